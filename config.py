@@ -9,6 +9,109 @@ load_dotenv()
 FUENTE_URL = os.getenv("FUENTE_URL", "")
 DESTINO_URL = os.getenv("DESTINO_URL", "")
 
+# Filas que se leen por viaje al servidor en las consultas por streaming
+TAMANO_LECTURA = int(os.getenv("SYNC_TAMANO_LECTURA", "10000"))
+
+# Filas por partición al extraer del origen; cada partición se procesa como un chunk
+TAMANO_PARTICION = int(os.getenv("SYNC_TAMANO_PARTICION", "5000"))
+
+# Por debajo de este número de claves se consulta el destino fila por fila en vez de por rango
+UMBRAL_CONSULTA_INDIVIDUAL = int(os.getenv("SYNC_UMBRAL_CONSULTA_INDIVIDUAL", "20"))
+
+# Conexiones con las que se lee el origen a la vez, cada una un tramo de codprod (1 = una sola consulta).
+# Los límites de los tramos salen de MIN/MAX de codprod ("minmax") o de cuantiles muestreados del índice
+# ("muestreo"), que reparten las mismas filas a cada tramo aunque los codprod tengan huecos
+CONEXIONES_EXTRACCION = int(os.getenv("SYNC_CONEXIONES_EXTRACCION", "1"))
+LIMITES_EXTRACCION = os.getenv("SYNC_LIMITES_EXTRACCION", "muestreo")
+
+# Filas por sentencia INSERT ... ON DUPLICATE KEY UPDATE
+TAMANO_LOTE_ESCRITURA = int(os.getenv("SYNC_TAMANO_LOTE_ESCRITURA", "1000"))
+
+# Archivo local donde se guardan las marcas de agua del modo incremental
+ARCHIVO_ESTADO = os.getenv("SYNC_ARCHIVO_ESTADO", "estado_sync.json")
+
+# Cada cuántas horas el modo incremental hace una pasada completa para corregir desvíos
+HORAS_RECONCILIACION = float(os.getenv("SYNC_HORAS_RECONCILIACION", "24"))
+
+# Función de hash de las filas: legacy (SHA-256 de la concatenación original), sha256, blake2b o xxh3.
+# Al cambiarlo todas las huellas guardadas en destino dejan de coincidir: la siguiente ejecución
+# hace una pasada completa que las reescribe (el modo incremental la fuerza por sí solo).
+HASH_BACKEND = os.getenv("SYNC_HASH_BACKEND", "legacy")
+
+# Calcular la huella en la base fuente (solo legacy y sha256, y solo con una fuente MySQL; con otras
+# bases se calcula en Python): primero se leen pares (clave, hash) y las columnas completas solo de
+# las filas cuyo hash difiere del destino
+HASH_EN_ORIGEN = os.getenv("SYNC_HASH_EN_ORIGEN", "0").lower() in ("1", "true", "si", "sí", "yes")
+
+# Extraer las existencias con una consulta plana (columnas crudas, tasa e IVA leídos una vez)
+# y calcular los precios en Python en los workers, en vez de con la consulta anidada
+EXTRACCION_PLANA = os.getenv("SYNC_EXTRACCION_PLANA", "0").lower() in ("1", "true", "si", "sí", "yes")
+
+# Ante un cambio de tasa, el modo incremental revalúa los precios en divisas en el destino con un
+# UPDATE por sede en vez de hacer una pasada completa de existencias
+REVALUAR_POR_TASA = os.getenv("SYNC_REVALUAR_TASA", "1").lower() in ("1", "true", "si", "sí", "yes")
+
+# Tamaños de bloque de codprod, de mayor a menor, con los que la reconciliación acota las diferencias
+TAMANOS_BLOQUE_RECONCILIACION = [
+    int(tamano) for tamano in os.getenv("SYNC_BLOQUES_RECONCILIACION", "10000,1000,100").split(",")
+]
+
+# Qué hacer en una pasada completa con las filas del destino que ya no vienen del origen (productos
+# borrados, existencias que quedaron sin stock): "cero" (existencia/stock a 0), "borrar" o "no"
+BAJAS_PRODUCTOS = os.getenv("SYNC_BAJAS_PRODUCTOS", "cero")
+BAJAS_EXISTENCIAS = os.getenv("SYNC_BAJAS_EXISTENCIAS", "cero")
+
+# Si las bajas superan esta fracción de las filas del destino no se aplican (protege de un origen
+# vacío o a medias); se pueden revisar con --simular-bajas y subir el límite si son legítimas
+MAX_PROPORCION_BAJAS = float(os.getenv("SYNC_MAX_PROPORCION_BAJAS", "0.2"))
+
+# Sedes a sincronizar, separadas por comas: codsede=columna (columna de stock del origen principal:
+# stock, alm2 ... alm6) o codsede=url (base fuente propia de la sede, con su columna stock),
+# opcionalmente codsede=url|columna. Por ejemplo "1=stock,2=alm2,3=mysql+mysqlconnector://...".
+SEDES = os.getenv("SYNC_SEDES", "1=stock")
+
+# Archivos SQL de semillas del catálogo (INSERT de una fila por sentencia) que carga --cargar-semillas
+ARCHIVOS_SEMILLA = [
+    ruta.strip() for ruta in os.getenv("SYNC_ARCHIVOS_SEMILLA", "images.sql,subcategory.sql").split(",") if ruta.strip()
+]
+
+# Reporte de métricas de cada corrida (tiempos por etapa, sentencias, workers): se agrega una línea JSON
+# por corrida a SYNC_METRICAS_ARCHIVO (vacío lo desactiva) y, si SYNC_METRICAS_PROMETHEUS indica un
+# directorio, se escribe ahí sync_<corrida>.prom para el textfile collector de Prometheus
+METRICAS_ARCHIVO = os.getenv("SYNC_METRICAS_ARCHIVO", "metricas_sync.jsonl")
+METRICAS_PROMETHEUS = os.getenv("SYNC_METRICAS_PROMETHEUS", "")
+
+# Directorio de las instantáneas (codprod, hash) del destino que se guardan al terminar cada ejecución
+# y se abren con mmap en la siguiente (vacío las desactiva). Se validan contra el destino con checksums
+# por bloques de SYNC_BLOQUE_INSTANTANEA codprod; en los bloques que coinciden no se consulta el destino
+DIRECTORIO_INSTANTANEAS = os.getenv("SYNC_INSTANTANEAS", "instantaneas")
+TAMANO_BLOQUE_INSTANTANEA = int(os.getenv("SYNC_BLOQUE_INSTANTANEA", "10000"))
+
+# Servicio residente (--servicio): segundos entre micro-sincronizaciones y socket Unix local por el que
+# se le piden ciclos inmediatos, pasadas completas, su estado o que se detenga (vacío lo desactiva)
+INTERVALO_SERVICIO = float(os.getenv("SYNC_INTERVALO_SERVICIO", "60"))
+SOCKET_SERVICIO = os.getenv("SYNC_SOCKET_SERVICIO", "sync_servicio.sock")
+
+# Reintentos de un lote que falla por un error de conexión o del servidor (los lotes son UPSERT
+# idempotentes) y cada cuántos segundos como mucho se guarda el punto de control de una ejecución
+# en curso, desde el que --reanudar la retoma si se interrumpe
+REINTENTOS_LOTE = int(os.getenv("SYNC_REINTENTOS_LOTE", "2"))
+SEGUNDOS_PUNTO_CONTROL = float(os.getenv("SYNC_SEGUNDOS_PUNTO_CONTROL", "5"))
+
+# Procesos que procesan lotes en paralelo. La carga es sobre todo de espera a la base destino,
+# así que puede convenir usar más workers que núcleos
+NUM_WORKERS = int(os.getenv("SYNC_WORKERS", str(os.cpu_count() or 1)))
+
+# Filas por tarea enviada a los workers y máximo de tareas en vuelo antes de frenar al extractor
+TAMANO_LOTE = int(os.getenv("SYNC_TAMANO_LOTE", "1000"))
+MAX_LOTES_PENDIENTES = int(os.getenv("SYNC_MAX_LOTES_PENDIENTES", str(2 * NUM_WORKERS)))
+
+# Pool de conexiones de cada engine (uno por proceso y base de datos)
+POOL_SIZE = int(os.getenv("SYNC_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("SYNC_POOL_MAX_OVERFLOW", "10"))
+POOL_PRE_PING = os.getenv("SYNC_POOL_PRE_PING", "1").lower() in ("1", "true", "si", "sí", "yes")
+POOL_RECYCLE = int(os.getenv("SYNC_POOL_RECYCLE", "3600"))
+
 def configurar_logger():
     """Configura el logger para escribir en un archivo con la fecha actual."""
     fecha_actual = datetime.now().strftime('%Y-%m-%d')
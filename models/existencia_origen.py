@@ -1,23 +1,33 @@
-class ExistenciaOrigen:
-    def __init__(self, *args):
-        (
-            self.codprod,
-            self.nombre,
-            self.precio_original,
-            self.precio_final,
-            self.precio_divisas_original,
-            self.precio_divisas_final,
-            self.poriva,
-            self.preciomasiva,
-            self.montoiva,
-            self.tasa_cambio,
-            self.stock,
-            self.barras,
-            self.pactivo,
-            self.codlin,
-            self.lineas,
-            self.tiene_descuento,
-            self.precio_oferta,
-            self.descuento_porcentual,
-            # Añade más atributos si es necesario
-        ) = args
+from collections import namedtuple
+
+# Existencia de la consulta de origen con los precios ya calculados. Es una tupla con nombres:
+# sin __dict__ por instancia, se arma directo de la fila del driver con ExistenciaOrigen._make
+# y se serializa entre procesos como una tupla.
+class ExistenciaOrigen(namedtuple("ExistenciaOrigen", [
+    "codprod",
+    "nombre",
+    "precio_original",
+    "precio_final",
+    "precio_divisas_original",
+    "precio_divisas_final",
+    "poriva",
+    "preciomasiva",
+    "montoiva",
+    "tasa_cambio",
+    "stock",
+    "barras",
+    "pactivo",
+    "codlin",
+    "lineas",
+    "tiene_descuento",
+    "precio_oferta",
+    "descuento_porcentual",
+    # Añade más atributos si es necesario
+])):
+    __slots__ = ()
+
+# Fila cruda de la extracción plana (CONSULTA_EXISTENCIAS_PLANA), antes de calcular los precios
+ExistenciaCruda = namedtuple("ExistenciaCruda", [
+    "codprod", "nombre", "precio", "tipoiva", "encarte", "inicio", "final", "desc_oferta",
+    "codlin", "stock", "barras", "pactivo", "lineas", "descuento",
+])
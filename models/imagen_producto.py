@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String, DateTime, BOOLEAN
+from sqlalchemy.ext.declarative import declarative_base
+
+# Declarative base para definir las clases ORM
+Base = declarative_base()
+
+class ImagenProducto(Base):
+    __tablename__ = 'product_images'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    product_codprod = Column(Integer, nullable=False)
+    url = Column(String(255), nullable=False)
+    altname = Column(String(255))
+    is_primary = Column(BOOLEAN, default=False)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+    def __repr__(self):
+        return f"<ImagenProducto(id={self.id}, product_codprod={self.product_codprod}, url={self.url})>"
@@ -0,0 +1,72 @@
+from itertools import chain, islice
+
+# Filas que se trasponen de cada vez al armar un lote: solo ese bloque de filas del driver está en
+# memoria a la vez junto a las columnas, en vez de todas las filas del resultado
+FILAS_POR_BLOQUE = 10000
+
+class LoteColumnas:
+    """
+    Lote de filas guardado por columnas: una tupla de valores por campo en vez de una tupla por
+    fila. Se arma por bloques con zip(*bloque) sobre las filas del driver, sin recorrerlas una a
+    una en Python, y ahorra la cabecera de una tupla por fila al retener el catálogo completo.
+    Al iterarlo devuelve las filas como tuplas simples, en el orden de campos.
+    """
+    __slots__ = ("campos", "columnas")
+
+    def __init__(self, campos, columnas):
+        self.campos = tuple(campos)
+        self.columnas = tuple(columnas)
+
+    @classmethod
+    def desde_filas(cls, campos, filas):
+        """
+        Traspone las filas (tuplas o Row del driver, en el orden de campos) a columnas, de
+        FILAS_POR_BLOQUE en FILAS_POR_BLOQUE: las columnas crecen mientras se leen las filas.
+        """
+        campos = tuple(campos)
+        columnas = [[] for _ in campos]
+        filas = iter(filas)
+        while True:
+            bloque = list(islice(filas, FILAS_POR_BLOQUE))
+            if not bloque:
+                break
+            for columna, valores in zip(columnas, zip(*bloque)):
+                columna.extend(valores)
+        # Cada lista se libera en cuanto se copia a su tupla
+        for i, columna in enumerate(columnas):
+            columnas[i] = tuple(columna)
+        return cls(campos, columnas)
+
+    @classmethod
+    def concatenar(cls, campos, lotes):
+        """Une lotes de los mismos campos, uno detrás de otro, en un solo lote."""
+        lotes = [lote for lote in lotes if lote]
+        if len(lotes) == 1:
+            return lotes[0]
+        columnas = tuple(tuple(chain.from_iterable(lote.columnas[i] for lote in lotes)) for i in range(len(campos)))
+        return cls(campos, columnas)
+
+    def columna(self, campo):
+        """Todos los valores de un campo, en el orden de las filas."""
+        return self.columnas[self.campos.index(campo)]
+
+    def filas(self, tipo=None):
+        """Itera las filas; con tipo (una namedtuple de los mismos campos) las devuelve como ese tipo."""
+        filas = zip(*self.columnas)
+        return map(tipo._make, filas) if tipo is not None else filas
+
+    def __iter__(self):
+        return self.filas()
+
+    def __getitem__(self, indice):
+        """Fila indice como tupla (acceso puntual; para recorrer el lote conviene iterarlo)."""
+        return tuple(columna[indice] for columna in self.columnas)
+
+    def __len__(self):
+        return len(self.columnas[0]) if self.columnas else 0
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __repr__(self):
+        return f"<LoteColumnas(campos={len(self.campos)}, filas={len(self)})>"
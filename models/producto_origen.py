@@ -1,3 +1,5 @@
+from collections import namedtuple
+
 from sqlalchemy import create_engine, Column, Integer, String, Float, DECIMAL, Date, DateTime
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -112,3 +114,10 @@ class ProductoOrigen(Base):
 
     def __repr__(self):
         return f"<ProductoOrigen(codprod={self.codprod}, nombre={self.nombre}, precio={self.precio}, stock={self.stock})>"
+
+# Fila con solo los campos del producto que usa la sincronización. Es una tupla: se serializa
+# entre procesos sin el estado de SQLAlchemy ni el resto de columnas de la tabla.
+ProductoProyectado = namedtuple(
+    "ProductoProyectado",
+    ["codprod", "nombre", "precio", "stock", "pactivo", "codmarca", "codbarra01"],
+)
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer
+from sqlalchemy.ext.declarative import declarative_base
+
+# Declarative base para definir las clases ORM
+Base = declarative_base()
+
+class ProductoSubcategoria(Base):
+    __tablename__ = 'product_subcategory_association'
+
+    # Campos clave primaria
+    product_id = Column(Integer, primary_key=True)
+    subcategory_id = Column(Integer, primary_key=True)
+
+    def __repr__(self):
+        return f"<ProductoSubcategoria(product_id={self.product_id}, subcategory_id={self.subcategory_id})>"
@@ -1,6 +1,88 @@
-from sync_existencia import sincronizar_existencias
+import argparse
+import json
+
+from sync_async import sincronizar_async
+from sync_conjunta import sincronizar_conjunta
+from sync_existencia import revaluar, sincronizar_existencias
 from sync_products import sincronizar_productos
+from sync_reconciliacion import reconciliar
+from sync_semillas import cargar_semillas
+from sync_servicio import COMANDOS_SERVICIO, enviar_comando, servir
 
 if __name__ == "__main__":
-    sincronizar_productos()
-    sincronizar_existencias()
+    parser = argparse.ArgumentParser(description="Sincroniza productos y existencias con el ecommerce.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Solo lee las filas que pudieron cambiar desde la última ejecución (con reconciliación completa periódica).",
+    )
+    parser.add_argument(
+        "--reconciliar",
+        action="store_true",
+        help="Compara checksums por rangos de codprod y sincroniza solo los rangos que difieren.",
+    )
+    parser.add_argument(
+        "--asincrono",
+        action="store_true",
+        help="Sincroniza productos y existencias a la vez con un pipeline asíncrono (lectura, diferencias y escritura solapadas).",
+    )
+    parser.add_argument(
+        "--conjunta",
+        action="store_true",
+        help="Lee el catálogo fuente una sola vez y sincroniza con esa lectura productos y existencias de las sedes de la base principal.",
+    )
+    parser.add_argument(
+        "--revaluar",
+        action="store_true",
+        help="Si cambió la tasa de cambio, recalcula los precios en divisas del destino sin resincronizar existencias.",
+    )
+    parser.add_argument(
+        "--simular-bajas",
+        action="store_true",
+        help="En las pasadas completas solo informa cuántas filas del destino se darían de baja, sin aplicarlas.",
+    )
+    parser.add_argument(
+        "--cargar-semillas",
+        action="store_true",
+        help="Carga en el destino los archivos SQL de imágenes y subcategorías (SYNC_ARCHIVOS_SEMILLA) en lotes multi-fila.",
+    )
+    parser.add_argument(
+        "--generar-imagenes",
+        action="store_true",
+        help="Crea la imagen principal de los productos del destino que no tienen ninguna (se puede combinar con --cargar-semillas).",
+    )
+    parser.add_argument(
+        "--reanudar",
+        action="store_true",
+        help="Retoma desde su punto de control las sincronizaciones de productos y sedes que se interrumpieron, sin repetir lo ya confirmado.",
+    )
+    parser.add_argument(
+        "--servicio",
+        action="store_true",
+        help="Queda residente y sincroniza en modo incremental cada SYNC_INTERVALO_SERVICIO segundos, "
+        "o antes si se le pide por SIGUSR1 (SIGUSR2: pasada completa) o por el socket SYNC_SOCKET_SERVICIO.",
+    )
+    parser.add_argument(
+        "--comando-servicio",
+        choices=COMANDOS_SERVICIO,
+        help="Envía una orden al servicio en ejecución y muestra su respuesta.",
+    )
+    args = parser.parse_args()
+
+    if args.comando_servicio:
+        print(json.dumps(enviar_comando(args.comando_servicio), ensure_ascii=False, indent=2))
+    elif args.servicio:
+        servir(simular_bajas=args.simular_bajas)
+    elif args.cargar_semillas or args.generar_imagenes:
+        cargar_semillas(rutas=None if args.cargar_semillas else [], generar_imagenes=args.generar_imagenes)
+    elif args.reconciliar:
+        reconciliar()
+    elif args.revaluar:
+        revaluar()
+    elif args.asincrono:
+        sincronizar_async()
+    elif args.conjunta:
+        sincronizar_conjunta(incremental=args.incremental, simular_bajas=args.simular_bajas, reanudar=args.reanudar)
+    else:
+        sincronizar_productos(incremental=args.incremental, simular_bajas=args.simular_bajas, reanudar=args.reanudar)
+        sincronizar_existencias(incremental=args.incremental, simular_bajas=args.simular_bajas, reanudar=args.reanudar)
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from config import FUENTE_URL, DESTINO_URL, MAX_LOTES_PENDIENTES, NUM_WORKERS, TAMANO_LOTE, configurar_logger
+from models.existencia_origen import ExistenciaOrigen
+from models.existencia_sede import ExistenciaSede
+from models.producto_destino import Producto
+from models.producto_origen import ProductoProyectado
+from sync_diff import calcular_diferencias
+from sync_huella import validar_backend
+from sync_metricas import exportar_reporte, instrumentar_engine, reiniciar_metricas
+from sync_sedes import SEDE_PRINCIPAL, cargar_sedes
+from sync_manager import (
+    COLUMNAS_UPSERT_EXISTENCIA,
+    COLUMNAS_UPSERT_PRODUCTO,
+    consulta_hashes_existencias_destino,
+    consulta_hashes_productos_destino,
+    consulta_productos_origen,
+    filas_upsert_existencias,
+    filas_upsert_productos,
+)
+from sync_worker import obtener_sync_manager
+from sync_writer import escribir_upsert_async
+import sync_existencia
+import sync_products
+
+# Drivers asíncronos que reemplazan al driver síncrono de cada URL
+DRIVERS_ASYNC = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+# Señal de fin de una cola; cada trabajador la vuelve a encolar para el siguiente
+_FIN = object()
+
+def url_async(url):
+    """Convierte una URL síncrona (mysql+mysqlconnector://, sqlite://) a su driver asíncrono."""
+    url = make_url(url)
+    return url.set(drivername=DRIVERS_ASYNC[url.get_backend_name()])
+
+def crear_engine_async(url):
+    engine = create_async_engine(url_async(url), pool_pre_ping=True)
+    # Los eventos de sentencias se registran en el engine síncrono que envuelve el asíncrono
+    instrumentar_engine(engine.sync_engine)
+    return engine
+
+async def _etapa(cola_entrada, procesar, concurrencia, cola_salida=None):
+    """
+    Consume cola_entrada con varios trabajadores concurrentes y, si hay cola_salida,
+    encola lo que devuelve procesar. Al terminar propaga la señal de fin.
+    """
+    async def trabajador():
+        while True:
+            item = await cola_entrada.get()
+            if item is _FIN:
+                await cola_entrada.put(_FIN)
+                return
+            resultado = await procesar(item)
+            if cola_salida is not None:
+                await cola_salida.put(resultado)
+
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    if cola_salida is not None:
+        await cola_salida.put(_FIN)
+
+async def _ejecutar_pipeline(extraer, diferenciar, escribir):
+    """
+    Conecta extracción -> diferencias -> escritura con colas acotadas: cada etapa avanza
+    mientras las demás esperan a la base de datos, y ninguna se adelanta más de
+    MAX_LOTES_PENDIENTES lotes a la siguiente.
+    """
+    cola_extraidos = asyncio.Queue(maxsize=MAX_LOTES_PENDIENTES)
+    cola_cambios = asyncio.Queue(maxsize=MAX_LOTES_PENDIENTES)
+
+    async def extractor():
+        async for lote in extraer():
+            await cola_extraidos.put(lote)
+        await cola_extraidos.put(_FIN)
+
+    tareas = [
+        asyncio.create_task(extractor()),
+        asyncio.create_task(_etapa(cola_extraidos, diferenciar, NUM_WORKERS, cola_cambios)),
+        asyncio.create_task(_etapa(cola_cambios, escribir, NUM_WORKERS)),
+    ]
+    try:
+        await asyncio.gather(*tareas)
+    except BaseException:
+        for tarea in tareas:
+            tarea.cancel()
+        raise
+
+async def pipeline_productos(engine_fuente, engine_destino):
+    """Sincroniza productos con extracción, diferencias y escritura solapadas. Devuelve (actualizados, nuevos)."""
+    totales = {"actualizados": 0, "nuevos": 0}
+
+    async def extraer():
+        async with engine_fuente.connect() as conexion:
+            query = consulta_productos_origen().execution_options(yield_per=TAMANO_LOTE)
+            resultado = await conexion.stream(query)
+            async for particion in resultado.partitions(TAMANO_LOTE):
+                yield list(map(ProductoProyectado._make, particion))
+
+    async def diferenciar(lote):
+        codprods = [producto.codprod for producto in lote]
+        async with engine_destino.connect() as conexion:
+            resultado = await conexion.execute(consulta_hashes_productos_destino(min(codprods), max(codprods)))
+            indice_destino = dict(resultado.all())
+        # El cálculo de hashes es CPU: se saca del event loop
+        return await asyncio.to_thread(lambda: calcular_diferencias(
+            lote,
+            indice_destino,
+            sync_products.obtener_clave,
+            sync_products.calcular_hash,
+            hashes=sync_products.calcular_hashes(lote),
+        ))
+
+    async def escribir(diferencias):
+        filas = filas_upsert_productos(diferencias.nuevos, diferencias.actualizados)
+        if filas:
+            async with engine_destino.begin() as conexion:
+                await escribir_upsert_async(conexion, Producto.__table__, filas, COLUMNAS_UPSERT_PRODUCTO)
+        totales["actualizados"] += len(diferencias.actualizados)
+        totales["nuevos"] += len(diferencias.nuevos)
+
+    await _ejecutar_pipeline(extraer, diferenciar, escribir)
+    return totales["actualizados"], totales["nuevos"]
+
+async def pipeline_existencias(engine_fuente, engine_destino, sede=SEDE_PRINCIPAL):
+    """Sincroniza las existencias de una sede con extracción, diferencias y escritura solapadas. Devuelve (actualizadas, nuevas)."""
+    totales = {"actualizadas": 0, "nuevas": 0}
+    codsede = sede.codsede
+    consulta, parametros = obtener_sync_manager(sede.fuente_url).consulta_existencias_origen(columna_stock=sede.columna_stock)
+
+    def obtener_clave(existencia):
+        return sync_existencia.obtener_clave(existencia, codsede)
+
+    async def extraer():
+        async with engine_fuente.connect() as conexion:
+            resultado = await conexion.stream(text(consulta + "ORDER BY codprod"), parametros)
+            async for particion in resultado.partitions(TAMANO_LOTE):
+                yield list(map(ExistenciaOrigen._make, particion))
+
+    async def diferenciar(lote):
+        codprods = [existencia.codprod for existencia in lote]
+        async with engine_destino.connect() as conexion:
+            resultado = await conexion.execute(consulta_hashes_existencias_destino(codsede, min(codprods), max(codprods)))
+            indice_destino = {(codprod, sede): hash_destino for codprod, sede, hash_destino in resultado}
+        return await asyncio.to_thread(lambda: calcular_diferencias(
+            lote,
+            indice_destino,
+            obtener_clave,
+            sync_existencia.calcular_hash,
+            hashes=sync_existencia.calcular_hashes(lote),
+        ))
+
+    async def escribir(diferencias):
+        filas = filas_upsert_existencias(diferencias.nuevos, diferencias.actualizados, codsede)
+        if filas:
+            async with engine_destino.begin() as conexion:
+                await escribir_upsert_async(conexion, ExistenciaSede.__table__, filas, COLUMNAS_UPSERT_EXISTENCIA)
+        totales["actualizadas"] += len(diferencias.actualizados)
+        totales["nuevas"] += len(diferencias.nuevos)
+
+    await _ejecutar_pipeline(extraer, diferenciar, escribir)
+    return totales["actualizadas"], totales["nuevas"]
+
+async def _sincronizar_async(fuente_url, destino_url, sedes):
+    engines_fuente = {None: crear_engine_async(fuente_url)}
+    for sede in sedes:
+        if sede.fuente_url not in engines_fuente:
+            engines_fuente[sede.fuente_url] = crear_engine_async(sede.fuente_url)
+    engine_destino = crear_engine_async(destino_url)
+    try:
+        # Productos y las existencias de cada sede corren a la vez sobre los mismos pools
+        productos, *existencias = await asyncio.gather(
+            pipeline_productos(engines_fuente[None], engine_destino),
+            *(pipeline_existencias(engines_fuente[sede.fuente_url], engine_destino, sede) for sede in sedes),
+        )
+        return productos, (
+            sum(actualizadas for actualizadas, _ in existencias),
+            sum(nuevas for _, nuevas in existencias),
+        )
+    finally:
+        for engine_fuente in engines_fuente.values():
+            await engine_fuente.dispose()
+        await engine_destino.dispose()
+
+def sincronizar_async(fuente_url=FUENTE_URL, destino_url=DESTINO_URL):
+    """
+    Sincroniza productos y las existencias de todas las sedes en modo asíncrono (aiomysql / aiosqlite): la lectura del
+    origen, el cálculo de diferencias y la escritura en destino se solapan, de modo que el tiempo
+    total se acerca al de la etapa más lenta. Siempre hace una pasada completa.
+    """
+    inicio = time.time()
+    configurar_logger()
+    reiniciar_metricas()
+
+    try:
+        logging.info("Iniciando la sincronización asíncrona de productos y existencias...")
+        validar_backend()
+
+        (productos_actualizados, productos_nuevos), (existencias_actualizadas, existencias_nuevas) = asyncio.run(
+            _sincronizar_async(fuente_url, destino_url, cargar_sedes())
+        )
+
+        fin = time.time()
+        logging.info("Sincronización asíncrona completada.")
+        logging.info(f"  Productos actualizados: {productos_actualizados}")
+        logging.info(f"  Productos nuevos: {productos_nuevos}")
+        logging.info(f"  Existencias actualizadas: {existencias_actualizadas}")
+        logging.info(f"  Existencias nuevas: {existencias_nuevas}")
+        logging.info(f"  Hora de inicio: {datetime.fromtimestamp(inicio).strftime('%Y-%m-%d %H:%M:%S')}")
+        logging.info(f"  Hora de finalización: {datetime.fromtimestamp(fin).strftime('%Y-%m-%d %H:%M:%S')}")
+        logging.info(f"  Duración del proceso: {fin - inicio:.2f} segundos")
+        exportar_reporte("asincrono", inicio, {
+            "productos_actualizados": productos_actualizados,
+            "productos_nuevos": productos_nuevos,
+            "existencias_actualizadas": existencias_actualizadas,
+            "existencias_nuevas": existencias_nuevas,
+        })
+
+    except Exception as e:
+        logging.error(f"Error durante la sincronización asíncrona: {str(e)}")
+
+if __name__ == "__main__":
+    sincronizar_async()
@@ -0,0 +1,98 @@
+import logging
+
+from config import BAJAS_EXISTENCIAS, BAJAS_PRODUCTOS, MAX_PROPORCION_BAJAS, TAMANO_LOTE_ESCRITURA
+
+# "cero" deja la fila con stock/existencia 0, "borrar" la elimina y "no" desactiva la etapa
+MODOS_BAJA = ("cero", "borrar", "no")
+
+def registrar_claves(filas, claves):
+    """Deja pasar las filas de la extracción anotando su codprod (primera columna) en claves."""
+    for fila in filas:
+        claves.add(fila[0])
+        yield fila
+
+def filtrar_desde(claves, desde_codprod=None):
+    """Las claves posteriores a desde_codprod (todas si es None)."""
+    if desde_codprod is None:
+        return claves
+    return {clave for clave in claves if clave > desde_codprod}
+
+def calcular_bajas(claves_origen, claves_destino):
+    """Claves del destino que ya no están en el origen (anti-join de los dos conjuntos), ordenadas."""
+    return sorted(claves_destino - claves_origen)
+
+def aplicar_bajas(descripcion, bajas, total_destino, dar_de_baja, session_destino, modo, simular=False):
+    """
+    Aplica las bajas en lotes de TAMANO_LOTE_ESCRITURA claves con dar_de_baja(session, lote, borrar),
+    confirmando cada lote. Con simular solo informa cuántas serían. No aplica nada si superan
+    MAX_PROPORCION_BAJAS de las filas del destino. Devuelve el número de filas dadas de baja.
+    """
+    if modo not in MODOS_BAJA:
+        raise ValueError(f"Modo de bajas no válido para {descripcion}: {modo}")
+    if modo == "no" or not bajas:
+        return 0
+
+    accion = "borrarían" if modo == "borrar" else "pondrían en 0"
+    if simular:
+        logging.info(f"  Simulación de bajas de {descripcion}: se {accion} {len(bajas)} de {total_destino} filas.")
+        return 0
+
+    if len(bajas) > MAX_PROPORCION_BAJAS * total_destino:
+        logging.error(
+            f"  Se omiten las bajas de {descripcion}: {len(bajas)} de {total_destino} filas supera "
+            f"SYNC_MAX_PROPORCION_BAJAS={MAX_PROPORCION_BAJAS}; revíselas con --simular-bajas."
+        )
+        return 0
+
+    total = 0
+    for inicio in range(0, len(bajas), TAMANO_LOTE_ESCRITURA):
+        total += dar_de_baja(session_destino, bajas[inicio:inicio + TAMANO_LOTE_ESCRITURA], modo == "borrar")
+        session_destino.commit()
+    logging.info(f"  Bajas de {descripcion}: {total} filas ({modo}).")
+    return total
+
+def procesar_bajas_productos(sync_manager, claves_origen, simular=False, modo=None, desde_codprod=None):
+    """
+    Da de baja los productos del destino que no aparecieron en una pasada completa del origen.
+    Una pasada completa reanudada solo leyó los codprod posteriores a desde_codprod: solo esos se comparan.
+    """
+    modo = modo or BAJAS_PRODUCTOS
+    if modo == "no":
+        return 0
+    session_destino = sync_manager.iniciar_sesion_destino()
+    try:
+        # Con "cero" las que ya están en 0 no cuentan como bajas nuevas
+        claves_destino = filtrar_desde(
+            sync_manager.obtener_codprods_destino(session_destino, solo_con_stock=modo == "cero"), desde_codprod
+        )
+        bajas = calcular_bajas(claves_origen, claves_destino)
+        return aplicar_bajas(
+            "productos", bajas, len(claves_destino), sync_manager.bajas_productos_destino, session_destino, modo, simular
+        )
+    finally:
+        session_destino.close()
+
+def procesar_bajas_existencias(sync_manager, codsede, claves_origen, simular=False, modo=None, desde_codprod=None):
+    """
+    Da de baja las existencias de la sede que no aparecieron (sin stock) en una pasada completa del
+    origen; si se reanudó, solo entre los codprod posteriores a desde_codprod.
+    """
+    modo = modo or BAJAS_EXISTENCIAS
+    if modo == "no":
+        return 0
+    session_destino = sync_manager.iniciar_sesion_destino()
+    try:
+        claves_destino = filtrar_desde(
+            sync_manager.obtener_codprods_existencias_destino(session_destino, codsede, solo_con_existencia=modo == "cero"),
+            desde_codprod,
+        )
+        bajas = calcular_bajas(claves_origen, claves_destino)
+
+        def dar_de_baja(session, codprods, borrar):
+            return sync_manager.bajas_existencias_destino(session, codsede, codprods, borrar)
+
+        return aplicar_bajas(
+            f"existencias de la sede {codsede}", bajas, len(claves_destino), dar_de_baja, session_destino, modo, simular
+        )
+    finally:
+        session_destino.close()
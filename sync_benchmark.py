@@ -0,0 +1,408 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from multiprocessing import Value
+
+from sqlalchemy import DECIMAL, REAL, Column, Date, Integer, MetaData, Table, bindparam, create_engine, event, func, insert, select, update
+from sqlalchemy.engine import Engine
+
+from models.existencia_sede import Base as BaseExistencias, ExistenciaSede
+from models.producto_destino import Base as BaseDestino, Producto
+from models.producto_origen import Base as BaseOrigen, ProductoOrigen
+
+# Variantes que se comparan: motor ("procesos" = sincronizar_productos + sincronizar_existencias con
+# el pool, "asincrono" = sincronizar_async) y variables de entorno que la configuran
+VARIANTES = {
+    "base": ("procesos", {}),
+    "hash_origen": ("procesos", {"SYNC_HASH_EN_ORIGEN": "1"}),
+    "plana": ("procesos", {"SYNC_EXTRACCION_PLANA": "1"}),
+    "asincrono": ("asincrono", {}),
+}
+
+# Filas por INSERT al generar el fixture
+TAMANO_LOTE_FIXTURE = 5000
+
+# Porcentajes y tasa de las tablas auxiliares. SQLite guarda un DECIMAL sin decimales (10, 16) como
+# entero y la consulta anidada dividiría descuento / 100 o iva / 100 en enteros: ahí se declaran REAL
+PORCENTAJE = DECIMAL(5, 2).with_variant(REAL(), "sqlite")
+TASA = DECIMAL(18, 4).with_variant(REAL(), "sqlite")
+
+# Tablas auxiliares del origen que lee la consulta de existencias y no tienen modelo ORM
+metadata_auxiliar = MetaData()
+Table("lineas", metadata_auxiliar, Column("keycodigo", Integer, primary_key=True), Column("descuento", PORCENTAJE))
+Table("monedas", metadata_auxiliar, Column("tasa_cambio", TASA), Column("esrefprecio", Integer))
+Table(
+    "areas", metadata_auxiliar,
+    Column("iva", PORCENTAJE), Column("ivareducido", PORCENTAJE), Column("tasa3", PORCENTAJE),
+)
+
+# Sentencias ejecutadas por todos los procesos de la corrida. Los workers del pool la heredan al
+# hacer fork (el método de inicio por defecto en Linux) junto con el listener que la incrementa.
+_consultas = Value("q", 0)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _contar_consulta(conexion, cursor, sentencia, parametros, contexto, executemany):
+    with _consultas.get_lock():
+        _consultas.value += 1
+
+class _BitXor:
+    def __init__(self):
+        self.valor = 0
+
+    def step(self, valor):
+        if valor is not None:
+            self.valor ^= int(valor)
+
+    def finalize(self):
+        return self.valor
+
+@event.listens_for(Engine, "connect")
+def _funciones_mysql(conexion_dbapi, registro):
+    """Registra en las conexiones SQLite las funciones de MySQL que usan las consultas del origen."""
+    if not hasattr(conexion_dbapi, "create_function"):
+        return
+    conexion_dbapi.create_function("CURDATE", 0, lambda: date.today().isoformat())
+    conexion_dbapi.create_function("IF", 3, lambda condicion, si, no: si if condicion else no)
+    conexion_dbapi.create_function(
+        "CONCAT", -1, lambda *valores: None if None in valores else "".join(str(valor) for valor in valores)
+    )
+    conexion_dbapi.create_function(
+        "CONCAT_WS", -1, lambda separador, *valores: separador.join(str(valor) for valor in valores if valor is not None)
+    )
+    conexion_dbapi.create_function(
+        "SHA2", 2, lambda valor, bits: None if valor is None else hashlib.sha256(str(valor).encode()).hexdigest()
+    )
+    conexion_dbapi.create_function("CRC32", 1, lambda valor: None if valor is None else zlib.crc32(str(valor).encode()))
+    # El adaptador de aiosqlite no expone create_aggregate; BIT_XOR solo lo usa la reconciliación
+    if hasattr(conexion_dbapi, "create_aggregate"):
+        conexion_dbapi.create_aggregate("BIT_XOR", 1, _BitXor)
+
+class _ContadorErrores(logging.Handler):
+    """Cuenta los errores registrados: los sincronizadores los capturan y solo los dejan en el log."""
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.errores = 0
+
+    def emit(self, registro):
+        self.errores += 1
+
+# Fechas por defecto del modelo de origen como date: vienen como texto y SQLite solo acepta date
+FECHAS_POR_DEFECTO = {
+    columna.name: date.fromisoformat(columna.default.arg)
+    for columna in ProductoOrigen.__table__.columns
+    if isinstance(columna.type, Date) and columna.default is not None and isinstance(columna.default.arg, str)
+}
+
+def _producto_sintetico(aleatorio, codprod, hoy):
+    """Fila de productos del origen con precios, stock en varios almacenes, IVA y ofertas variados."""
+    en_oferta = aleatorio.random() < 0.2
+    return {
+        **FECHAS_POR_DEFECTO,
+        "keycodigo": codprod,
+        "codprod": codprod,
+        "nombre": f"PRODUCTO SINTETICO {codprod}",
+        "precio": Decimal(aleatorio.randint(100, 100000)) / 100,
+        "stock": Decimal(aleatorio.randint(1, 500)) if aleatorio.random() < 0.85 else Decimal(0),
+        "alm2": Decimal(aleatorio.randint(0, 50)),
+        "alm3": Decimal(aleatorio.randint(0, 50)),
+        "tipoIva": aleatorio.choice(["NORMAL", "REDUCIDO", "TASA3", "EXENTO"]),
+        "encarte": Decimal(1) if en_oferta else Decimal(0),
+        "desc_oferta": Decimal(aleatorio.randint(50, 5000)) / 100 if en_oferta else Decimal(0),
+        "inicio": hoy - timedelta(days=aleatorio.randint(0, 5)),
+        "final": hoy + timedelta(days=aleatorio.randint(0, 5)),
+        "codlin": aleatorio.randint(1, 50),
+        "lineas": "LINEA",
+        "pactivo": "PRINCIPIO ACTIVO",
+        "codmarca": aleatorio.randint(1, 20),
+        "CODBARRA01": f"{759000000000 + codprod}",
+        "ucambio_precio": date(2020, 1, 1),
+        "ultventa": date(2020, 1, 1),
+    }
+
+def generar_fixture(fuente_url, destino_url, filas, semilla=1):
+    """
+    Crea desde cero las tablas del origen (productos, lineas, monedas, areas) con filas productos
+    sintéticos y las del destino (productos, existencias_sede) vacías. Con la misma semilla genera
+    siempre los mismos datos.
+    """
+    aleatorio = random.Random(semilla)
+    hoy = date.today()
+
+    engine_fuente = create_engine(fuente_url)
+    for metadata in (BaseOrigen.metadata, metadata_auxiliar):
+        metadata.drop_all(engine_fuente)
+        metadata.create_all(engine_fuente)
+    with engine_fuente.begin() as conexion:
+        conexion.execute(insert(metadata_auxiliar.tables["monedas"]), [{"tasa_cambio": Decimal("36.55"), "esrefprecio": 1}])
+        conexion.execute(
+            insert(metadata_auxiliar.tables["areas"]),
+            [{"iva": Decimal(16), "ivareducido": Decimal(8), "tasa3": Decimal(0)}],
+        )
+        conexion.execute(
+            insert(metadata_auxiliar.tables["lineas"]),
+            [
+                {"keycodigo": codlin, "descuento": Decimal(aleatorio.choice([0, 0, 5, 10, 12.5]))}
+                for codlin in range(1, 51)
+            ],
+        )
+    for inicio in range(1, filas + 1, TAMANO_LOTE_FIXTURE):
+        lote = [_producto_sintetico(aleatorio, codprod, hoy) for codprod in range(inicio, min(inicio + TAMANO_LOTE_FIXTURE, filas + 1))]
+        with engine_fuente.begin() as conexion:
+            conexion.execute(insert(ProductoOrigen), lote)
+    engine_fuente.dispose()
+
+    engine_destino = create_engine(destino_url)
+    for metadata in (BaseDestino.metadata, BaseExistencias.metadata):
+        metadata.drop_all(engine_destino)
+        metadata.create_all(engine_destino)
+    engine_destino.dispose()
+
+def aplicar_cambios(fuente_url, proporcion, semilla=1):
+    """
+    Modifica en el origen una fracción proporcion de los productos (precio, stock y fecha de cambio
+    de precio, como lo haría el sistema administrativo) y agrega un 5 % de esa cantidad como nuevos.
+    Devuelve (modificados, nuevos).
+    """
+    aleatorio = random.Random(semilla)
+    hoy = date.today()
+    engine_fuente = create_engine(fuente_url)
+    with engine_fuente.begin() as conexion:
+        codprods = conexion.execute(select(ProductoOrigen.codprod)).scalars().all()
+        cambiados = aleatorio.sample(codprods, int(len(codprods) * proporcion))
+        if cambiados:
+            conexion.execute(
+                update(ProductoOrigen)
+                .where(ProductoOrigen.codprod == bindparam("b_codprod"))
+                .values(precio=bindparam("b_precio"), stock=bindparam("b_stock"), ucambio_precio=hoy),
+                [
+                    {
+                        "b_codprod": codprod,
+                        "b_precio": Decimal(aleatorio.randint(100, 100000)) / 100,
+                        "b_stock": Decimal(aleatorio.randint(0, 500)),
+                    }
+                    for codprod in cambiados
+                ],
+            )
+        siguiente = max(codprods, default=0) + 1
+        nuevos = [_producto_sintetico(aleatorio, codprod, hoy) for codprod in range(siguiente, siguiente + len(cambiados) // 20)]
+        if nuevos:
+            conexion.execute(insert(ProductoOrigen), nuevos)
+    engine_fuente.dispose()
+    return len(cambiados), len(nuevos)
+
+def _contar(url, consulta):
+    engine = create_engine(url)
+    with engine.connect() as conexion:
+        total = conexion.execute(consulta).scalar()
+    engine.dispose()
+    return total
+
+def _huella_precios(url):
+    """SHA-256 de los precio_final del destino por (codprod, codsede), para comparar las variantes entre sí."""
+    engine = create_engine(url)
+    huella = hashlib.sha256()
+    with engine.connect() as conexion:
+        consulta = select(ExistenciaSede.product_codprod, ExistenciaSede.codsede, ExistenciaSede.precio_final).order_by(
+            ExistenciaSede.product_codprod, ExistenciaSede.codsede
+        )
+        for codprod, codsede, precio_final in conexion.execute(consulta):
+            huella.update(f"{codprod}|{codsede}|{precio_final}\n".encode())
+    engine.dispose()
+    return huella.hexdigest()
+
+def _rss_maximo():
+    """Pico de memoria residente en KiB del proceso y de sus hijos ya terminados (los workers)."""
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+def medir_escenario(nombre, etapas, fuente_url, destino_url):
+    """
+    Corre las etapas [(nombre, función)] de un escenario y devuelve su tiempo por etapa, filas por
+    segundo, sentencias ejecutadas, errores registrados y pico de memoria, más las filas que quedaron
+    en el destino para validar la corrida.
+    """
+    filas_origen = _contar(fuente_url, select(func.count()).select_from(ProductoOrigen))
+    existencias_origen = _contar(fuente_url, select(func.count()).select_from(ProductoOrigen).where(ProductoOrigen.stock > 0))
+
+    contador = _ContadorErrores()
+    logging.getLogger().addHandler(contador)
+    consultas_inicio = _consultas.value
+    inicio = time.perf_counter()
+    tiempos = {}
+    try:
+        for etapa, funcion in etapas:
+            inicio_etapa = time.perf_counter()
+            funcion()
+            tiempos[etapa] = round(time.perf_counter() - inicio_etapa, 4)
+    finally:
+        logging.getLogger().removeHandler(contador)
+    segundos = time.perf_counter() - inicio
+    rss, rss_workers = _rss_maximo()
+
+    return {
+        "escenario": nombre,
+        "segundos": round(segundos, 4),
+        "etapas": tiempos,
+        "filas_origen": filas_origen + existencias_origen,
+        "filas_por_segundo": round((filas_origen + existencias_origen) / segundos, 1) if segundos else None,
+        "consultas": _consultas.value - consultas_inicio,
+        "errores": contador.errores,
+        "rss_max_kib": rss,
+        "rss_max_workers_kib": rss_workers,
+        "filas_destino": {
+            "productos": _contar(destino_url, select(func.count()).select_from(Producto)),
+            "existencias": _contar(destino_url, select(func.count()).select_from(ExistenciaSede)),
+        },
+    }
+
+def ejecutar_variante(motor, fuente_url, destino_url, filas, proporcion, semilla=1):
+    """
+    Corre una variante sobre un fixture nuevo: carga inicial, pasada sin cambios, pasada completa
+    tras modificar una proporción del origen y, con el motor de procesos, una pasada incremental
+    tras otra ronda de cambios. Debe correr en un proceso propio, con la configuración de la
+    variante ya en las variables de entorno (config la lee al importarse).
+    """
+    # Se importan aquí para que el proceso padre no fije la configuración al importar este módulo
+    from sync_async import sincronizar_async
+    from sync_existencia import sincronizar_existencias
+    from sync_products import sincronizar_productos
+
+    inicio_fixture = time.perf_counter()
+    generar_fixture(fuente_url, destino_url, filas, semilla)
+    resultado = {"motor": motor, "fixture_segundos": round(time.perf_counter() - inicio_fixture, 4), "escenarios": []}
+
+    def pasada(incremental):
+        if motor == "asincrono":
+            return [("asincrono", sincronizar_async)]
+        return [
+            ("productos", lambda: sincronizar_productos(incremental=incremental)),
+            ("existencias", lambda: sincronizar_existencias(incremental=incremental)),
+        ]
+
+    escenarios = resultado["escenarios"]
+    # Sin estado previo la pasada incremental es completa y deja registrada la marca de agua
+    escenarios.append(medir_escenario("carga_inicial", pasada(True), fuente_url, destino_url))
+    escenarios.append(medir_escenario("sin_cambios", pasada(False), fuente_url, destino_url))
+    resultado["cambios"] = aplicar_cambios(fuente_url, proporcion, semilla + 1)
+    escenarios.append(medir_escenario("cambios", pasada(False), fuente_url, destino_url))
+    # Tras la misma ronda de cambios todas las variantes deben dejar los mismos precios
+    resultado["huella_precios"] = _huella_precios(destino_url)
+    if motor != "asincrono":
+        aplicar_cambios(fuente_url, proporcion, semilla + 2)
+        escenarios.append(medir_escenario("incremental", pasada(True), fuente_url, destino_url))
+    return resultado
+
+def _commit_actual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def ejecutar_benchmark(filas, proporcion, variantes=None, directorio=None, fuente_url=None, destino_url=None, semilla=1):
+    """
+    Corre cada variante en un subproceso propio (configuración, memoria y conteo de sentencias
+    aislados) y junta los resultados. Por defecto usa bases SQLite en directorio; con fuente_url y
+    destino_url puede apuntar, por ejemplo, a un MySQL local en un contenedor.
+    """
+    directorio = os.path.abspath(directorio or tempfile.mkdtemp(prefix="sync_benchmark_"))
+    os.makedirs(directorio, exist_ok=True)
+    fuente_url = fuente_url or f"sqlite:///{os.path.join(directorio, 'fuente.db')}"
+    destino_url = destino_url or f"sqlite:///{os.path.join(directorio, 'destino.db')}"
+
+    resultados = {
+        "commit": _commit_actual(),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "filas": filas,
+        "proporcion_cambios": proporcion,
+        "motor_fuente": fuente_url.split(":", 1)[0],
+        "motor_destino": destino_url.split(":", 1)[0],
+        "variantes": {},
+    }
+    for nombre in variantes or VARIANTES:
+        _, entorno_variante = VARIANTES[nombre]
+        entorno = dict(os.environ, **entorno_variante)
+        entorno.update({
+            "FUENTE_URL": fuente_url,
+            "DESTINO_URL": destino_url,
+            "SYNC_ARCHIVO_ESTADO": os.path.join(directorio, f"estado_{nombre}.json"),
+            "SYNC_SEDES": "1=stock",
+        })
+        if os.path.exists(entorno["SYNC_ARCHIVO_ESTADO"]):
+            os.remove(entorno["SYNC_ARCHIVO_ESTADO"])
+        print(f"Variante {nombre}...", file=sys.stderr)
+        proceso = subprocess.run(
+            [
+                sys.executable, os.path.abspath(__file__), "--variante", nombre,
+                "--filas", str(filas), "--cambios", str(proporcion), "--semilla", str(semilla),
+            ],
+            env=entorno, cwd=directorio, stdout=subprocess.PIPE, text=True,
+        )
+        if proceso.returncode != 0:
+            resultados["variantes"][nombre] = {"error": f"el subproceso terminó con código {proceso.returncode}"}
+            continue
+        resultados["variantes"][nombre] = json.loads(proceso.stdout.strip().splitlines()[-1])
+
+    # Si los precios difieren, las variantes no hacen el mismo trabajo y sus tiempos no son comparables
+    huellas = {nombre: v["huella_precios"] for nombre, v in resultados["variantes"].items() if "huella_precios" in v}
+    resultados["precios_coinciden"] = len(set(huellas.values())) <= 1
+    if not resultados["precios_coinciden"]:
+        print(f"Las variantes dejaron distintos precio_final en el destino: {huellas}", file=sys.stderr)
+    return resultados
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=(
+            "Benchmark de la sincronización sobre un fixture sintético. Por defecto usa SQLite; para un MySQL "
+            "local (p. ej. docker run -e MYSQL_ROOT_PASSWORD=clave -p 3306:3306 mysql:8 con las bases creadas) "
+            "indique --fuente-url y --destino-url."
+        ),
+    )
+    parser.add_argument("--filas", type=int, default=10000, help="Productos del origen (p. ej. de 10000 a 1000000).")
+    parser.add_argument("--cambios", type=float, default=0.05, help="Fracción de productos que cambia entre pasadas.")
+    parser.add_argument("--variantes", default=",".join(VARIANTES), help=f"Variantes separadas por comas: {', '.join(VARIANTES)}.")
+    parser.add_argument("--directorio", help="Directorio de trabajo (bases SQLite, estado y logs); por defecto uno temporal.")
+    parser.add_argument("--fuente-url", help="URL de la base fuente en vez de SQLite.")
+    parser.add_argument("--destino-url", help="URL de la base destino en vez de SQLite.")
+    parser.add_argument("--semilla", type=int, default=1, help="Semilla de los datos sintéticos.")
+    parser.add_argument("--salida", help="Archivo JSON donde guardar los resultados (además de imprimirlos).")
+    # Uso interno: corre una sola variante en este proceso e imprime su resultado como JSON
+    parser.add_argument("--variante", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variante:
+        motor, _ = VARIANTES[args.variante]
+        resultado = ejecutar_variante(
+            motor, os.environ["FUENTE_URL"], os.environ["DESTINO_URL"], args.filas, args.cambios, args.semilla
+        )
+        print(json.dumps(resultado))
+    else:
+        resultados = ejecutar_benchmark(
+            args.filas,
+            args.cambios,
+            [nombre.strip() for nombre in args.variantes.split(",") if nombre.strip()],
+            args.directorio,
+            args.fuente_url,
+            args.destino_url,
+            args.semilla,
+        )
+        texto = json.dumps(resultados, indent=2, ensure_ascii=False)
+        if args.salida:
+            with open(args.salida, "w", encoding="utf-8") as archivo:
+                archivo.write(texto)
+        print(texto)
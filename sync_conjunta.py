@@ -0,0 +1,277 @@
+import logging
+import time
+from datetime import datetime
+from functools import partial
+from itertools import chain
+
+from config import REVALUAR_POR_TASA, TAMANO_LOTE, TAMANO_PARTICION, configurar_logger
+from models.producto_origen import ProductoProyectado
+from sync_worker import obtener_sync_manager, usar_pool
+from sync_scheduler import ejecutar_lotes, en_lotes
+from sync_extraccion import extraer_particiones
+from sync_bajas import procesar_bajas_existencias, procesar_bajas_productos
+from sync_huella import validar_backend
+from sync_sedes import cargar_sedes, clave_estado
+from sync_estado import (
+    PuntoControl,
+    PuntosControl,
+    cargar_estado,
+    obtener_marca_agua,
+    obtener_punto_control,
+    registrar_sincronizacion,
+)
+from sync_metricas import etapa, exportar_reporte, medir_iterable, reiniciar_metricas
+from sync_instantanea import actualizar_instantanea, ruta_instantanea, validar_instantanea
+from sync_existencia import revaluar_existencias, sincronizar_existencias
+from sync_products import sincronizar_productos
+import sync_existencia
+import sync_products
+
+# Posición en las filas de CONSULTA_CATALOGO_ORIGEN de la existencia de la primera sede (stock_0)
+COLUMNA_STOCK_SEDES = 15
+
+def producto_de_catalogo(fila):
+    """ProductoProyectado de una fila del catálogo."""
+    return ProductoProyectado(fila[0], fila[1], fila[2], fila[9], fila[11], fila[14], fila[10])
+
+def existencias_de_catalogo(filas, posicion):
+    """
+    Filas crudas (en el orden de ExistenciaCruda) de la sede posicion: las del catálogo con su
+    existencia en lugar de la del producto, solo las que tienen stock, como CONSULTA_EXISTENCIAS_PLANA.
+    """
+    columna = COLUMNA_STOCK_SEDES + posicion
+    return [fila[:9] + (fila[columna],) + fila[10:14] for fila in filas if fila[columna] is not None and fila[columna] > 0]
+
+def procesar_chunk_conjunto(constantes, sedes, vistas, filas_chunk):
+    """
+    Procesa un chunk del catálogo para todas las tablas: el diff y la escritura de los productos y
+    luego los de las existencias de cada sede, con las mismas conexiones del SyncManager del worker.
+    Devuelve {tabla: (actualizadas, nuevas, hashes escritos)} con la clave del estado de cada tabla.
+    """
+    with etapa("reparto", len(filas_chunk)):
+        productos = [producto_de_catalogo(fila) for fila in filas_chunk]
+    resultados = {"productos": sync_products.procesar_chunk(productos, vistas.get("productos"))}
+    for posicion, sede in enumerate(sedes):
+        clave = clave_estado(sede)
+        with etapa("reparto", len(filas_chunk)):
+            crudas = existencias_de_catalogo(filas_chunk, posicion)
+        if crudas:
+            resultados[clave] = sync_existencia.procesar_chunk_crudo(constantes, crudas, sede, vistas.get(clave))
+    return resultados
+
+def registrar_claves_catalogo(filas, claves_productos, claves_sedes):
+    """Deja pasar las filas del catálogo anotando su codprod y, por sede, los que tienen stock."""
+    for fila in filas:
+        claves_productos.add(fila[0])
+        for posicion, claves in enumerate(claves_sedes):
+            stock = fila[COLUMNA_STOCK_SEDES + posicion]
+            if stock is not None and stock > 0:
+                claves.add(fila[0])
+        yield fila
+
+def marca_agua_conjunta(marcas_agua):
+    """
+    Marca de agua con la que se lee el catálogo una sola vez para todas las tablas: la más antigua
+    de todas, o None (pasada completa) si alguna tabla la necesita.
+    """
+    marcas_agua = list(marcas_agua)
+    if any(marca_agua is None for marca_agua in marcas_agua):
+        return None
+    return {
+        "fecha": min(marca_agua["fecha"] for marca_agua in marcas_agua),
+        "keycodigo": min(marca_agua["keycodigo"] for marca_agua in marcas_agua),
+    }
+
+def sincronizar_catalogo(pool, sedes, estado, incremental=False, simular_bajas=False):
+    """
+    Pipeline de la sincronización conjunta sobre la base fuente principal: una sola lectura del
+    catálogo, con la existencia de cada sede, repartida en lotes que cada worker aplica a todas las
+    tablas. Escribe el estado de cada tabla y devuelve los totales por tabla y las estadísticas.
+    """
+    tablas = ["productos"] + [clave_estado(sede) for sede in sedes]
+    marcas_agua = {tabla: obtener_marca_agua(estado, tabla) if incremental else None for tabla in tablas}
+
+    sync_manager = obtener_sync_manager()
+    session_fuente = sync_manager.iniciar_sesion_fuente()
+    nueva_marca_agua = sync_manager.obtener_marca_agua_origen(session_fuente)
+    tasa_cambio = sync_manager.obtener_tasa_cambio_origen(session_fuente)
+    constantes = sync_manager.obtener_constantes_precios_origen(session_fuente)
+
+    # Un cambio de tasa se revalúa en el destino o, si la revaluación está desactivada, obliga a una pasada completa
+    for sede in sedes:
+        clave = clave_estado(sede)
+        if marcas_agua[clave] is not None and estado[clave].get("tasa_cambio") != str(tasa_cambio):
+            if REVALUAR_POR_TASA:
+                logging.info(f"Sede {sede.codsede}: la tasa de cambio cambió a {tasa_cambio}, se revalúan sus existencias.")
+                session_destino = sync_manager.iniciar_sesion_destino()
+                revaluar_existencias(sync_manager, session_fuente, session_destino, tasa_cambio, [sede.codsede])
+                session_destino.close()
+            else:
+                logging.info(f"Sede {sede.codsede}: la tasa de cambio cambió desde la última ejecución, se hace una pasada completa.")
+                marcas_agua[clave] = None
+
+    # Con una sola lectura, si alguna tabla necesita una pasada completa la hacen todas
+    marca_agua = marca_agua_conjunta(marcas_agua.values())
+    if marca_agua is not None:
+        logging.info(f"Modo incremental: catálogo con cambios desde {marca_agua['fecha']} o keycodigo > {marca_agua['keycodigo']}.")
+    elif incremental:
+        logging.info(f"Modo incremental: toca reconciliación completa de {', '.join(t for t in tablas if marcas_agua[t] is None)}.")
+
+    rutas = {"productos": ruta_instantanea("productos")}
+    rutas.update({clave_estado(sede): ruta_instantanea("existencias", sede.codsede) for sede in sedes})
+    vistas = {}
+    if rutas["productos"]:
+        with etapa("validar_instantanea"):
+            session_destino = sync_manager.iniciar_sesion_destino()
+            vistas["productos"] = validar_instantanea(
+                rutas["productos"], lambda tamano: sync_manager.obtener_checksums_productos_destino(session_destino, tamano)
+            )
+            for sede in sedes:
+                vistas[clave_estado(sede)] = validar_instantanea(
+                    rutas[clave_estado(sede)],
+                    lambda tamano: sync_manager.obtener_checksums_existencias_destino(session_destino, sede.codsede, tamano),
+                )
+            session_destino.close()
+
+    leer = partial(
+        sync_manager.obtener_particiones_catalogo_origen,
+        columnas_stock=[sede.columna_stock for sede in sedes],
+        tamano_particion=TAMANO_PARTICION,
+        marca_agua=marca_agua,
+    )
+    particiones = extraer_particiones(sync_manager, session_fuente, leer)
+    claves_productos = set()
+    claves_sedes = [set() for _ in sedes]
+    filas = registrar_claves_catalogo(chain.from_iterable(medir_iterable("extraccion", particiones)), claves_productos, claves_sedes)
+    lotes = en_lotes(filas, TAMANO_LOTE)
+    funcion = partial(procesar_chunk_conjunto, constantes, tuple(sedes), vistas)
+
+    punto_control = PuntosControl(
+        [PuntoControl(estado, "productos", marca_agua, nueva_marca_agua)]
+        + [PuntoControl(estado, clave_estado(sede), marca_agua, nueva_marca_agua, tasa_cambio=tasa_cambio) for sede in sedes]
+    )
+    try:
+        resultados, estadisticas = ejecutar_lotes(pool, funcion, lotes, descripcion="Catálogo", punto_control=punto_control)
+    finally:
+        session_fuente.close()
+
+    for sede in sedes:
+        estado.setdefault(clave_estado(sede), {})["tasa_cambio"] = str(tasa_cambio)
+    for tabla in tablas:
+        registrar_sincronizacion(estado, tabla, nueva_marca_agua, completa=marca_agua is None)
+
+    # Solo una pasada completa ve todas las claves del origen
+    if marca_agua is None:
+        with etapa("bajas"):
+            procesar_bajas_productos(sync_manager, claves_productos, simular_bajas)
+            for sede, claves in zip(sedes, claves_sedes):
+                procesar_bajas_existencias(sync_manager, sede.codsede, claves, simular_bajas)
+
+    if rutas["productos"]:
+        with etapa("escribir_instantanea"):
+            actualizar_instantanea(
+                rutas["productos"],
+                vistas["productos"],
+                {codprod: hash_fuente for r in resultados for codprod, hash_fuente in r["productos"][2]},
+                lambda: sync_products.leer_hashes_destino(sync_manager),
+                completa=marca_agua is None,
+            )
+            for sede in sedes:
+                clave = clave_estado(sede)
+                actualizar_instantanea(
+                    rutas[clave],
+                    vistas[clave],
+                    {codprod: hash_fuente for r in resultados if clave in r for codprod, hash_fuente in r[clave][2]},
+                    lambda: sync_existencia.leer_hashes_destino(sync_manager, sede.codsede),
+                    completa=marca_agua is None,
+                )
+
+    totales = {
+        tabla: {
+            "actualizadas": sum(r[tabla][0] for r in resultados if tabla in r),
+            "nuevas": sum(r[tabla][1] for r in resultados if tabla in r),
+        }
+        for tabla in tablas
+    }
+    totales["productos"]["filas"] = len(claves_productos)
+    for sede, claves in zip(sedes, claves_sedes):
+        totales[clave_estado(sede)]["filas"] = len(claves)
+    return totales, estadisticas
+
+def sincronizar_conjunta(incremental=False, simular_bajas=False, pool=None, reanudar=False):
+    """
+    Sincroniza productos y existencias con una sola lectura del catálogo fuente: cada fila se reparte
+    al diff de productos y al de las existencias de cada sede de la base fuente principal, y los
+    workers escriben las dos tablas con las mismas conexiones. El modo incremental lee el catálogo
+    desde la marca de agua más antigua de las tablas; si alguna necesita una reconciliación completa,
+    la pasada es completa para todas (y aplica las bajas de todas).
+    Las sedes con otra base fuente se sincronizan después, sobre el mismo pool, con sincronizar_existencias.
+    La lectura es siempre la extracción plana: SYNC_HASH_EN_ORIGEN no se aplica en este modo.
+    Con reanudar, si alguna tabla tiene una ejecución interrumpida, se reanudan las de productos y
+    existencias por separado, cada una desde su punto de control.
+    """
+    inicio = time.time()
+    configurar_logger()
+    reiniciar_metricas()
+
+    try:
+        logging.info("Iniciando la sincronización conjunta de productos y existencias...")
+        validar_backend()
+
+        estado = cargar_estado()
+        todas = cargar_sedes()
+        sedes = [sede for sede in todas if sede.fuente_url is None]
+        remotas = [sede for sede in todas if sede.fuente_url is not None]
+
+        tablas = ["productos"] + [clave_estado(sede) for sede in todas]
+        if reanudar and any(obtener_punto_control(estado, tabla) is not None for tabla in tablas):
+            logging.info("Hay sincronizaciones interrumpidas: se reanudan por separado desde sus puntos de control.")
+            with usar_pool(pool) as pool_lotes:
+                sincronizar_productos(incremental=incremental, simular_bajas=simular_bajas, pool=pool_lotes, reanudar=True)
+                sincronizar_existencias(incremental=incremental, simular_bajas=simular_bajas, pool=pool_lotes, reanudar=True)
+            return
+
+        with usar_pool(pool) as pool_lotes:
+            totales, estadisticas = sincronizar_catalogo(pool_lotes, sedes, estado, incremental, simular_bajas)
+
+            fin = time.time()
+            duracion = fin - inicio
+
+            logging.info("Sincronización conjunta completada.")
+            logging.info(
+                f"  Productos: {totales['productos']['actualizadas']} actualizados, "
+                f"{totales['productos']['nuevas']} nuevos, {totales['productos']['filas']} leídos"
+            )
+            for sede in sedes:
+                resultado = totales[clave_estado(sede)]
+                logging.info(
+                    f"  Sede {sede.codsede}: {resultado['actualizadas']} actualizadas, "
+                    f"{resultado['nuevas']} nuevas, {resultado['filas']} con stock"
+                )
+            logging.info(f"  Hora de inicio: {datetime.fromtimestamp(inicio).strftime('%Y-%m-%d %H:%M:%S')}")
+            logging.info(f"  Hora de finalización: {datetime.fromtimestamp(fin).strftime('%Y-%m-%d %H:%M:%S')}")
+            logging.info(f"  Duración del proceso: {duracion:.2f} segundos")
+            estadisticas.resumir()
+            existencias = [totales[clave_estado(sede)] for sede in sedes]
+            exportar_reporte(
+                "conjunta",
+                inicio,
+                {
+                    "productos_actualizados": totales["productos"]["actualizadas"],
+                    "productos_nuevos": totales["productos"]["nuevas"],
+                    "existencias_actualizadas": sum(r["actualizadas"] for r in existencias),
+                    "existencias_nuevas": sum(r["nuevas"] for r in existencias),
+                    "sedes": len(sedes),
+                },
+                [estadisticas],
+            )
+
+            if remotas:
+                logging.info(f"Sedes con otra base fuente: {', '.join(str(sede.codsede) for sede in remotas)}.")
+                sincronizar_existencias(incremental=incremental, sedes=remotas, simular_bajas=simular_bajas, pool=pool_lotes)
+
+    except Exception as e:
+        logging.error(f"Error durante la sincronización conjunta: {str(e)}")
+
+if __name__ == "__main__":
+    sincronizar_conjunta()
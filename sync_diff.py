@@ -0,0 +1,81 @@
+from collections import namedtuple
+
+from sync_metricas import contar
+
+# Resultado de comparar un lote de origen contra el índice destino:
+#   nuevos:       [(fila_origen, hash_fuente)] que no existen en destino
+#   actualizados: [(fila_origen, hash_fuente)] cuyo hash cambió
+#   sin_cambios:  [clave] que ya están al día
+Diferencias = namedtuple("Diferencias", ["nuevos", "actualizados", "sin_cambios"])
+
+_AUSENTE = object()
+
+def calcular_diferencias(filas_origen, indice_destino, obtener_clave, calcular_hash, hashes=None):
+    """
+    Compara las filas de origen contra un índice {clave: hash} del destino cargado en memoria.
+    No realiza ninguna consulta: toda la comparación se resuelve con búsquedas en el diccionario.
+    Si ya se calcularon los hashes del lote (hashes, en el mismo orden que filas_origen) no se recalculan.
+    """
+    nuevos = []
+    actualizados = []
+    sin_cambios = []
+
+    if hashes is None:
+        hashes = map(calcular_hash, filas_origen)
+
+    for fila, hash_fuente in zip(filas_origen, hashes):
+        clave = obtener_clave(fila)
+        hash_destino = indice_destino.get(clave, _AUSENTE)
+
+        if hash_destino is _AUSENTE:
+            nuevos.append((fila, hash_fuente))
+        elif hash_destino != hash_fuente:
+            actualizados.append((fila, hash_fuente))
+        else:
+            sin_cambios.append(clave)
+
+    return Diferencias(nuevos, actualizados, sin_cambios)
+
+class IndiceHashes:
+    """
+    Índice {clave: hash} del destino que el servicio residente conserva en memoria entre ciclos.
+    Sirve para descartar, antes de repartir los lotes, las filas cuyo hash es el de la última escritura
+    conocida; los workers vuelven a comparar contra la base lo que sí se les envía. Si otro proceso
+    escribe en el destino el índice queda desfasado hasta que se invalida: las pasadas completas y las
+    revaluaciones por tasa lo invalidan y se vuelve a cargar en la siguiente pasada incremental.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.cargado = False
+        # Hashes de las filas enviadas en la pasada en curso: se confirman si termina sin errores
+        self._pendientes = {}
+
+    def cargar(self, hashes):
+        self.hashes = dict(hashes)
+        self.cargado = True
+        self._pendientes = {}
+
+    def invalidar(self):
+        self.hashes = {}
+        self.cargado = False
+        self._pendientes = {}
+
+    def filtrar(self, filas, obtener_clave, obtener_hash):
+        """Deja pasar solo las filas cuyo hash difiere del índice, anotándolas como pendientes."""
+        self._pendientes = {}
+        descartadas = 0
+        for fila in filas:
+            clave = obtener_clave(fila)
+            hash_fuente = obtener_hash(fila)
+            if self.hashes.get(clave, _AUSENTE) == hash_fuente:
+                descartadas += 1
+                continue
+            self._pendientes[clave] = hash_fuente
+            yield fila
+        contar("filas_descartadas_indice", descartadas)
+
+    def confirmar(self):
+        """Pasa al índice los hashes de las filas que se escribieron en la pasada."""
+        self.hashes.update(self._pendientes)
+        self._pendientes = {}
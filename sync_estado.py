@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from config import ARCHIVO_ESTADO, HASH_BACKEND, HORAS_RECONCILIACION, SEGUNDOS_PUNTO_CONTROL
+
+# Mayor codprod posible: límite superior del rango que queda por leer al reanudar
+CODPROD_MAXIMO = 2 ** 63 - 1
+
+# Las sedes guardan sus puntos de control desde varios hilos sobre el mismo estado
+_lock_estado = threading.RLock()
+
+def cargar_estado(archivo=None):
+    """Lee el estado persistido entre ejecuciones (marcas de agua, última sincronización completa, ...)."""
+    archivo = archivo or ARCHIVO_ESTADO
+    if not os.path.exists(archivo):
+        return {}
+    with open(archivo, encoding="utf-8") as f:
+        return json.load(f)
+
+def guardar_estado(estado, archivo=None):
+    """Escribe el estado de forma atómica para no dejarlo a medias si el proceso se interrumpe."""
+    archivo = archivo or ARCHIVO_ESTADO
+    temporal = f"{archivo}.tmp"
+    with _lock_estado:
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(estado, f, indent=2, sort_keys=True, default=str)
+        os.replace(temporal, archivo)
+
+def _marca_agua_a_json(marca_agua):
+    if marca_agua is None:
+        return None
+    return {"fecha": marca_agua["fecha"].isoformat(), "keycodigo": marca_agua["keycodigo"]}
+
+def _marca_agua_de_json(marca_agua):
+    if marca_agua is None:
+        return None
+    return {"fecha": date.fromisoformat(marca_agua["fecha"]), "keycodigo": marca_agua["keycodigo"]}
+
+def obtener_marca_agua(estado, tabla):
+    """
+    Devuelve la marca de agua de la tabla como {"fecha": date, "keycodigo": int},
+    o None si la próxima ejecución debe ser una reconciliación completa.
+    """
+    estado_tabla = estado.get(tabla, {})
+    marca_agua = estado_tabla.get("marca_agua")
+    ultima_completa = estado_tabla.get("ultima_completa")
+    if not marca_agua or not ultima_completa:
+        return None
+
+    # Con otro backend de hash cambian todas las huellas: hace falta una pasada completa que las reescriba
+    if estado_tabla.get("backend_hash", "legacy") != HASH_BACKEND:
+        return None
+
+    if datetime.now() - datetime.fromisoformat(ultima_completa) >= timedelta(hours=HORAS_RECONCILIACION):
+        return None
+
+    return _marca_agua_de_json(marca_agua)
+
+def registrar_sincronizacion(estado, tabla, marca_agua, completa):
+    """Guarda la marca de agua tomada al inicio de una ejecución que terminó sin errores."""
+    estado_tabla = estado.setdefault(tabla, {})
+    estado_tabla["marca_agua"] = _marca_agua_a_json(marca_agua)
+    if completa:
+        estado_tabla["ultima_completa"] = datetime.now().isoformat(timespec="seconds")
+        estado_tabla["backend_hash"] = HASH_BACKEND
+    # La ejecución terminó: ya no hay nada que reanudar
+    estado_tabla.pop("punto_control", None)
+    guardar_estado(estado)
+
+def obtener_punto_control(estado, tabla):
+    """
+    Punto de control que dejó una ejecución interrumpida de la tabla, para reanudarla:
+    {"codprod": último codprod confirmado (o None), "marca_agua": con la que se leyó el origen
+    (None si era completa), "nueva_marca_agua": la que se registra al terminar, "tasa_cambio": ...},
+    o None si la última ejecución terminó o nunca confirmó nada.
+    """
+    punto_control = estado.get(tabla, {}).get("punto_control")
+    if not punto_control:
+        return None
+    # Con otro backend de hash las filas ya escritas tendrían huellas distintas: no se reanuda
+    if punto_control.get("backend_hash") != HASH_BACKEND:
+        return None
+    return {
+        "codprod": punto_control["codprod"],
+        "marca_agua": _marca_agua_de_json(punto_control["marca_agua"]),
+        "nueva_marca_agua": _marca_agua_de_json(punto_control["nueva_marca_agua"]),
+        "tasa_cambio": punto_control.get("tasa_cambio"),
+    }
+
+class PuntoControl:
+    """
+    Avance de una ejecución en curso de una tabla o sede. Los lotes se envían en orden de codprod y
+    terminan en cualquier orden: codprod es el último de la racha de lotes confirmados desde el primero,
+    de modo que todo lo anterior ya está escrito en el destino. Se guarda en el estado como mucho cada
+    SYNC_SEGUNDOS_PUNTO_CONTROL segundos y al terminar de enviar lotes (también si falló uno).
+    """
+
+    def __init__(self, estado, tabla, marca_agua, nueva_marca_agua, codprod=None, tasa_cambio=None):
+        self.estado = estado
+        self.tabla = tabla
+        self.marca_agua = marca_agua
+        self.nueva_marca_agua = nueva_marca_agua
+        self.codprod = codprod
+        self.tasa_cambio = tasa_cambio
+        # Último codprod de cada lote enviado y aún no alcanzado por la racha, y los ya confirmados
+        self._hasta = {}
+        self._confirmados = set()
+        self._siguiente = 0
+        self._guardado = time.monotonic()
+        self._lock = threading.Lock()
+
+    def enviado(self, numero, lote):
+        """Registra el lote número numero (en orden de envío) con su último codprod, la primera columna."""
+        with self._lock:
+            self._hasta[numero] = lote[-1][0]
+
+    def confirmado(self, numero):
+        """El lote número numero se escribió y confirmó en el destino."""
+        with self._lock:
+            self._confirmados.add(numero)
+            while self._siguiente in self._confirmados:
+                self._confirmados.discard(self._siguiente)
+                self.codprod = self._hasta.pop(self._siguiente)
+                self._siguiente += 1
+            guardar = time.monotonic() - self._guardado >= SEGUNDOS_PUNTO_CONTROL
+        if guardar:
+            self.guardar()
+
+    def guardar(self):
+        with _lock_estado:
+            self.estado.setdefault(self.tabla, {})["punto_control"] = {
+                "codprod": self.codprod,
+                "marca_agua": _marca_agua_a_json(self.marca_agua),
+                "nueva_marca_agua": _marca_agua_a_json(self.nueva_marca_agua),
+                "tasa_cambio": None if self.tasa_cambio is None else str(self.tasa_cambio),
+                "backend_hash": HASH_BACKEND,
+                "actualizado": datetime.now().isoformat(timespec="seconds"),
+            }
+            guardar_estado(self.estado)
+            self._guardado = time.monotonic()
+
+class PuntosControl:
+    """
+    Puntos de control de varias tablas que avanzan con los mismos lotes (la sincronización conjunta):
+    reparte cada aviso de ejecutar_lotes entre los PuntoControl de cada tabla.
+    """
+
+    def __init__(self, puntos_control):
+        self.puntos_control = list(puntos_control)
+
+    def enviado(self, numero, lote):
+        for punto_control in self.puntos_control:
+            punto_control.enviado(numero, lote)
+
+    def confirmado(self, numero):
+        for punto_control in self.puntos_control:
+            punto_control.confirmado(numero)
+
+    def guardar(self):
+        for punto_control in self.puntos_control:
+            punto_control.guardar()
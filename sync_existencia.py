@@ -1,95 +1,492 @@
 import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 
-from tqdm import tqdm
-from multiprocessing import Pool, cpu_count
-from config import FUENTE_URL, DESTINO_URL, configurar_logger
-from sync_manager import SyncManager
-import hashlib
+from config import (
+    EXTRACCION_PLANA,
+    HASH_EN_ORIGEN,
+    MAX_LOTES_PENDIENTES,
+    REVALUAR_POR_TASA,
+    TAMANO_LOTE,
+    TAMANO_LOTE_ESCRITURA,
+    configurar_logger,
+)
+from models.existencia_origen import ExistenciaOrigen
+from sync_worker import obtener_sync_manager, usar_pool
+from sync_scheduler import ejecutar_lotes, en_lotes
+from sync_bajas import procesar_bajas_existencias
+from sync_diff import calcular_diferencias
+from sync_extraccion import extraer_lote
+from sync_huella import Esquema, expresion_sql, huella, huellas_lote, resolver_hash_en_origen, validar_backend
+from sync_sedes import SEDE_PRINCIPAL, cargar_sedes, clave_estado
+from sync_precios import a_decimal, calcular_existencia, calcular_existencias, redondear
+from sync_estado import (
+    CODPROD_MAXIMO,
+    PuntoControl,
+    cargar_estado,
+    guardar_estado,
+    obtener_marca_agua,
+    obtener_punto_control,
+    registrar_sincronizacion,
+)
+from sync_metricas import etapa, exportar_reporte, reiniciar_metricas
+from sync_instantanea import abrir_instantanea, actualizar_instantanea, hashes_en_rango, ruta_instantanea, validar_instantanea
 from datetime import datetime
 import time
 
+# Campos de la existencia que forman su hash y su tipo (la escala, en los decimales)
+# (la de las columnas destino: existencia y tasa con 3 decimales, precios y descuento con 2)
+ESQUEMA_HASH = Esquema([
+    ("codprod", int),
+    ("codlin", int),
+    ("stock", 3),
+    ("precio_final", 2),
+    ("precio_divisas_final", 2),
+    ("tasa_cambio", 3),
+    ("descuento_porcentual", 2),
+])
+
 def calcular_hash(existencia_origen):
     """Genera un hash de los campos relevantes de la existencia."""
-    campos = (
-        f"{existencia_origen.codprod}{existencia_origen.codlin}{existencia_origen.stock}"
-        f"{existencia_origen.precio_final}{existencia_origen.precio_divisas_final}"
-        f"{existencia_origen.tasa_cambio}{existencia_origen.descuento_porcentual}"
-    )
-    return hashlib.sha256(campos.encode('utf-8')).hexdigest()
+    return huella(existencia_origen, ESQUEMA_HASH)
+
+def calcular_hashes(existencias_origen):
+    """Genera los hashes de un lote de existencias en una sola llamada."""
+    return huellas_lote(existencias_origen, ESQUEMA_HASH)
+
+def expresion_hash_sql(alias="e"):
+    """El mismo hash que calcular_hash, calculado en MySQL sobre la consulta de existencias con el alias indicado."""
+    return expresion_sql(ESQUEMA_HASH, alias)
+
+# Campos del hash de una existencia armados con las columnas del destino, para la revaluación por tasa
+ExistenciaRevaluada = namedtuple("ExistenciaRevaluada", ESQUEMA_HASH.nombres)
+
+def obtener_clave(existencia_origen, codsede=1):
+    """Clave (product_codprod, codsede) con la que se compara una existencia contra el destino."""
+    return existencia_origen.codprod, codsede
+
+def leer_indice_destino(sync_manager, session_destino, claves, vista=None):
+    """
+    Índice {(product_codprod, codsede): hash} del destino para las claves del chunk: de la instantánea
+    local de la sede si está vigente para todo su rango de codprod y, si no, consultando el destino.
+    """
+    codprods = [codprod for codprod, _ in claves]
+    indice_destino = None
+    if vista is not None:
+        with etapa("lectura_instantanea"):
+            indice_destino = hashes_en_rango(vista, min(codprods), max(codprods), claves[0][1])
+    if indice_destino is None:
+        with etapa("lectura_destino"):
+            indice_destino = sync_manager.obtener_indice_existencias_destino(session_destino, claves)
+    return indice_destino
+
+def hashes_escritos(diferencias):
+    """Pares (codprod, hash) que el chunk escribió en el destino, para actualizar la instantánea de la sede."""
+    return [(fila.codprod, hash_fuente) for fila, hash_fuente in diferencias.nuevos + diferencias.actualizados]
+
+def procesar_chunk(datos_chunk, sede=SEDE_PRINCIPAL, vista=None):
+    """Función para procesar un chunk de existencias de una sede (tuplas en el orden de ExistenciaOrigen)."""
+    datos_chunk = list(map(ExistenciaOrigen._make, datos_chunk))
+    sync_manager = obtener_sync_manager(sede.fuente_url)
+    with sync_manager.iniciar_sesion_destino() as session_destino:
+        codsede_origen = sede.codsede
+        claves = [obtener_clave(existencia_origen, codsede_origen) for existencia_origen in datos_chunk]
+        indice_destino = leer_indice_destino(sync_manager, session_destino, claves, vista)
+
+        with etapa("hash", len(datos_chunk)):
+            hashes = calcular_hashes(datos_chunk)
+        with etapa("diferencias", len(datos_chunk)):
+            diferencias = calcular_diferencias(
+                datos_chunk,
+                indice_destino,
+                lambda existencia: obtener_clave(existencia, codsede_origen),
+                calcular_hash,
+                hashes=hashes,
+            )
+
+        if diferencias.nuevos or diferencias.actualizados:
+            sync_manager.upsert_existencias_batch(session_destino, diferencias.nuevos, diferencias.actualizados, codsede_origen)
+
+    return len(diferencias.actualizados), len(diferencias.nuevos), hashes_escritos(diferencias)
+
+def procesar_chunk_crudo(constantes, filas_chunk, sede=SEDE_PRINCIPAL, vista=None):
+    """Procesa un chunk de la extracción plana: calcula los precios y sigue como procesar_chunk."""
+    with etapa("precios", len(filas_chunk)):
+        existencias = calcular_existencias(filas_chunk, constantes)
+    return procesar_chunk(existencias, sede, vista)
 
-def procesar_chunk(datos_chunk):
-    """Función para procesar un chunk de existencias."""
-    sync_manager = SyncManager(FUENTE_URL, DESTINO_URL)
+def procesar_chunk_hashes(hashes_chunk, sede=SEDE_PRINCIPAL, vista=None):
+    """
+    Procesa un chunk de pares (codprod, hash) calculados en origen: compara con el destino y
+    solo lee del origen las existencias completas de los productos nuevos o cambiados.
+    """
+    sync_manager = obtener_sync_manager(sede.fuente_url)
+    with sync_manager.iniciar_sesion_destino() as session_destino:
+        codsede_origen = sede.codsede
+        claves = [(codprod, codsede_origen) for codprod, _ in hashes_chunk]
+        indice_destino = leer_indice_destino(sync_manager, session_destino, claves, vista)
+        with etapa("diferencias", len(hashes_chunk)):
+            hashes_origen = {
+                codprod: hash_fuente
+                for codprod, hash_fuente in hashes_chunk
+                if indice_destino.get((codprod, codsede_origen)) != hash_fuente
+            }
+
+        if not hashes_origen:
+            return 0, 0, []
+
+        with sync_manager.iniciar_sesion_fuente() as session_fuente, etapa("extraccion", len(hashes_origen)):
+            filas = sync_manager.obtener_filas_existencias_origen(
+                session_fuente, codprods=list(hashes_origen), columna_stock=sede.columna_stock
+            )
+        datos_chunk = list(map(ExistenciaOrigen._make, filas))
+
+        diferencias = calcular_diferencias(
+            datos_chunk,
+            indice_destino,
+            lambda existencia: obtener_clave(existencia, codsede_origen),
+            calcular_hash,
+            hashes=[hashes_origen[existencia_origen.codprod] for existencia_origen in datos_chunk],
+        )
+
+        if diferencias.nuevos or diferencias.actualizados:
+            sync_manager.upsert_existencias_batch(session_destino, diferencias.nuevos, diferencias.actualizados, codsede_origen)
+
+    return len(diferencias.actualizados), len(diferencias.nuevos), hashes_escritos(diferencias)
+
+def revaluar_existencias(sync_manager, session_fuente, session_destino, tasa_cambio, codsedes=None):
+    """
+    Aplica una nueva tasa de cambio sin resincronizar: por cada sede (por defecto todas las del
+    destino) un UPDATE que recalcula los precios en divisas en el destino y luego los hashes,
+    armados con las columnas del destino y el codlin del origen. Devuelve el número de existencias revaluadas.
+    Limitación: el destino solo guarda precio_final ya redondeado, y el origen divide el precio sin
+    redondear. Por eso precio_divisas_final puede diferir en 0.01 del de una sincronización cuando la
+    división cae cerca de un .005 (p. ej. 10.004 / 0.8 = 12.505 -> 12.51, pero 10.00 / 0.8 = 12.50).
+    Esas filas quedan con otro hash y la siguiente pasada completa las reescribe.
+    """
+    codlins = sync_manager.obtener_lineas_productos_origen(session_fuente)
+    total = 0
+    for codsede in codsedes or sync_manager.obtener_sedes_destino(session_destino):
+        filas = sync_manager.revaluar_existencias_destino(session_destino, codsede, tasa_cambio)
+
+        valores = sync_manager.obtener_valores_hash_existencias_destino(session_destino, codsede)
+        for inicio_lote in range(0, len(valores), TAMANO_LOTE_ESCRITURA):
+            lote = valores[inicio_lote:inicio_lote + TAMANO_LOTE_ESCRITURA]
+            # Con la escala de las columnas DECIMAL del origen (descuento es FLOAT en destino), para que
+            # también el hash legacy, que depende de la representación, coincida con el de una sincronización
+            existencias = [
+                ExistenciaRevaluada(
+                    codprod,
+                    codlins.get(codprod),
+                    redondear(a_decimal(existencia), 3),
+                    redondear(a_decimal(precio_final)),
+                    redondear(a_decimal(precio_divisa_final)),
+                    tasa_cambio,
+                    redondear(a_decimal(descuento)),
+                )
+                for codprod, existencia, precio_final, precio_divisa_final, descuento in lote
+            ]
+            hashes = dict(zip((existencia.codprod for existencia in existencias), calcular_hashes(existencias)))
+            sync_manager.actualizar_hashes_existencias_batch(session_destino, codsede, hashes)
+
+        # Precios y hashes de la sede quedan en la misma transacción
+        session_destino.commit()
+        logging.info(f"  Sede {codsede}: {filas} existencias revaluadas a la tasa {tasa_cambio}.")
+        total += filas
+    return total
+
+def cargar_indice(sync_manager, codsede, indice, vista=None):
+    """
+    Carga en el índice en memoria los hashes de las existencias de la sede en el destino si aún no los
+    tiene: de la instantánea local si coincide entera con el destino o, si no, del destino.
+    """
+    if indice.cargado:
+        return
+    with etapa("indice_destino") as medicion:
+        if vista is not None and vista.completa:
+            indice.cargar(abrir_instantanea(vista).items(codsede))
+        else:
+            session_destino = sync_manager.iniciar_sesion_destino()
+            indice.cargar(sync_manager.obtener_hashes_existencias_destino(session_destino, codsede))
+            session_destino.close()
+        medicion["filas"] = len(indice.hashes)
+
+def leer_hashes_destino(sync_manager, codsede):
+    """{codprod: hash} de las existencias de la sede en el destino, para rehacer su instantánea."""
     session_destino = sync_manager.iniciar_sesion_destino()
+    try:
+        hashes = sync_manager.obtener_hashes_existencias_destino(session_destino, codsede)
+        return {codprod: hash_destino for (codprod, _), hash_destino in hashes.items()}
+    finally:
+        session_destino.close()
 
-    batched_existencias_actualizadas = []
-    batched_existencias_nuevas = []
+def sincronizar_sede(pool, sede, estado, incremental=False, rangos=None, max_pendientes=None, simular_bajas=False, indice=None, reanudar=False):
+    """
+    Pipeline de una sede: lee sus existencias de su base fuente y columna de stock y reparte los
+    lotes en el pool compartido. No escribe el estado: devuelve lo que hay que registrar
+    (marca de agua, tasa, si fue completa) junto con los totales y las estadísticas de la sede.
+    En una pasada completa también da de baja las existencias del destino que ya no tienen stock.
+    Con el IndiceHashes de la sede (servicio residente) las pasadas incrementales no envían a los
+    workers las existencias cuyo hash no cambió desde la última escritura. Con SYNC_INSTANTANEAS
+    los workers leen los hashes del destino de la instantánea de la sede donde sigue vigente.
+    Con SYNC_CONEXIONES_EXTRACCION > 1 sus existencias se leen por tramos de codprod en paralelo.
+    Con reanudar, una ejecución interrumpida de la sede se retoma desde su punto de control.
+    """
+    inicio = time.time()
+    clave = clave_estado(sede)
+    reanudacion = obtener_punto_control(estado, clave) if reanudar and not rangos else None
+    marca_agua = obtener_marca_agua(estado, clave) if incremental else None
 
-    for existencia_origen in datos_chunk:
-        codprod_origen = existencia_origen.codprod
-        codsede_origen = 1
-        hash_fuente = calcular_hash(existencia_origen)
+    # Las sedes de una misma base fuente comparten engines
+    sync_manager = obtener_sync_manager(sede.fuente_url)
+    session_fuente = sync_manager.iniciar_sesion_fuente()
+    nueva_marca_agua = sync_manager.obtener_marca_agua_origen(session_fuente)
+    tasa_cambio = sync_manager.obtener_tasa_cambio_origen(session_fuente)
 
-        existencia_destino = sync_manager.obtener_existencia_destino(session_destino, codprod_origen, codsede_origen)
+    # Las filas ya escritas tienen los precios en divisas de la tasa de entonces
+    if reanudacion is not None and reanudacion["tasa_cambio"] != str(tasa_cambio):
+        logging.info(f"Sede {sede.codsede}: la tasa de cambio cambió desde la ejecución interrumpida, no se reanuda.")
+        reanudacion = None
 
-        if existencia_destino:
-            if existencia_destino.hash != hash_fuente:
-                batched_existencias_actualizadas.append((existencia_destino, existencia_origen, hash_fuente))
+    rangos_lectura = rangos
+    desde_codprod = None
+    if reanudacion is not None:
+        marca_agua = reanudacion["marca_agua"]
+        nueva_marca_agua = reanudacion["nueva_marca_agua"]
+        desde_codprod = reanudacion["codprod"]
+        if desde_codprod is not None:
+            rangos_lectura = [(desde_codprod + 1, CODPROD_MAXIMO)]
+        logging.info(f"Sede {sede.codsede}: se reanuda la sincronización interrumpida después del codprod {desde_codprod}.")
+
+    # Un cambio de tasa altera el precio en divisas de todas las filas: se revalúan en el destino
+    # con un UPDATE o, si la revaluación está desactivada, se hace una pasada completa
+    if marca_agua is not None and estado[clave].get("tasa_cambio") != str(tasa_cambio):
+        if REVALUAR_POR_TASA:
+            logging.info(f"Sede {sede.codsede}: la tasa de cambio cambió a {tasa_cambio}, se revalúan sus existencias.")
+            session_destino = sync_manager.iniciar_sesion_destino()
+            revaluar_existencias(sync_manager, session_fuente, session_destino, tasa_cambio, [sede.codsede])
+            session_destino.close()
+            # La revaluación reescribe los hashes de la sede en el destino
+            if indice is not None:
+                indice.invalidar()
         else:
-            batched_existencias_nuevas.append((existencia_origen, hash_fuente))
+            logging.info(f"Sede {sede.codsede}: la tasa de cambio cambió desde la última ejecución, se hace una pasada completa.")
+            marca_agua = None
+
+    if marca_agua is not None:
+        logging.info(f"Sede {sede.codsede}: existencias con cambios desde {marca_agua['fecha']} o keycodigo > {marca_agua['keycodigo']}.")
+    elif incremental:
+        logging.info(f"Sede {sede.codsede}: toca reconciliación completa.")
 
-    if batched_existencias_actualizadas:
-        sync_manager.actualizar_existencias_batch(session_destino, batched_existencias_actualizadas)
+    # Se valida después de la revaluación, que cambia los hashes de la sede en el destino
+    ruta = ruta_instantanea("existencias", sede.codsede)
+    vista = None
+    if ruta:
+        with etapa("validar_instantanea"):
+            session_destino = sync_manager.iniciar_sesion_destino()
+            vista = validar_instantanea(
+                ruta, lambda tamano: sync_manager.obtener_checksums_existencias_destino(session_destino, sede.codsede, tamano)
+            )
+            session_destino.close()
+
+    with etapa("extraccion") as medicion:
+        if resolver_hash_en_origen(sync_manager.engine_fuente.dialect.name, HASH_EN_ORIGEN):
+            leer = partial(
+                sync_manager.obtener_hashes_existencias_origen,
+                expresion_hash=expresion_hash_sql(),
+                marca_agua=marca_agua,
+                columna_stock=sede.columna_stock,
+            )
+            funcion = partial(procesar_chunk_hashes, sede=sede, vista=vista)
+            obtener_hash = lambda fila: fila[1]
+        elif EXTRACCION_PLANA:
+            constantes = sync_manager.obtener_constantes_precios_origen(session_fuente)
+            leer = partial(sync_manager.obtener_filas_crudas_existencias_origen, marca_agua=marca_agua, columna_stock=sede.columna_stock)
+            funcion = partial(procesar_chunk_crudo, constantes, sede=sede, vista=vista)
+            obtener_hash = lambda fila: calcular_hash(ExistenciaOrigen._make(calcular_existencia(fila, constantes)))
+        else:
+            leer = partial(sync_manager.obtener_filas_existencias_origen, marca_agua=marca_agua, columna_stock=sede.columna_stock)
+            funcion = partial(procesar_chunk, sede=sede, vista=vista)
+            obtener_hash = lambda fila: calcular_hash(ExistenciaOrigen._make(fila))
+        existencias_origen = extraer_lote(sync_manager, session_fuente, leer, rangos_lectura)
+        medicion["filas"] = len(existencias_origen)
+    session_fuente.close()
 
-    if batched_existencias_nuevas:
-        sync_manager.insertar_existencias_batch(session_destino, batched_existencias_nuevas)
+    if not existencias_origen and marca_agua is None and not rangos_lectura:
+        logging.warning(f"Sede {sede.codsede}: no se encontraron existencias en la base de datos fuente.")
 
-    session_destino.close()
-    return len(batched_existencias_actualizadas), len(batched_existencias_nuevas)
+    logging.info(f"Sede {sede.codsede}: se encontraron {len(existencias_origen)} existencias en la base de datos fuente.")
+
+    filas = existencias_origen
+    if indice is not None and marca_agua is not None:
+        cargar_indice(sync_manager, sede.codsede, indice, vista)
+        filas = list(indice.filtrar(existencias_origen, lambda fila: (fila[0], sede.codsede), obtener_hash))
+        logging.info(f"Sede {sede.codsede}: {len(existencias_origen) - len(filas)} existencias sin cambios según el índice en memoria.")
+
+    # Repartir existencias en lotes pequeños entre los workers
+    lotes = en_lotes(filas, TAMANO_LOTE)
+    total_lotes = -(-len(filas) // TAMANO_LOTE)
+    punto_control = None if rangos else PuntoControl(estado, clave, marca_agua, nueva_marca_agua, desde_codprod, tasa_cambio)
+    resultados, estadisticas = ejecutar_lotes(
+        pool, funcion, lotes, total_lotes, max_pendientes, descripcion=f"Sede {sede.codsede}", punto_control=punto_control
+    )
 
-def sincronizar_existencias():
+    # Tras una pasada completa (que además aplica bajas) el índice se vuelve a cargar del destino
+    if indice is not None:
+        if marca_agua is not None:
+            indice.confirmar()
+        elif not rangos:
+            indice.invalidar()
+
+    # Solo una pasada completa ve todas las claves con stock del origen
+    if marca_agua is None and not rangos:
+        claves_origen = set(existencias_origen.columna("codprod"))
+        with etapa("bajas"):
+            procesar_bajas_existencias(sync_manager, sede.codsede, claves_origen, simular_bajas, desde_codprod=desde_codprod)
+
+    if ruta:
+        with etapa("escribir_instantanea"):
+            actualizar_instantanea(
+                ruta,
+                vista,
+                {codprod: hash_fuente for r in resultados for codprod, hash_fuente in r[2]},
+                lambda: leer_hashes_destino(sync_manager, sede.codsede),
+                completa=marca_agua is None and not rangos,
+            )
+
+    return {
+        "sede": sede,
+        "actualizadas": sum(r[0] for r in resultados),
+        "nuevas": sum(r[1] for r in resultados),
+        "filas": len(existencias_origen),
+        "duracion": time.time() - inicio,
+        "estadisticas": estadisticas,
+        "marca_agua": nueva_marca_agua,
+        "tasa_cambio": tasa_cambio,
+        "completa": marca_agua is None,
+    }
+
+def sincronizar_existencias(incremental=False, rangos=None, sedes=None, simular_bajas=False, pool=None, indices=None, reanudar=False):
+    """
+    Sincroniza las existencias fuente con el destino, para cada sede del registro (SYNC_SEDES).
+    Las sedes corren a la vez como pipelines independientes sobre un mismo pool de workers,
+    con su propia marca de agua y tasa de cambio.
+    En modo incremental solo se leen los productos que pudieron cambiar desde la última marca de agua;
+    si cambió la tasa de cambio se revalúa el destino (o se hace una pasada completa) y la
+    reconciliación periódica también es completa.
+    Con rangos [(desde, hasta), ...] solo se sincronizan esos codprod y no se toca el estado persistido.
+    Con SYNC_HASH_EN_ORIGEN el hash se calcula en la base fuente (si es MySQL) y solo se leen completas las
+    existencias que cambiaron; con SYNC_EXTRACCION_PLANA los precios se calculan en los workers.
+    Con simular_bajas las bajas de las pasadas completas solo se cuentan.
+    El servicio residente pasa su pool de workers y sus IndiceHashes por clave_estado de sede.
+    Con reanudar, las sedes cuya ejecución anterior se interrumpió la retoman desde su punto de control.
+    """
     inicio = time.time()
     archivo_log = configurar_logger()
+    reiniciar_metricas()
 
     try:
         logging.info("Iniciando la sincronización de existencias por sede...")
+        validar_backend(en_sql=HASH_EN_ORIGEN)
 
-        sync_manager = SyncManager(FUENTE_URL, DESTINO_URL)
-        session_fuente = sync_manager.iniciar_sesion_fuente()
-        existencias_origen = sync_manager.obtener_existencias_origen(session_fuente)
-        session_fuente.close()
-
-        if not existencias_origen:
-            logging.warning("No se encontraron existencias en la base de datos fuente.")
-            return
-
-        logging.info(f"Se encontraron {len(existencias_origen)} existencias en la base de datos fuente.")
+        estado = cargar_estado()
+        sedes = sedes or cargar_sedes()
+        # El límite de lotes en vuelo se reparte entre las sedes para no multiplicar la memoria
+        max_pendientes = max(1, MAX_LOTES_PENDIENTES // len(sedes))
 
-        # Dividir existencias en chunks para multiprocesamiento
-        num_chunks = cpu_count()
-        chunk_size = len(existencias_origen) // num_chunks
-        chunks = [existencias_origen[i:i + chunk_size] for i in range(0, len(existencias_origen), chunk_size)]
+        resultados = []
+        indices = indices or {}
+        with usar_pool(pool) as pool_lotes, ThreadPoolExecutor(max_workers=len(sedes)) as hilos:
+            futuros = {
+                hilos.submit(
+                    sincronizar_sede, pool_lotes, sede, estado, incremental, rangos, max_pendientes, simular_bajas,
+                    indices.get(clave_estado(sede)), reanudar,
+                ): sede
+                for sede in sedes
+            }
+            for futuro in as_completed(futuros):
+                try:
+                    resultados.append(futuro.result())
+                except Exception as e:
+                    logging.error(f"Error durante la sincronización de la sede {futuros[futuro].codsede}: {str(e)}")
 
-        # Procesar en paralelo
-        with Pool(processes=num_chunks) as pool:
-            resultados = list(tqdm(pool.imap(procesar_chunk, chunks), total=len(chunks), desc="Procesando en paralelo", unit="chunk"))
-
-        # Resumir resultados
-        total_actualizadas = sum(r[0] for r in resultados)
-        total_nuevas = sum(r[1] for r in resultados)
+        # El estado solo se actualiza para las sedes que terminaron sin errores
+        if not rangos:
+            for resultado in resultados:
+                clave = clave_estado(resultado["sede"])
+                estado.setdefault(clave, {})["tasa_cambio"] = str(resultado["tasa_cambio"])
+                registrar_sincronizacion(estado, clave, resultado["marca_agua"], completa=resultado["completa"])
 
         fin = time.time()
         duracion = fin - inicio
 
         logging.info("Sincronización completada.")
-        logging.info(f"  Existencias actualizadas: {total_actualizadas}")
-        logging.info(f"  Existencias nuevas: {total_nuevas}")
+        for resultado in sorted(resultados, key=lambda r: r["sede"].codsede):
+            velocidad = resultado["filas"] / resultado["duracion"] if resultado["duracion"] else 0
+            logging.info(
+                f"  Sede {resultado['sede'].codsede}: {resultado['actualizadas']} actualizadas, "
+                f"{resultado['nuevas']} nuevas, {resultado['filas']} leídas en {resultado['duracion']:.2f} s "
+                f"({velocidad:.0f} filas/s)"
+            )
+        logging.info(f"  Existencias actualizadas: {sum(r['actualizadas'] for r in resultados)}")
+        logging.info(f"  Existencias nuevas: {sum(r['nuevas'] for r in resultados)}")
         logging.info(f"  Hora de inicio: {datetime.fromtimestamp(inicio).strftime('%Y-%m-%d %H:%M:%S')}")
         logging.info(f"  Hora de finalización: {datetime.fromtimestamp(fin).strftime('%Y-%m-%d %H:%M:%S')}")
         logging.info(f"  Duración del proceso: {duracion:.2f} segundos")
+        for resultado in sorted(resultados, key=lambda r: r["sede"].codsede):
+            resultado["estadisticas"].resumir()
+        exportar_reporte(
+            "existencias",
+            inicio,
+            {
+                "actualizadas": sum(r["actualizadas"] for r in resultados),
+                "nuevas": sum(r["nuevas"] for r in resultados),
+                "sedes": len(resultados),
+            },
+            [r["estadisticas"] for r in resultados],
+        )
 
     except Exception as e:
         logging.error(f"Error durante la sincronización: {str(e)}")
 
+def revaluar(sedes=None):
+    """
+    Modo solo revaluación: para cada sede cuya base fuente tiene una tasa de cambio distinta de la
+    última aplicada, la aplica a sus existencias del destino sin leer las existencias del origen.
+    """
+    inicio = time.time()
+    configurar_logger()
+
+    try:
+        logging.info("Comprobando la tasa de cambio...")
+        validar_backend()
+
+        estado = cargar_estado()
+        total = 0
+        for sede in sedes or cargar_sedes():
+            clave = clave_estado(sede)
+            sync_manager = obtener_sync_manager(sede.fuente_url)
+            session_fuente = sync_manager.iniciar_sesion_fuente()
+            tasa_cambio = sync_manager.obtener_tasa_cambio_origen(session_fuente)
+
+            if estado.get(clave, {}).get("tasa_cambio") == str(tasa_cambio):
+                logging.info(f"  Sede {sede.codsede}: la tasa de cambio {tasa_cambio} ya está aplicada.")
+                session_fuente.close()
+                continue
+
+            session_destino = sync_manager.iniciar_sesion_destino()
+            total += revaluar_existencias(sync_manager, session_fuente, session_destino, tasa_cambio, [sede.codsede])
+            session_fuente.close()
+            session_destino.close()
+
+            estado.setdefault(clave, {})["tasa_cambio"] = str(tasa_cambio)
+            guardar_estado(estado)
+
+        logging.info(f"Revaluación completada: {total} existencias en {time.time() - inicio:.2f} segundos.")
+
+    except Exception as e:
+        logging.error(f"Error durante la revaluación: {str(e)}")
+
 if __name__ == "__main__":
     sincronizar_existencias()
@@ -0,0 +1,119 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import CONEXIONES_EXTRACCION, LIMITES_EXTRACCION, MAX_LOTES_PENDIENTES
+from models.lote_columnas import LoteColumnas
+from sync_estado import CODPROD_MAXIMO
+from sync_metricas import contar, etapa
+
+# Señal de fin de la cola de un tramo
+_FIN = object()
+
+def intersecar_rangos(tramo, rangos=None):
+    """Partes del tramo (desde, hasta) que caen dentro de alguno de los rangos (todo el tramo si no hay rangos)."""
+    desde, hasta = tramo
+    if not rangos:
+        return [tramo]
+    return [(max(desde, d), min(hasta, h)) for d, h in rangos if d <= hasta and desde <= h]
+
+def calcular_lecturas(sync_manager, session_fuente, rangos=None, conexiones=None):
+    """
+    Divide la lectura del origen (limitada a rangos, si se indican) en tramos de codprod, uno por
+    conexión: devuelve los rangos de cada lectura, en orden de codprod, o None si se lee con una sola
+    consulta. El primer y el último tramo quedan abiertos para no perder los productos creados
+    después de tomar los límites, como no los pierde una sola consulta.
+    """
+    conexiones = conexiones or CONEXIONES_EXTRACCION
+    if conexiones <= 1:
+        return None
+    with etapa("tramos"):
+        tramos = sync_manager.obtener_tramos_codprod_origen(session_fuente, conexiones, rangos, LIMITES_EXTRACCION)
+    if len(tramos) <= 1:
+        return None
+    tramos[0] = (-CODPROD_MAXIMO - 1, tramos[0][1])
+    tramos[-1] = (tramos[-1][0], CODPROD_MAXIMO)
+    # Un tramo que cae entero en un hueco entre los rangos no se lee (sin rangos leería toda la tabla)
+    lecturas = [lectura for lectura in (intersecar_rangos(tramo, rangos) for tramo in tramos) if lectura]
+    contar("tramos_extraccion", len(lecturas))
+    return lecturas
+
+def leer_particiones_en_paralelo(sync_manager, leer, lecturas, max_pendientes=None):
+    """
+    Lee cada tramo en su propio hilo y sesión (una conexión por tramo) con leer(session_fuente, rangos=...),
+    que recorre sus particiones. Cada hilo deja sus particiones en una cola de hasta max_pendientes y se
+    devuelven tramo por tramo: el orden por codprod se mantiene (puntos de control, índice, bajas) mientras
+    los tramos siguientes ya se están leyendo. Un error de un tramo se relanza al llegar a él; si quien
+    consume deja de iterar, los hilos dejan de leer.
+    """
+    max_pendientes = max_pendientes or MAX_LOTES_PENDIENTES
+    colas = [queue.Queue(max_pendientes) for _ in lecturas]
+    cancelado = threading.Event()
+
+    def encolar(cola, elemento):
+        while not cancelado.is_set():
+            try:
+                cola.put(elemento, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def leer_tramo(cola, rangos):
+        session_fuente = sync_manager.iniciar_sesion_fuente()
+        try:
+            for particion in leer(session_fuente, rangos=rangos):
+                if not encolar(cola, particion):
+                    return
+            encolar(cola, _FIN)
+        except Exception as e:
+            encolar(cola, e)
+        finally:
+            session_fuente.close()
+
+    with ThreadPoolExecutor(max_workers=len(lecturas)) as hilos:
+        for cola, rangos in zip(colas, lecturas):
+            hilos.submit(leer_tramo, cola, rangos)
+        try:
+            for cola in colas:
+                while True:
+                    elemento = cola.get()
+                    if elemento is _FIN:
+                        break
+                    if isinstance(elemento, Exception):
+                        raise elemento
+                    yield elemento
+        finally:
+            cancelado.set()
+
+def extraer_particiones(sync_manager, session_fuente, leer, rangos=None):
+    """
+    Particiones del origen leídas con leer(session_fuente, rangos=...): con una sola consulta en
+    session_fuente o, con SYNC_CONEXIONES_EXTRACCION > 1, por tramos de codprod leídos a la vez.
+    """
+    lecturas = calcular_lecturas(sync_manager, session_fuente, rangos)
+    if lecturas is None:
+        return leer(session_fuente, rangos=rangos)
+    logging.info(f"  Lectura del origen en {len(lecturas)} tramos de codprod en paralelo.")
+    return leer_particiones_en_paralelo(sync_manager, leer, lecturas)
+
+def extraer_lote(sync_manager, session_fuente, leer, rangos=None):
+    """
+    LoteColumnas del origen leído con leer(session_fuente, rangos=...): con una sola consulta o, con
+    SYNC_CONEXIONES_EXTRACCION > 1, por tramos de codprod leídos a la vez y unidos en orden.
+    """
+    lecturas = calcular_lecturas(sync_manager, session_fuente, rangos)
+    if lecturas is None:
+        return leer(session_fuente, rangos=rangos)
+
+    def leer_tramo(rangos_tramo):
+        session_tramo = sync_manager.iniciar_sesion_fuente()
+        try:
+            return leer(session_tramo, rangos=rangos_tramo)
+        finally:
+            session_tramo.close()
+
+    with ThreadPoolExecutor(max_workers=len(lecturas)) as hilos:
+        lotes = list(hilos.map(leer_tramo, lecturas))
+    return LoteColumnas.concatenar(lotes[0].campos, lotes)
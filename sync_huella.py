@@ -0,0 +1,186 @@
+import hashlib
+import logging
+from datetime import date
+from decimal import ROUND_HALF_UP, localcontext
+from operator import attrgetter
+
+from config import HASH_BACKEND
+
+# Separador entre campos codificados: el carácter de control US ("unit separator"), que no aparece en los datos
+SEPARADOR = "\x1f"
+
+# Codificación de un campo nulo, distinta de la de cualquier valor (todas llevan prefijo de tipo)
+NULO = "n"
+
+def _sha256(datos):
+    return hashlib.sha256(datos).hexdigest()
+
+def _blake2b(datos):
+    return hashlib.blake2b(datos, digest_size=16).hexdigest()
+
+# Funciones de resumen disponibles: reciben bytes y devuelven el hash en hexadecimal (<= 64 caracteres)
+BACKENDS = {
+    "sha256": _sha256,
+    "blake2b": _blake2b,
+}
+
+try:
+    import xxhash
+
+    BACKENDS["xxh3"] = xxhash.xxh3_128_hexdigest
+except ImportError:
+    pass
+
+def _formato_campo(tipo):
+    """
+    Prefijo de tipo y especificador de formato de un campo. Los decimales (tipo = escala entera)
+    se escriben siempre con esa escala, de modo que 1.5, 1.50 y 1.500 dan la misma huella.
+    Todos llevan especificador para que un None falle en vez de escribirse como "None".
+    """
+    if tipo is str:
+        return "s", "s"
+    if tipo is int:
+        return "i", "d"
+    if tipo is date:
+        return "t", "%Y-%m-%d"
+    if isinstance(tipo, int):
+        return "d", f".{tipo}f"
+    raise ValueError(f"Tipo de campo no soportado en la huella: {tipo}")
+
+def _lector(nombres):
+    """attrgetter de los campos que siempre devuelve una tupla, también con un solo campo."""
+    lector = attrgetter(*nombres)
+    if len(nombres) == 1:
+        return lambda fila: (lector(fila),)
+    return lector
+
+class Esquema:
+    """Campos que forman la huella de una fila y su tipo: str, int, date o la escala de un decimal."""
+
+    def __init__(self, campos):
+        self.campos = tuple(campos)
+        self.nombres = tuple(nombre for nombre, _ in self.campos)
+        for nombre in self.nombres:
+            if not nombre.isidentifier():
+                raise ValueError(f"Nombre de campo no válido en la huella: {nombre}")
+
+        formatos = [_formato_campo(tipo) for _, tipo in self.campos]
+        self._campos = tuple(
+            (nombre, prefijo, f"{{:{especificador}}}")
+            for nombre, (prefijo, especificador) in zip(self.nombres, formatos)
+        )
+        # Una sola plantilla por esquema: los valores se leen juntos y se formatean en una llamada
+        self._valores = _lector(self.nombres)
+        self._plantilla = SEPARADOR.join(f"{prefijo}{{:{especificador}}}" for prefijo, especificador in formatos)
+
+    def codificar(self, fila):
+        """Codificación canónica: cada campo con su prefijo de tipo, separados por SEPARADOR."""
+        try:
+            return self._plantilla.format(*self._valores(fila)).encode("utf-8")
+        except (TypeError, ValueError):
+            # Alguno de los campos es nulo
+            pass
+        partes = []
+        for nombre, prefijo, formato in self._campos:
+            valor = getattr(fila, nombre)
+            partes.append(NULO if valor is None else prefijo + formato.format(valor))
+        return SEPARADOR.join(partes).encode("utf-8")
+
+    def codificar_legacy(self, fila):
+        """Concatenación sin separadores que usaba calcular_hash originalmente."""
+        return "".join(map(str, self._valores(fila))).encode("utf-8")
+
+def _redondeo_canonico():
+    """Contexto decimal de la codificación: redondeo mitad hacia arriba, como ROUND() de MySQL."""
+    return localcontext(rounding=ROUND_HALF_UP)
+
+def huella(fila, esquema, backend=None):
+    """
+    Huella de una fila según el esquema. El backend "legacy" reproduce el SHA-256 de la
+    concatenación sin separadores que ya está guardado en destino; el resto usa la
+    codificación canónica.
+    """
+    backend = backend or HASH_BACKEND
+    if backend == "legacy":
+        return _sha256(esquema.codificar_legacy(fila))
+    with _redondeo_canonico():
+        return BACKENDS[backend](esquema.codificar(fila))
+
+def huellas_lote(filas, esquema, backend=None):
+    """Huellas de todas las filas de un lote en una sola llamada."""
+    backend = backend or HASH_BACKEND
+    if backend == "legacy":
+        codificar = esquema.codificar_legacy
+        return [_sha256(codificar(fila)) for fila in filas]
+    codificar, resumir = esquema.codificar, BACKENDS[backend]
+    with _redondeo_canonico():
+        return [resumir(codificar(fila)) for fila in filas]
+
+# Backends que MySQL puede calcular en el servidor (SHA2); blake2b y xxh3 solo existen en Python
+BACKENDS_SQL = {"legacy", "sha256"}
+
+# Dialectos en los que expresion_sql da la misma huella que Python: la codificación depende de cómo
+# escribe el servidor cada valor (CAST a DECIMAL, DATE_FORMAT, CONCAT de números), así que en el resto
+# (p. ej. SQLite, que guarda los decimales como enteros o REAL) la huella se calcula en Python
+DIALECTOS_SQL = {"mysql"}
+
+def _expresion_campo_sql(columna, tipo):
+    """Codificación canónica de un campo en MySQL, equivalente a la de _formato_campo."""
+    if tipo is str:
+        valor = columna
+    elif tipo is int:
+        valor = f"CAST({columna} AS SIGNED)"
+    elif tipo is date:
+        valor = f"DATE_FORMAT({columna}, '%Y-%m-%d')"
+    elif isinstance(tipo, int):
+        # CAST a DECIMAL redondea la mitad hacia arriba, como _redondeo_canonico
+        valor = f"CAST({columna} AS DECIMAL(65, {tipo}))"
+    else:
+        raise ValueError(f"Tipo de campo no soportado en la huella: {tipo}")
+    prefijo, _ = _formato_campo(tipo)
+    return f"IFNULL(CONCAT('{prefijo}', {valor}), '{NULO}')"
+
+def expresion_sql(esquema, alias, backend=None, dialecto="mysql"):
+    """
+    Expresión MySQL que calcula en el servidor la misma huella que huella() sobre las columnas
+    alias.campo del esquema. Solo para los backends de BACKENDS_SQL y los dialectos de DIALECTOS_SQL.
+    """
+    backend = backend or HASH_BACKEND
+    if dialecto not in DIALECTOS_SQL:
+        raise ValueError(f"La huella no se puede calcular en una base {dialecto}")
+    columnas = [f"{alias}.{nombre}" for nombre in esquema.nombres]
+    if backend == "legacy":
+        # str() de un None en Python es "None"
+        return "SHA2(CONCAT(" + ", ".join(f"IFNULL({columna}, 'None')" for columna in columnas) + "), 256)"
+    if backend == "sha256":
+        campos = ", ".join(_expresion_campo_sql(columna, tipo) for columna, (_, tipo) in zip(columnas, esquema.campos))
+        return f"SHA2(CONCAT_WS(CHAR({ord(SEPARADOR)}), {campos}), 256)"
+    raise ValueError(f"El backend de hash {backend} no se puede calcular en SQL")
+
+def calculable_en_sql(dialecto, backend=None):
+    """Si una base del dialecto indicado calcula en el servidor la misma huella que Python."""
+    return dialecto in DIALECTOS_SQL and (backend or HASH_BACKEND) in BACKENDS_SQL
+
+def resolver_hash_en_origen(dialecto, solicitado, backend=None):
+    """
+    Si la huella se calcula en la base fuente: solo cuando se pide (SYNC_HASH_EN_ORIGEN) y la base
+    es de un dialecto de DIALECTOS_SQL. Si no lo es, se avisa y se calcula en Python.
+    """
+    if not solicitado:
+        return False
+    if calculable_en_sql(dialecto, backend):
+        return True
+    logging.warning(f"La base fuente {dialecto} no calcula la huella igual que Python: se calcula en Python.")
+    return False
+
+def validar_backend(backend=None, en_sql=False):
+    """
+    Falla al arrancar si el backend configurado no existe (p. ej. xxh3 sin el paquete xxhash)
+    o, con en_sql, si hace falta calcularlo en la base de datos y MySQL no lo soporta.
+    """
+    backend = backend or HASH_BACKEND
+    if backend != "legacy" and backend not in BACKENDS:
+        raise ValueError(f"Backend de hash no disponible: {backend}")
+    if en_sql and backend not in BACKENDS_SQL:
+        raise ValueError(f"El backend de hash {backend} no se puede calcular en SQL")
+    return backend
@@ -0,0 +1,233 @@
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+from config import DIRECTORIO_INSTANTANEAS, HASH_BACKEND, TAMANO_BLOQUE_INSTANTANEA
+
+# Formato del archivo: MAGIA, longitud de la cabecera JSON (uint32), la cabecera rellenada hasta
+# múltiplo de 8 bytes y luego los registros (codprod int64, hash ASCII de ancho fijo) ordenados por codprod
+MAGIA = b"SYNCHSH1"
+LONGITUD_CABECERA = struct.Struct("<I")
+
+class VistaInstantanea(namedtuple("VistaInstantanea", ["ruta", "identificador", "tamano_bloque", "bloques_invalidos"])):
+    """
+    Resultado de validar una instantánea contra el destino, liviano para enviarse a los workers con cada lote:
+    qué archivo abrir y qué bloques de codprod ya no coinciden con el destino y hay que leer de la base.
+    """
+    __slots__ = ()
+
+    @property
+    def completa(self):
+        return not self.bloques_invalidos
+
+    def cubre(self, desde, hasta):
+        """Si todos los bloques del rango [desde, hasta] de codprod coinciden con el destino."""
+        if not self.bloques_invalidos:
+            return True
+        return not any(
+            self.tamano_bloque * bloque <= hasta and desde < self.tamano_bloque * (bloque + 1)
+            for bloque in self.bloques_invalidos
+        )
+
+class _Claves:
+    """Secuencia de los codprod de los registros, leídos del mapa a demanda, para buscar con bisect."""
+
+    def __init__(self, instantanea):
+        self._instantanea = instantanea
+
+    def __len__(self):
+        return self._instantanea.filas
+
+    def __getitem__(self, posicion):
+        return struct.unpack_from("<q", self._instantanea._mapa, self._instantanea._desplazamiento(posicion))[0]
+
+class InstantaneaHashes:
+    """
+    Instantánea (codprod, hash) de una tabla del destino abierta con mmap: las búsquedas por rango son
+    búsquedas binarias sobre el archivo y los workers que la abren comparten las páginas en memoria.
+    """
+
+    def __init__(self, ruta):
+        with open(ruta, "rb") as archivo:
+            self._mapa = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mapa[:len(MAGIA)] != MAGIA:
+            self._mapa.close()
+            raise ValueError(f"{ruta} no es una instantánea de hashes")
+        (longitud,) = LONGITUD_CABECERA.unpack_from(self._mapa, len(MAGIA))
+        inicio_cabecera = len(MAGIA) + LONGITUD_CABECERA.size
+        self.cabecera = json.loads(self._mapa[inicio_cabecera:inicio_cabecera + longitud])
+        self.filas = self.cabecera["filas"]
+        self._registro = struct.Struct(f"<q{self.cabecera['ancho_hash']}s")
+        self._inicio = -(-(inicio_cabecera + longitud) // 8) * 8
+        self._claves = _Claves(self)
+
+    def _desplazamiento(self, posicion):
+        return self._inicio + posicion * self._registro.size
+
+    def _pares(self, desde_posicion, hasta_posicion):
+        datos = self._mapa[self._desplazamiento(desde_posicion):self._desplazamiento(hasta_posicion)]
+        for codprod, hash_destino in self._registro.iter_unpack(datos):
+            yield codprod, hash_destino.rstrip(b"\0").decode("ascii")
+
+    def rango(self, desde, hasta, codsede=None):
+        """
+        Índice {codprod: hash} (o {(codprod, codsede): hash} si se indica la sede, como el de las
+        existencias) de los registros con codprod en [desde, hasta].
+        """
+        inicio = bisect.bisect_left(self._claves, desde)
+        fin = bisect.bisect_right(self._claves, hasta, lo=inicio)
+        if codsede is None:
+            return dict(self._pares(inicio, fin))
+        return {(codprod, codsede): hash_destino for codprod, hash_destino in self._pares(inicio, fin)}
+
+    def items(self, codsede=None):
+        """Todos los pares en orden de codprod, con la clave de las existencias si se indica la sede."""
+        for codprod, hash_destino in self._pares(0, self.filas):
+            yield ((codprod, codsede) if codsede is not None else codprod), hash_destino
+
+    def cerrar(self):
+        self._mapa.close()
+
+# Instantáneas abiertas en este proceso por ruta, con el identificador del archivo que se mapeó
+_abiertas = {}
+
+def abrir_instantanea(vista):
+    """Abre (una vez por proceso y versión del archivo) la instantánea de la vista."""
+    identificador, instantanea = _abiertas.get(vista.ruta, (None, None))
+    if identificador != vista.identificador:
+        # La versión anterior deja de usarse; si algún worker aún tuviera el archivo viejo, su inodo sigue vivo
+        if instantanea is not None:
+            instantanea.cerrar()
+        instantanea = InstantaneaHashes(vista.ruta)
+        _abiertas[vista.ruta] = (vista.identificador, instantanea)
+    return instantanea
+
+def hashes_en_rango(vista, desde, hasta, codsede=None):
+    """
+    Índice de hashes del destino para el rango de codprod leído de la instantánea, o None si no hay
+    instantánea vigente para todo el rango y hay que consultar la base.
+    """
+    if vista is None or not vista.cubre(desde, hasta):
+        return None
+    return abrir_instantanea(vista).rango(desde, hasta, codsede)
+
+def ruta_instantanea(tabla, codsede=None):
+    """Archivo de la instantánea de productos o de las existencias de una sede; None si están desactivadas."""
+    if not DIRECTORIO_INSTANTANEAS:
+        return None
+    nombre = tabla if codsede is None else f"{tabla}_sede_{codsede}"
+    return os.path.join(DIRECTORIO_INSTANTANEAS, f"{nombre}.hsh")
+
+def checksum_hashes(pares, tamano_bloque):
+    """{bloque: [filas, checksum]} con el mismo BIT_XOR(CRC32(hash)) por bloque de codprod que calcula la base."""
+    bloques = {}
+    for codprod, hash_destino in pares:
+        bloque = bloques.setdefault(codprod // tamano_bloque, [0, 0])
+        bloque[0] += 1
+        if hash_destino is not None:
+            bloque[1] ^= zlib.crc32(hash_destino.encode("ascii"))
+    return bloques
+
+def validar_instantanea(ruta, obtener_checksums):
+    """
+    Compara la instantánea con el destino por bloques de codprod: obtener_checksums(tamano_bloque)
+    devuelve {bloque: (filas, checksum)} calculado en la base, sin traer sus filas. Devuelve la
+    VistaInstantanea con los bloques que difieren, o None si no hay instantánea utilizable.
+    """
+    if not ruta or not os.path.exists(ruta):
+        return None
+    try:
+        instantanea = InstantaneaHashes(ruta)
+        cabecera = instantanea.cabecera
+        instantanea.cerrar()
+        # Con otro backend cambian todas las huellas del destino
+        if cabecera["backend"] != HASH_BACKEND:
+            logging.info(f"  La instantánea {ruta} es del backend {cabecera['backend']}: se descarta.")
+            return None
+        tamano_bloque = cabecera["tamano_bloque"]
+        propios = {int(bloque): tuple(valores) for bloque, valores in cabecera["bloques"].items()}
+        destino = {int(bloque): (filas, int(checksum or 0)) for bloque, (filas, checksum) in obtener_checksums(tamano_bloque).items()}
+    except Exception as e:
+        logging.warning(f"  No se pudo validar la instantánea {ruta}: {str(e)}")
+        return None
+
+    invalidos = frozenset(bloque for bloque in propios.keys() | destino.keys() if propios.get(bloque) != destino.get(bloque))
+    total = len(propios.keys() | destino.keys())
+    logging.info(f"  Instantánea {ruta}: {total - len(invalidos)} de {total} bloques coinciden con el destino.")
+    return VistaInstantanea(ruta, cabecera["creada"], tamano_bloque, invalidos)
+
+def escribir_instantanea(ruta, pares, tamano_bloque=None):
+    """
+    Escribe la instantánea con los pares (codprod, hash) ordenados por codprod. Se escribe aparte y se
+    renombra, de modo que quien tenga mapeada la anterior la sigue leyendo entera.
+    """
+    tamano_bloque = tamano_bloque or TAMANO_BLOQUE_INSTANTANEA
+    pares = [(codprod, hash_destino or "") for codprod, hash_destino in pares]
+    ancho_hash = max((len(hash_destino) for _, hash_destino in pares), default=1) or 1
+    cabecera = json.dumps({
+        "backend": HASH_BACKEND,
+        "filas": len(pares),
+        "ancho_hash": ancho_hash,
+        "tamano_bloque": tamano_bloque,
+        "bloques": {str(bloque): valores for bloque, valores in checksum_hashes(pares, tamano_bloque).items()},
+        "creada": datetime.now().isoformat(timespec="microseconds"),
+    }).encode("utf-8")
+    registro = struct.Struct(f"<q{ancho_hash}s")
+
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    with open(ruta + ".tmp", "wb") as archivo:
+        archivo.write(MAGIA + LONGITUD_CABECERA.pack(len(cabecera)) + cabecera)
+        archivo.write(b"\0" * (-(len(MAGIA) + LONGITUD_CABECERA.size + len(cabecera)) % 8))
+        for codprod, hash_destino in pares:
+            archivo.write(registro.pack(codprod, hash_destino.encode("ascii")))
+    os.replace(ruta + ".tmp", ruta)
+    return len(pares)
+
+def fusionar_cambios(instantanea, cambios):
+    """Pares de la instantánea con los hashes escritos en la ejecución ({codprod: hash}) aplicados, en orden."""
+    pendientes = sorted(cambios.items())
+    posicion = 0
+    for codprod, hash_destino in instantanea.items():
+        while posicion < len(pendientes) and pendientes[posicion][0] < codprod:
+            yield pendientes[posicion]
+            posicion += 1
+        if posicion < len(pendientes) and pendientes[posicion][0] == codprod:
+            yield pendientes[posicion]
+            posicion += 1
+        else:
+            yield codprod, hash_destino
+    yield from pendientes[posicion:]
+
+def actualizar_instantanea(ruta, vista, cambios, leer_destino, completa=False):
+    """
+    Deja la instantánea al día tras una ejecución sin errores. Si la de partida coincidía entera con el
+    destino y la ejecución no fue una pasada completa (que además aplica bajas), se le aplican los
+    hashes escritos (cambios); si no, se rehace con leer_destino(), que devuelve {codprod: hash} del destino.
+    Un error solo se advierte: la próxima ejecución consultará el destino.
+    """
+    if not ruta:
+        return
+    try:
+        inicio = time.time()
+        if vista is not None and vista.completa and not completa:
+            if not cambios:
+                return
+            instantanea = InstantaneaHashes(ruta)
+            try:
+                filas = escribir_instantanea(ruta, fusionar_cambios(instantanea, cambios), vista.tamano_bloque)
+            finally:
+                instantanea.cerrar()
+            origen = f"{len(cambios)} cambios"
+        else:
+            filas = escribir_instantanea(ruta, sorted(leer_destino().items()))
+            origen = "el destino"
+        logging.info(f"  Instantánea {ruta} actualizada desde {origen}: {filas} filas en {time.time() - inicio:.2f} s.")
+    except Exception as e:
+        logging.warning(f"  No se pudo actualizar la instantánea {ruta}: {str(e)}")
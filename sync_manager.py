@@ -1,78 +1,49 @@
 import logging
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
-from sqlalchemy import create_engine, select, text
+from sqlalchemy import Date, String, create_engine, delete, func, insert, literal, literal_column, or_, select, text, update
 from sqlalchemy.orm import sessionmaker
 
-from models.existencia_origen import ExistenciaOrigen
+from models.existencia_origen import ExistenciaCruda, ExistenciaOrigen
 from models.existencia_sede import ExistenciaSede
+from models.imagen_producto import ImagenProducto
+from models.lote_columnas import LoteColumnas
 from models.producto_destino import Producto
-from models.producto_origen import ProductoOrigen
+from models.producto_origen import ProductoOrigen, ProductoProyectado
+from config import (
+    POOL_MAX_OVERFLOW,
+    POOL_PRE_PING,
+    POOL_RECYCLE,
+    POOL_SIZE,
+    TAMANO_LECTURA,
+    TAMANO_PARTICION,
+    UMBRAL_CONSULTA_INDIVIDUAL,
+)
+from sync_metricas import contar, etapa, instrumentar_engine
+from sync_precios import a_decimal
+from sync_writer import escribir_upsert
 
-class SyncManager:
-    def __init__(self, fuente_url, destino_url):
-        self.fuente_url = fuente_url
-        self.destino_url = destino_url
-        self.engine_fuente = create_engine(self.fuente_url)
-        self.engine_destino = create_engine(self.destino_url)
-        self.Session_fuente = sessionmaker(bind=self.engine_fuente)
-        self.Session_destino = sessionmaker(bind=self.engine_destino)
-
-    def iniciar_sesion_fuente(self):
-        return self.Session_fuente()
-
-    def iniciar_sesion_destino(self):
-        return self.Session_destino()
+# Únicas columnas del origen que usa la sincronización de productos, en el orden de ProductoProyectado
+COLUMNAS_PRODUCTO_ORIGEN = [
+    ProductoOrigen.codprod,
+    ProductoOrigen.nombre,
+    ProductoOrigen.precio,
+    ProductoOrigen.stock,
+    ProductoOrigen.pactivo,
+    ProductoOrigen.codmarca,
+    ProductoOrigen.CODBARRA01.label("codbarra01"),
+]
 
-    def obtener_productos_origen(self, session_fuente):
-        """Obtiene los productos de la base de datos fuente"""
-        query_fuente = select(ProductoOrigen)
-        return session_fuente.execute(query_fuente).scalars().all()
+# Columnas que se sobrescriben cuando la fila ya existe en destino
+COLUMNAS_UPSERT_PRODUCTO = ["nombre", "precio", "stock", "pactivo", "codmarca", "hash"]
+COLUMNAS_UPSERT_EXISTENCIA = [
+    "existencia", "precio_final", "precio_original", "precio_divisa_original",
+    "precio_divisa_final", "tasa_cambio", "descuento", "hash",
+]
 
-    def obtener_producto_destino(self, session_destino, codprod_origen):
-        """Obtiene un producto de la base de datos destino"""
-        return session_destino.query(Producto).filter(Producto.codprod == codprod_origen).first()
-
-    def actualizar_productos_batch(self, session_destino, productos_batch):
-        """
-        Actualiza un lote de productos en la base de datos destino.
-        """
-        logging.info("Actualizando lote de productos...")
-        for producto_destino, producto_origen, hash_fuente in productos_batch:
-            producto_destino.nombre = producto_origen.nombre
-            producto_destino.precio = producto_origen.precio
-            producto_destino.stock = producto_origen.stock
-            producto_destino.pactivo = producto_origen.pactivo
-            producto_destino.codmarca = producto_origen.codmarca
-            producto_destino.hash = hash_fuente
-        session_destino.commit()
-
-    def insertar_productos_batch(self, session_destino, productos_batch):
-        """
-        Inserta un lote de nuevos productos en la base de datos destino.
-        """
-        logging.info("Insertando lote de nuevos productos...")
-        nuevos_productos = []
-        for producto_origen, hash_fuente in productos_batch:
-            nuevo_producto = Producto(
-                codprod=producto_origen.codprod,
-                nombre=producto_origen.nombre,
-                precio=producto_origen.precio,
-                stock=producto_origen.stock,
-                pactivo=producto_origen.pactivo,
-                codmarca=1,
-                hash=hash_fuente,
-                created_at=datetime.now(),
-                updated_at=datetime.now(),
-                codbarra01=producto_origen.codbarra01
-            )
-            nuevos_productos.append(nuevo_producto)
-        session_destino.bulk_save_objects(nuevos_productos)
-        session_destino.commit()
-
-    def obtener_existencias_origen(self, session_fuente):
-        """Obtiene las existencias desde la base de datos fuente usando la consulta proporcionada"""
-        consulta = """
+# Consulta de precios y existencias del origen; {filtro} recibe condiciones adicionales sobre productos p
+# y {stock} la columna de existencia de la sede (stock, alm2 ... alm6)
+CONSULTA_EXISTENCIAS_ORIGEN = """
         SELECT 
     codprod, 
     nombre, 
@@ -165,26 +136,521 @@ FROM (
                     final, 
                     desc_oferta, 
                     codlin, 
-                    p.stock, 
+                    p.{stock} AS stock, 
                     codbarra01 AS barras, 
                     pactivo, 
                     lineas  
                 FROM 
                     productos p 
                 WHERE 
-                    p.stock > 0  
+                    p.{stock} > 0  
+                    {filtro}
             ) w 
             LEFT JOIN lineas l ON w.codlin = l.keycodigo
         ) x
     ) y
-) z;
+) z
+"""
+
+# Extracción plana de existencias: solo las columnas crudas de productos y el descuento de su línea
+# ({filtro} y {stock} como en CONSULTA_EXISTENCIAS_ORIGEN).
+# Los precios se calculan en sync_precios con la tasa y el IVA leídos una vez por ejecución
+CONSULTA_EXISTENCIAS_PLANA = """
+SELECT
+    p.codprod,
+    p.nombre,
+    p.precio,
+    p.tipoiva,
+    p.encarte,
+    p.inicio,
+    p.final,
+    p.desc_oferta,
+    p.codlin,
+    p.{stock} AS stock,
+    p.codbarra01 AS barras,
+    p.pactivo,
+    p.lineas,
+    l.descuento
+FROM productos p
+LEFT JOIN lineas l ON p.codlin = l.keycodigo
+WHERE
+    p.{stock} > 0
+    {filtro}
+"""
+
+# Catálogo del origen para la sincronización conjunta, sin filtro de stock: las columnas de
+# CONSULTA_EXISTENCIAS_PLANA (con stock, la del producto), codmarca y en {stocks} la existencia de cada sede
+CONSULTA_CATALOGO_ORIGEN = """
+SELECT
+    p.codprod,
+    p.nombre,
+    p.precio,
+    p.tipoiva,
+    p.encarte,
+    p.inicio,
+    p.final,
+    p.desc_oferta,
+    p.codlin,
+    p.stock,
+    p.codbarra01 AS barras,
+    p.pactivo,
+    p.lineas,
+    l.descuento,
+    p.codmarca{stocks}
+FROM productos p
+LEFT JOIN lineas l ON p.codlin = l.keycodigo
+WHERE 1 = 1
+    {filtro}
+"""
+
+# Constantes de precios que la consulta anidada vuelve a evaluar por fila
+CONSULTA_CONSTANTES_PRECIOS = """
+SELECT
+    CURDATE() AS fecha,
+    (SELECT tasa_cambio FROM monedas WHERE esrefprecio LIMIT 1) AS tasa_cambio,
+    (SELECT iva FROM areas LIMIT 1) AS iva,
+    (SELECT ivareducido FROM areas LIMIT 1) AS ivareducido,
+    (SELECT tasa3 FROM areas LIMIT 1) AS tasa3
+"""
+
+def filtro_marca_agua(marca_agua):
+    """
+    Condición sobre productos fuente para el modo incremental: filas con cambio de precio o venta
+    desde la fecha de la marca de agua, o creadas después del último keycodigo visto.
+    """
+    return or_(
+        ProductoOrigen.ucambio_precio >= marca_agua["fecha"],
+        ProductoOrigen.ultventa >= marca_agua["fecha"],
+        ProductoOrigen.keycodigo > marca_agua["keycodigo"],
+    )
+
+def filtro_rangos(columna, rangos):
+    """Condición columna BETWEEN desde AND hasta para alguno de los rangos [(desde, hasta), ...]."""
+    return or_(*(columna.between(desde, hasta) for desde, hasta in rangos))
+
+def filtro_rangos_sql(columna, rangos, parametros):
+    """Versión en SQL textual de filtro_rangos; agrega los límites a parametros."""
+    condiciones = []
+    for i, (desde, hasta) in enumerate(rangos):
+        parametros[f"rango_desde_{i}"] = desde
+        parametros[f"rango_hasta_{i}"] = hasta
+        condiciones.append(f"{columna} BETWEEN :rango_desde_{i} AND :rango_hasta_{i}")
+    return "(" + " OR ".join(condiciones) + ")"
+
+def filtro_claves_sql(columna, claves, parametros):
+    """Condición columna IN (...) en SQL textual; agrega las claves a parametros."""
+    marcadores = []
+    for i, clave in enumerate(claves):
+        parametros[f"clave_{i}"] = clave
+        marcadores.append(f":clave_{i}")
+    return f"{columna} IN ({', '.join(marcadores)})"
+
+def consulta_productos_origen(marca_agua=None, rangos=None, columnas=None):
+    """
+    SELECT de las columnas de ProductoProyectado (u otras columnas), ordenado por codprod,
+    con los filtros indicados.
+    """
+    query = select(*(columnas or COLUMNAS_PRODUCTO_ORIGEN))
+    if marca_agua is not None:
+        query = query.where(filtro_marca_agua(marca_agua))
+    if rangos:
+        query = query.where(filtro_rangos(ProductoOrigen.codprod, rangos))
+    return query.order_by(ProductoOrigen.codprod)
+
+def consulta_hashes_productos_origen(expresion_hash, marca_agua=None, rangos=None):
+    """
+    SELECT (codprod, hash) de los productos fuente, con el hash calculado en el servidor por
+    expresion_hash sobre la tabla productos sin alias.
+    """
+    columnas = [ProductoOrigen.codprod, literal_column(expresion_hash).label("hash")]
+    return consulta_productos_origen(marca_agua, rangos, columnas)
+
+def consulta_hashes_productos_destino(codprod_desde=None, codprod_hasta=None):
+    """SELECT (codprod, hash) de los productos destino, acotado opcionalmente a [desde, hasta]."""
+    query = select(Producto.codprod, Producto.hash)
+    if codprod_desde is not None:
+        query = query.where(Producto.codprod >= codprod_desde)
+    if codprod_hasta is not None:
+        query = query.where(Producto.codprod <= codprod_hasta)
+    return query
+
+def consulta_hashes_existencias_destino(codsede=None, codprod_desde=None, codprod_hasta=None):
+    """SELECT (product_codprod, codsede, hash) de las existencias destino, acotado por sede y rango."""
+    query = select(ExistenciaSede.product_codprod, ExistenciaSede.codsede, ExistenciaSede.hash)
+    if codsede is not None:
+        query = query.where(ExistenciaSede.codsede == codsede)
+    if codprod_desde is not None:
+        query = query.where(ExistenciaSede.product_codprod >= codprod_desde)
+    if codprod_hasta is not None:
+        query = query.where(ExistenciaSede.product_codprod <= codprod_hasta)
+    return query
+
+def filas_upsert_productos(productos_nuevos, productos_actualizados):
+    """Filas para el UPSERT de productos a partir de pares (producto_origen, hash_fuente)."""
+    ahora = datetime.now()
+    filas = []
+    for productos_batch, es_nuevo in ((productos_nuevos, True), (productos_actualizados, False)):
+        for producto_origen, hash_fuente in productos_batch:
+            filas.append({
+                "codprod": producto_origen.codprod,
+                "nombre": producto_origen.nombre,
+                "precio": producto_origen.precio,
+                "stock": producto_origen.stock,
+                "pactivo": producto_origen.pactivo,
+                # Los productos nuevos entran con la marca por defecto (1); los actualizados conservan la del origen
+                "codmarca": 1 if es_nuevo else producto_origen.codmarca,
+                "hash": hash_fuente,
+                "created_at": ahora,
+                "updated_at": ahora,
+                "codbarra01": producto_origen.codbarra01,
+            })
+    return filas
+
+def filas_upsert_existencias(existencias_nuevas, existencias_actualizadas, codsede=1):
+    """Filas para el UPSERT de existencias a partir de pares (existencia_origen, hash_fuente)."""
+    filas = []
+    for existencia_origen, hash_fuente in existencias_nuevas + existencias_actualizadas:
+        descuento = existencia_origen.descuento_porcentual
+        filas.append({
+            "product_codprod": existencia_origen.codprod,
+            "codsede": codsede,
+            "existencia": existencia_origen.stock,
+            "precio_original": existencia_origen.precio_original,
+            "precio_final": existencia_origen.precio_final,
+            "precio_divisa_original": existencia_origen.precio_divisas_original,
+            "precio_divisa_final": existencia_origen.precio_divisas_final,
+            "tasa_cambio": existencia_origen.tasa_cambio,
+            "descuento": descuento,
+            "tiene_descuento": descuento is not None and descuento > 0,
+            "hash": hash_fuente,
+        })
+    return filas
+
+def opciones_engine(url):
+    """Opciones del pool de conexiones para create_engine según la configuración."""
+    opciones = {"pool_pre_ping": POOL_PRE_PING, "pool_recycle": POOL_RECYCLE}
+    # SQLite usa pools propios que no aceptan tamaño ni desborde
+    if not url.startswith("sqlite"):
+        opciones.update({"pool_size": POOL_SIZE, "max_overflow": POOL_MAX_OVERFLOW})
+    return opciones
+
+class SyncManager:
+    def __init__(self, fuente_url, destino_url):
+        self.fuente_url = fuente_url
+        self.destino_url = destino_url
+        # Los engines se crean al usarse por primera vez: un worker que solo escribe
+        # en destino nunca abre conexiones contra la base fuente
+        self._engine_fuente = None
+        self._engine_destino = None
+        self._Session_fuente = None
+        self._Session_destino = None
+
+    @property
+    def engine_fuente(self):
+        if self._engine_fuente is None:
+            self._engine_fuente = instrumentar_engine(create_engine(self.fuente_url, **opciones_engine(self.fuente_url)))
+        return self._engine_fuente
+
+    @property
+    def engine_destino(self):
+        if self._engine_destino is None:
+            self._engine_destino = instrumentar_engine(create_engine(self.destino_url, **opciones_engine(self.destino_url)))
+        return self._engine_destino
+
+    @property
+    def Session_fuente(self):
+        if self._Session_fuente is None:
+            self._Session_fuente = sessionmaker(bind=self.engine_fuente)
+        return self._Session_fuente
+
+    @property
+    def Session_destino(self):
+        if self._Session_destino is None:
+            self._Session_destino = sessionmaker(bind=self.engine_destino)
+        return self._Session_destino
+
+    def iniciar_sesion_fuente(self):
+        return self.Session_fuente()
+
+    def iniciar_sesion_destino(self):
+        return self.Session_destino()
+
+    def cerrar(self, cerrar_conexiones=True):
+        """
+        Libera las conexiones de los pools abiertos. En un proceso hijo recién creado con fork se
+        llama con cerrar_conexiones=False: las conexiones heredadas son del padre y no deben cerrarse.
+        """
+        for engine in (self._engine_fuente, self._engine_destino):
+            if engine is not None:
+                engine.dispose(close=cerrar_conexiones)
+
+    def obtener_productos_origen(self, session_fuente):
+        """Obtiene los productos de la base de datos fuente"""
+        query_fuente = select(ProductoOrigen).order_by(ProductoOrigen.codprod)
+        return session_fuente.execute(query_fuente).scalars().all()
+
+    def obtener_marca_agua_origen(self, session_fuente):
+        """Toma la marca de agua actual del origen: su fecha y el mayor keycodigo."""
+        fecha, keycodigo = session_fuente.execute(
+            select(func.current_date(), func.max(ProductoOrigen.keycodigo))
+        ).one()
+        if isinstance(fecha, str):
+            fecha = date.fromisoformat(fecha)
+        return {"fecha": fecha, "keycodigo": keycodigo or 0}
+
+    def contar_productos_origen(self, session_fuente, marca_agua=None, rangos=None):
+        """Cuenta los productos de la base de datos fuente (solo los candidatos a cambio si hay marca de agua o rangos)"""
+        query = select(func.count()).select_from(ProductoOrigen)
+        if marca_agua is not None:
+            query = query.where(filtro_marca_agua(marca_agua))
+        if rangos:
+            query = query.where(filtro_rangos(ProductoOrigen.codprod, rangos))
+        return session_fuente.execute(query).scalar()
+
+    def obtener_tramos_codprod_origen(self, session_fuente, tramos, rangos=None, metodo="muestreo"):
+        """
+        Divide los codprod del origen (dentro de rangos, si se indican) en hasta tramos rangos contiguos
+        [(desde, hasta), ...] para leerlos en paralelo. Con "minmax" se parte en partes iguales el
+        intervalo entre MIN y MAX; con "muestreo" los límites son los codprod en las posiciones
+        1/tramos, 2/tramos, ... del índice, de modo que cada tramo tiene las mismas filas.
+        """
+        consulta_limites = select(func.min(ProductoOrigen.codprod), func.max(ProductoOrigen.codprod), func.count())
+        consulta_posicion = select(ProductoOrigen.codprod).order_by(ProductoOrigen.codprod).limit(1)
+        if rangos:
+            consulta_limites = consulta_limites.where(filtro_rangos(ProductoOrigen.codprod, rangos))
+            consulta_posicion = consulta_posicion.where(filtro_rangos(ProductoOrigen.codprod, rangos))
+        minimo, maximo, filas = session_fuente.execute(consulta_limites).one()
+        if minimo is None:
+            return []
+        if metodo == "minmax":
+            paso = (maximo - minimo + 1) / tramos
+            limites = [minimo + int(paso * i) for i in range(1, tramos)]
+        elif metodo == "muestreo":
+            limites = [
+                session_fuente.execute(consulta_posicion.offset(filas * i // tramos)).scalar()
+                for i in range(1, tramos)
+            ]
+        else:
+            raise ValueError(f"Método de límites de extracción no válido: {metodo}")
+        limites = sorted({limite for limite in limites if minimo < limite <= maximo})
+        inicios = [minimo] + limites
+        return list(zip(inicios, [limite - 1 for limite in limites] + [maximo]))
+
+    def obtener_particiones_productos_origen(self, session_fuente, tamano_particion=None, marca_agua=None, rangos=None):
+        """
+        Recorre los productos fuente en particiones de tamano_particion filas (listas de
+        ProductoProyectado), ordenadas por codprod.
+        Solo se seleccionan las columnas que usa la sincronización y se leen por streaming (yield_per),
+        sin cargar el catálogo completo en memoria. El cursor del servidor solo se aprovecha con drivers
+        que lo soportan (p. ej. mysql+pymysql); mysqlconnector siempre usa cursores con buffer.
+        Con marca_agua solo se leen los productos que pudieron cambiar desde entonces y con
+        rangos [(desde, hasta), ...] solo los codprod dentro de alguno de ellos.
         """
-        result = session_fuente.execute(text(consulta)).fetchall()
-        existencias = []
-        for row in result:
-            existencia = ExistenciaOrigen(*row)  # Mapear los valores de la tupla a la clase
-            existencias.append(existencia)
-        return existencias
+        tamano_particion = tamano_particion or TAMANO_PARTICION
+        query = consulta_productos_origen(marca_agua, rangos).execution_options(yield_per=tamano_particion)
+        resultado = session_fuente.execute(query)
+        for particion in resultado.partitions():
+            yield list(map(ProductoProyectado._make, particion))
+
+    def obtener_particiones_hashes_productos_origen(self, session_fuente, expresion_hash, tamano_particion=None, marca_agua=None, rangos=None):
+        """
+        Primera fase de la lectura con hash en origen: recorre en particiones los pares
+        (codprod, hash) de los productos fuente, con el hash calculado por el servidor.
+        Admite los mismos filtros que obtener_particiones_productos_origen.
+        """
+        tamano_particion = tamano_particion or TAMANO_PARTICION
+        query = consulta_hashes_productos_origen(expresion_hash, marca_agua, rangos)
+        resultado = session_fuente.execute(query.execution_options(yield_per=tamano_particion))
+        for particion in resultado.partitions():
+            yield [tuple(fila) for fila in particion]
+
+    def obtener_productos_origen_por_codprod(self, session_fuente, codprods):
+        """Segunda fase de la lectura con hash en origen: columnas completas de los codprod indicados."""
+        query = select(*COLUMNAS_PRODUCTO_ORIGEN).where(ProductoOrigen.codprod.in_(codprods)).order_by(ProductoOrigen.codprod)
+        return list(map(ProductoProyectado._make, session_fuente.execute(query)))
+
+    def obtener_producto_destino(self, session_destino, codprod_origen):
+        """Obtiene un producto de la base de datos destino"""
+        return session_destino.query(Producto).filter(Producto.codprod == codprod_origen).first()
+
+    def obtener_hashes_productos_destino(self, session_destino, codprod_desde=None, codprod_hasta=None):
+        """
+        Obtiene un índice {codprod: hash} de los productos destino con una sola consulta.
+        Si se indican límites, solo se cargan los codprod dentro del rango [desde, hasta].
+        """
+        query = consulta_hashes_productos_destino(codprod_desde, codprod_hasta)
+        resultado = session_destino.execute(query.execution_options(yield_per=TAMANO_LECTURA))
+        return {codprod: hash_destino for codprod, hash_destino in resultado}
+
+    def obtener_checksums_productos_destino(self, session_destino, tamano_bloque):
+        """
+        {bloque: (filas, checksum)} de los productos destino por bloques de tamano_bloque codprod, con
+        BIT_XOR(CRC32(hash)) calculado en el servidor: valida la instantánea local sin traer filas.
+        """
+        bloque = (Producto.codprod // tamano_bloque).label("bloque")
+        query = select(bloque, func.count(), func.bit_xor(func.crc32(Producto.hash))).group_by(bloque)
+        return {int(numero): (filas, checksum) for numero, filas, checksum in session_destino.execute(query)}
+
+    def obtener_codprods_destino(self, session_destino, solo_con_stock=False):
+        """Conjunto de codprod de los productos destino (con solo_con_stock, los que aún tienen stock)."""
+        query = select(Producto.codprod)
+        if solo_con_stock:
+            query = query.where(Producto.stock != 0)
+        return set(session_destino.execute(query.execution_options(yield_per=TAMANO_LECTURA)).scalars())
+
+    def bajas_productos_destino(self, session_destino, codprods, borrar=False):
+        """
+        Da de baja productos del destino con una sola sentencia: los borra o deja su stock en 0.
+        El hash vacío hace que vuelvan a escribirse si reaparecen en el origen. No hace commit.
+        """
+        if borrar:
+            query = delete(Producto).where(Producto.codprod.in_(codprods))
+        else:
+            query = update(Producto).where(Producto.codprod.in_(codprods)).values(stock=0, hash="")
+        return session_destino.execute(query.execution_options(synchronize_session=False)).rowcount
+
+    def insertar_imagenes_faltantes_destino(self, session_destino):
+        """
+        Crea la imagen principal de cada producto destino que aún no tiene ninguna con un solo
+        INSERT ... SELECT. La url sigue la convención del catálogo: 'static/' + nombre con los
+        espacios cambiados por '_', sin paréntesis ni '%', y '.jpg'. No hace commit.
+        Devuelve el número de imágenes creadas.
+        """
+        archivo = Producto.nombre
+        for caracter, reemplazo in ((" ", "_"), ("(", ""), (")", ""), ("%", "")):
+            archivo = func.replace(archivo, caracter, reemplazo, type_=String)
+        sin_imagen = ~select(ImagenProducto.id).where(ImagenProducto.product_codprod == Producto.codprod).exists()
+        query = insert(ImagenProducto).from_select(
+            ["product_codprod", "url", "altname", "is_primary", "created_at", "updated_at"],
+            select(
+                Producto.codprod,
+                literal("static/") + archivo + literal(".jpg"),
+                Producto.nombre,
+                literal(True),
+                func.now(),
+                func.now(),
+            ).where(Producto.nombre.is_not(None), sin_imagen),
+        )
+        return session_destino.execute(query).rowcount
+
+    def upsert_productos_batch(self, session_destino, productos_nuevos, productos_actualizados):
+        """
+        Escribe productos nuevos y actualizados en un único flujo de INSERT ... ON DUPLICATE KEY UPDATE.
+        Ambas listas contienen pares (producto_origen, hash_fuente).
+        """
+        filas = filas_upsert_productos(productos_nuevos, productos_actualizados)
+        contar("filas_nuevas", len(productos_nuevos))
+        contar("filas_actualizadas", len(productos_actualizados))
+        with etapa("escritura", len(filas)):
+            escribir_upsert(session_destino, Producto.__table__, filas, COLUMNAS_UPSERT_PRODUCTO)
+        with etapa("commit"):
+            session_destino.commit()
+
+    def obtener_tasa_cambio_origen(self, session_fuente):
+        """Obtiene la tasa de cambio de referencia vigente en la base de datos fuente"""
+        return session_fuente.execute(text("SELECT tasa_cambio FROM monedas WHERE esrefprecio LIMIT 1")).scalar()
+
+    def filtro_existencias_origen(self, marca_agua=None, rangos=None, codprods=None):
+        """
+        Condiciones adicionales sobre productos p de las consultas de existencias, y sus parámetros.
+        Con marca_agua solo se leen los productos que pudieron cambiar desde entonces, incluidos
+        los que entran o salen de una oferta por fecha. Con rangos [(desde, hasta), ...] solo los
+        codprod dentro de alguno de ellos y con codprods solo esos codprod.
+        """
+        condiciones = []
+        parametros = {}
+        if marca_agua is not None:
+            condiciones.append("""(
+                        p.ucambio_precio >= :fecha
+                        OR p.ultventa >= :fecha
+                        OR p.keycodigo > :keycodigo
+                        OR p.inicio BETWEEN :fecha_oferta AND CURDATE()
+                        OR p.final BETWEEN :fecha_oferta AND CURDATE()
+                    )""")
+            parametros.update({
+                "fecha": marca_agua["fecha"],
+                "keycodigo": marca_agua["keycodigo"],
+                # Las ofertas se activan el día siguiente a inicio, por eso se mira un día antes
+                "fecha_oferta": marca_agua["fecha"] - timedelta(days=1),
+            })
+        if rangos:
+            condiciones.append(filtro_rangos_sql("p.codprod", rangos, parametros))
+        if codprods:
+            condiciones.append(filtro_claves_sql("p.codprod", codprods, parametros))
+
+        return "".join(f"AND {condicion}\n" for condicion in condiciones), parametros
+
+    def consulta_existencias_origen(self, marca_agua=None, rangos=None, codprods=None, columna_stock="stock"):
+        """
+        Arma la consulta de existencias del origen y sus parámetros, con los filtros de filtro_existencias_origen
+        y la existencia leída de columna_stock.
+        """
+        filtro, parametros = self.filtro_existencias_origen(marca_agua, rangos, codprods)
+        return CONSULTA_EXISTENCIAS_ORIGEN.format(filtro=filtro, stock=columna_stock), parametros
+
+    def obtener_filas_existencias_origen(self, session_fuente, marca_agua=None, rangos=None, codprods=None, columna_stock="stock"):
+        """
+        Obtiene las existencias fuente como LoteColumnas con los campos de ExistenciaOrigen; al
+        iterarlo da tuplas simples, listas para enviarse a los workers sin serializar objetos.
+        """
+        consulta, parametros = self.consulta_existencias_origen(marca_agua, rangos, codprods, columna_stock)
+        result = session_fuente.execute(text(consulta + "ORDER BY codprod"), parametros)
+        return LoteColumnas.desde_filas(ExistenciaOrigen._fields, result)
+
+    def obtener_constantes_precios_origen(self, session_fuente):
+        """Lee una sola vez la fecha del servidor, la tasa de cambio y los porcentajes de IVA."""
+        constantes = dict(session_fuente.execute(text(CONSULTA_CONSTANTES_PRECIOS)).mappings().one())
+        if isinstance(constantes["fecha"], str):
+            constantes["fecha"] = date.fromisoformat(constantes["fecha"])
+        for nombre in ("tasa_cambio", "iva", "ivareducido", "tasa3"):
+            constantes[nombre] = a_decimal(constantes[nombre])
+        return constantes
+
+    def obtener_filas_crudas_existencias_origen(self, session_fuente, marca_agua=None, rangos=None, columna_stock="stock"):
+        """
+        Extracción plana de existencias: LoteColumnas con las columnas crudas de CONSULTA_EXISTENCIAS_PLANA
+        (campos de ExistenciaCruda), sin subconsultas por fila. Los precios se calculan después con sync_precios.calcular_existencias.
+        """
+        filtro, parametros = self.filtro_existencias_origen(marca_agua, rangos)
+        consulta = text(CONSULTA_EXISTENCIAS_PLANA.format(filtro=filtro, stock=columna_stock) + "ORDER BY p.codprod").columns(
+            inicio=Date, final=Date
+        )
+        return LoteColumnas.desde_filas(ExistenciaCruda._fields, session_fuente.execute(consulta, parametros))
+
+    def obtener_particiones_catalogo_origen(self, session_fuente, columnas_stock, tamano_particion=None, marca_agua=None, rangos=None):
+        """
+        Lectura única de la sincronización conjunta: recorre por streaming, en particiones ordenadas por
+        codprod, las filas de CONSULTA_CATALOGO_ORIGEN con la existencia de cada columna de columnas_stock
+        al final (stock_0, stock_1, ...). Con marca_agua aplica el filtro de las existencias, que incluye
+        al de los productos. Con rangos [(desde, hasta), ...] solo los codprod dentro de alguno de ellos.
+        """
+        tamano_particion = tamano_particion or TAMANO_PARTICION
+        filtro, parametros = self.filtro_existencias_origen(marca_agua, rangos)
+        stocks = "".join(f",\n    p.{columna} AS stock_{posicion}" for posicion, columna in enumerate(columnas_stock))
+        # precio y stock del producto con los tipos del ORM, como en obtener_particiones_productos_origen;
+        # las existencias de las sedes tal como las devuelve el driver, como en la extracción plana
+        consulta = text(CONSULTA_CATALOGO_ORIGEN.format(filtro=filtro, stocks=stocks) + "ORDER BY p.codprod").columns(
+            inicio=Date, final=Date, precio=ProductoOrigen.precio.type, stock=ProductoOrigen.stock.type
+        )
+        resultado = session_fuente.execute(consulta.execution_options(yield_per=tamano_particion), parametros)
+        for particion in resultado.partitions():
+            yield [tuple(fila) for fila in particion]
+
+    def obtener_hashes_existencias_origen(self, session_fuente, expresion_hash, marca_agua=None, rangos=None, columna_stock="stock"):
+        """
+        Primera fase de la lectura con hash en origen: pares (codprod, hash) de la consulta de
+        existencias, con el hash calculado por el servidor con expresion_hash sobre el alias e.
+        Se devuelven como LoteColumnas de los campos codprod y hash.
+        """
+        consulta, parametros = self.consulta_existencias_origen(marca_agua, rangos, columna_stock=columna_stock)
+        result = session_fuente.execute(
+            text(f"SELECT e.codprod, {expresion_hash} AS hash FROM ({consulta}) e ORDER BY e.codprod"), parametros
+        )
+        return LoteColumnas.desde_filas(("codprod", "hash"), result)
+
+    def obtener_existencias_origen(self, session_fuente, marca_agua=None, rangos=None):
+        """Obtiene las existencias desde la base de datos fuente usando la consulta proporcionada"""
+        return list(self.obtener_filas_existencias_origen(session_fuente, marca_agua, rangos).filas(ExistenciaOrigen))
 
     def obtener_todas_existencias_destino(self, session_destino):
         """Obtiene todas las existencias de la base de datos destino."""
@@ -197,36 +663,124 @@ FROM (
         return session_destino.query(ExistenciaSede).filter(ExistenciaSede.product_codprod == codprod_origen,
                                                             ExistenciaSede.codsede == codsede_origen).first()
 
-    def actualizar_existencias_batch(self, session_destino, existencias_batch):
-        """Actualiza un lote de existencias en la base de datos destino."""
-        for existencia_destino, existencia_origen, hash_fuente in existencias_batch:
-            existencia_destino.existencia = existencia_origen.stock
-            existencia_destino.precio_final = existencia_origen.precio_final
-            existencia_destino.precio_original = existencia_origen.precio_original
-            existencia_destino.precio_divisa_original = existencia_origen.precio_divisas_original
-            existencia_destino.precio_divisa_final = existencia_origen.precio_divisas_final
-            existencia_destino.tasa_cambio = existencia_origen.tasa_cambio
-            existencia_destino.descuento = existencia_origen.descuento_porcentual
-            existencia_destino.hash = hash_fuente
-        session_destino.commit()
-
-    def insertar_existencias_batch(self, session_destino, existencias_batch):
-        """Inserta un lote de nuevas existencias en la base de datos destino."""
-        nuevas_existencias = []
-        for existencia_origen, hash_fuente in existencias_batch:
-            nueva_existencia = ExistenciaSede(
-                product_codprod=existencia_origen.codprod,
-                codsede=1,
-                existencia=existencia_origen.stock,
-                precio_original=existencia_origen.precio_original,
-                precio_final=existencia_origen.precio_final,
-                precio_divisa_original=existencia_origen.precio_divisas_original,
-                precio_divisa_final=existencia_origen.precio_divisas_final,
-                tasa_cambio=existencia_origen.tasa_cambio,
-                descuento=existencia_origen.descuento_porcentual,
-                tiene_descuento=existencia_origen.descuento_porcentual > 0,
-                hash=hash_fuente
+    def obtener_hashes_existencias_destino(self, session_destino, codsede=None, codprod_desde=None, codprod_hasta=None):
+        """
+        Obtiene un índice {(product_codprod, codsede): hash} de las existencias destino con una sola consulta.
+        Se puede acotar por sede y por rango de codprod [desde, hasta].
+        """
+        query = consulta_hashes_existencias_destino(codsede, codprod_desde, codprod_hasta)
+        resultado = session_destino.execute(query.execution_options(yield_per=TAMANO_LECTURA))
+        return {(codprod, codsede_destino): hash_destino for codprod, codsede_destino, hash_destino in resultado}
+
+    def obtener_checksums_existencias_destino(self, session_destino, codsede, tamano_bloque):
+        """{bloque: (filas, checksum)} de las existencias destino de la sede, como obtener_checksums_productos_destino."""
+        bloque = (ExistenciaSede.product_codprod // tamano_bloque).label("bloque")
+        query = (
+            select(bloque, func.count(), func.bit_xor(func.crc32(ExistenciaSede.hash)))
+            .where(ExistenciaSede.codsede == codsede)
+            .group_by(bloque)
+        )
+        return {int(numero): (filas, checksum) for numero, filas, checksum in session_destino.execute(query)}
+
+    def obtener_indice_existencias_destino(self, session_destino, claves):
+        """
+        Construye el índice {(product_codprod, codsede): hash} para las claves indicadas.
+        Con pocas claves consulta una por una; en otro caso carga de una vez el rango que las cubre.
+        """
+        if len(claves) <= UMBRAL_CONSULTA_INDIVIDUAL:
+            indice = {}
+            for codprod, codsede in claves:
+                existencia_destino = self.obtener_existencia_destino(session_destino, codprod, codsede)
+                if existencia_destino is not None:
+                    indice[(codprod, codsede)] = existencia_destino.hash
+            return indice
+
+        codprods = [codprod for codprod, _ in claves]
+        sedes = {codsede for _, codsede in claves}
+        codsede = sedes.pop() if len(sedes) == 1 else None
+        return self.obtener_hashes_existencias_destino(session_destino, codsede, min(codprods), max(codprods))
+
+    def obtener_sedes_destino(self, session_destino):
+        """Sedes que tienen existencias en la base de datos destino."""
+        query = select(ExistenciaSede.codsede).distinct().order_by(ExistenciaSede.codsede)
+        return session_destino.execute(query).scalars().all()
+
+    def obtener_lineas_productos_origen(self, session_fuente):
+        """Índice {codprod: codlin} de los productos fuente, para recalcular hashes sin releer las existencias."""
+        query = select(ProductoOrigen.codprod, ProductoOrigen.codlin)
+        resultado = session_fuente.execute(query.execution_options(yield_per=TAMANO_LECTURA))
+        return {codprod: codlin for codprod, codlin in resultado}
+
+    def revaluar_existencias_destino(self, session_destino, codsede, tasa_cambio):
+        """
+        Aplica una nueva tasa de cambio a todas las existencias de una sede con un único UPDATE:
+        recalcula los precios en divisas a partir de los precios en bolívares ya guardados.
+        No hace commit. Devuelve el número de filas afectadas.
+        """
+        query = (
+            update(ExistenciaSede)
+            .where(ExistenciaSede.codsede == codsede)
+            .values(
+                precio_divisa_original=func.round(ExistenciaSede.precio_original / tasa_cambio, 2),
+                precio_divisa_final=func.round(ExistenciaSede.precio_final / tasa_cambio, 2),
+                tasa_cambio=tasa_cambio,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        return session_destino.execute(query).rowcount
+
+    def obtener_valores_hash_existencias_destino(self, session_destino, codsede):
+        """Columnas del destino que entran en el hash de existencias de una sede, ordenadas por codprod."""
+        query = (
+            select(
+                ExistenciaSede.product_codprod,
+                ExistenciaSede.existencia,
+                ExistenciaSede.precio_final,
+                ExistenciaSede.precio_divisa_final,
+                ExistenciaSede.descuento,
             )
-            nuevas_existencias.append(nueva_existencia)
-        session_destino.bulk_save_objects(nuevas_existencias)
-        session_destino.commit()
\ No newline at end of file
+            .where(ExistenciaSede.codsede == codsede)
+            .order_by(ExistenciaSede.product_codprod)
+        )
+        return [tuple(fila) for fila in session_destino.execute(query)]
+
+    def actualizar_hashes_existencias_batch(self, session_destino, codsede, hashes):
+        """Actualiza por clave primaria solo el hash de las existencias {codprod: hash} de una sede. No hace commit."""
+        valores = [
+            {"product_codprod": codprod, "codsede": codsede, "hash": hash_fuente}
+            for codprod, hash_fuente in hashes.items()
+        ]
+        if valores:
+            session_destino.execute(update(ExistenciaSede), valores)
+
+    def obtener_codprods_existencias_destino(self, session_destino, codsede, solo_con_existencia=False):
+        """Conjunto de codprod con existencias de una sede en el destino (opcionalmente solo con existencia)."""
+        query = select(ExistenciaSede.product_codprod).where(ExistenciaSede.codsede == codsede)
+        if solo_con_existencia:
+            query = query.where(ExistenciaSede.existencia != 0)
+        return set(session_destino.execute(query.execution_options(yield_per=TAMANO_LECTURA)).scalars())
+
+    def bajas_existencias_destino(self, session_destino, codsede, codprods, borrar=False):
+        """
+        Da de baja existencias de una sede con una sola sentencia: las borra o deja su existencia
+        en 0 (con hash vacío, para que se reescriban si vuelven a tener stock). No hace commit.
+        """
+        condicion = (ExistenciaSede.codsede == codsede) & ExistenciaSede.product_codprod.in_(codprods)
+        if borrar:
+            query = delete(ExistenciaSede).where(condicion)
+        else:
+            query = update(ExistenciaSede).where(condicion).values(existencia=0, hash="")
+        return session_destino.execute(query.execution_options(synchronize_session=False)).rowcount
+
+    def upsert_existencias_batch(self, session_destino, existencias_nuevas, existencias_actualizadas, codsede=1):
+        """
+        Escribe existencias nuevas y actualizadas en un único flujo de INSERT ... ON DUPLICATE KEY UPDATE.
+        Ambas listas contienen pares (existencia_origen, hash_fuente).
+        """
+        filas = filas_upsert_existencias(existencias_nuevas, existencias_actualizadas, codsede)
+        contar("filas_nuevas", len(existencias_nuevas))
+        contar("filas_actualizadas", len(existencias_actualizadas))
+        with etapa("escritura", len(filas)):
+            escribir_upsert(session_destino, ExistenciaSede.__table__, filas, COLUMNAS_UPSERT_EXISTENCIA)
+        with etapa("commit"):
+            session_destino.commit()
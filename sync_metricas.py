@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import event
+
+from config import METRICAS_ARCHIVO, METRICAS_PROMETHEUS, NUM_WORKERS
+
+# Tipos de sentencia que se cuentan por separado; el resto va a "otra"
+TIPOS_SENTENCIA = ("select", "insert", "update", "delete")
+
+class Metricas:
+    """
+    Tiempos y filas por etapa y contadores de una corrida. Cada proceso tiene la suya: la de un worker
+    se reinicia en cada lote y vuelve con el resultado para sumarse a la del proceso principal.
+    """
+
+    def __init__(self):
+        self.etapas = {}
+        self.contadores = {}
+        # Las sedes corren en hilos y los resultados de los workers llegan por el hilo del pool
+        self._lock = threading.Lock()
+
+    def registrar_etapa(self, nombre, segundos, filas=0, llamadas=1):
+        with self._lock:
+            etapa = self.etapas.setdefault(nombre, {"segundos": 0.0, "llamadas": 0, "filas": 0})
+            etapa["segundos"] += segundos
+            etapa["llamadas"] += llamadas
+            etapa["filas"] += filas
+
+    def contar(self, nombre, cantidad=1):
+        with self._lock:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + cantidad
+
+    def fusionar(self, datos):
+        """Suma las métricas serializadas con a_dict (las de un lote de un worker)."""
+        for nombre, etapa in datos["etapas"].items():
+            self.registrar_etapa(nombre, etapa["segundos"], etapa["filas"], etapa["llamadas"])
+        for nombre, cantidad in datos["contadores"].items():
+            self.contar(nombre, cantidad)
+
+    def a_dict(self):
+        with self._lock:
+            return {
+                "etapas": {nombre: dict(etapa) for nombre, etapa in self.etapas.items()},
+                "contadores": dict(self.contadores),
+            }
+
+_metricas = Metricas()
+
+def reiniciar_metricas():
+    """Empieza a medir de cero en este proceso y devuelve el nuevo acumulador."""
+    global _metricas
+    _metricas = Metricas()
+    return _metricas
+
+def fusionar_metricas(datos):
+    _metricas.fusionar(datos)
+
+def contar(nombre, cantidad=1):
+    _metricas.contar(nombre, cantidad)
+
+@contextmanager
+def etapa(nombre, filas=0):
+    """
+    Cronometra el bloque como una ejecución de la etapa nombre que procesó filas filas. Si las filas
+    solo se conocen al final, el bloque puede fijarlas en medicion["filas"].
+    """
+    medicion = {"filas": filas}
+    inicio = time.perf_counter()
+    try:
+        yield medicion
+    finally:
+        _metricas.registrar_etapa(nombre, time.perf_counter() - inicio, medicion["filas"])
+
+def medir_iterable(nombre, particiones):
+    """
+    Deja pasar las particiones (listas de filas) de un generador de extracción cargando a la etapa
+    nombre el tiempo que tarda en producir cada una, sin contar lo que hace después quien la consume.
+    """
+    iterador = iter(particiones)
+    while True:
+        inicio = time.perf_counter()
+        try:
+            particion = next(iterador)
+        except StopIteration:
+            _metricas.registrar_etapa(nombre, time.perf_counter() - inicio, llamadas=0)
+            return
+        _metricas.registrar_etapa(nombre, time.perf_counter() - inicio, len(particion))
+        yield particion
+
+def _tipo_sentencia(sentencia):
+    palabras = sentencia.lstrip(" \t\r\n(").split(None, 1)
+    tipo = palabras[0].lower() if palabras else ""
+    return tipo if tipo in TIPOS_SENTENCIA else "otra"
+
+def _antes_de_sentencia(conexion, cursor, sentencia, parametros, contexto, executemany):
+    conexion.info.setdefault("metricas_inicios", []).append(time.perf_counter())
+    tipo = _tipo_sentencia(sentencia)
+    _metricas.contar("sentencias")
+    _metricas.contar(f"sentencias_{tipo}")
+    # Un executemany de INSERT viaja como INSERT multi-fila; el de UPDATE o DELETE, una vez por fila
+    _metricas.contar("viajes", len(parametros) if executemany and tipo != "insert" else 1)
+
+def _despues_de_sentencia(conexion, cursor, sentencia, parametros, contexto, executemany):
+    inicios = conexion.info.get("metricas_inicios")
+    if inicios:
+        _metricas.registrar_etapa("espera_sql", time.perf_counter() - inicios.pop())
+
+def _al_confirmar(conexion):
+    _metricas.contar("commits")
+
+def instrumentar_engine(engine):
+    """
+    Cuenta las sentencias (en total y por tipo), los viajes al servidor y los commits del engine, y
+    acumula en la etapa espera_sql el tiempo que se esperó a la base (se solapa con las demás etapas).
+    """
+    event.listen(engine, "before_cursor_execute", _antes_de_sentencia)
+    event.listen(engine, "after_cursor_execute", _despues_de_sentencia)
+    event.listen(engine, "commit", _al_confirmar)
+    return engine
+
+def resumen_workers(estadisticas, duracion):
+    """Lotes, tiempos por lote y utilización del pool a partir de las EstadisticasLotes de la corrida."""
+    duraciones = sorted(d for e in estadisticas for d in e.duraciones)
+    if not duraciones:
+        return {}
+    ocupado = sum(duraciones)
+    por_worker = {}
+    for e in estadisticas:
+        for pid, segundos in e.tiempo_por_worker.items():
+            por_worker[str(pid)] = round(por_worker.get(str(pid), 0.0) + segundos, 4)
+    return {
+        "lotes": len(duraciones),
+        "filas": sum(e.filas for e in estadisticas),
+        "segundos_ocupados": round(ocupado, 4),
+        "p50": round(duraciones[len(duraciones) // 2], 4),
+        "p95": round(duraciones[min(len(duraciones) - 1, int(len(duraciones) * 0.95))], 4),
+        "maximo": round(duraciones[-1], 4),
+        # Fracción del tiempo de la corrida en que los NUM_WORKERS procesos estuvieron trabajando
+        "utilizacion": round(ocupado / (duracion * NUM_WORKERS), 4) if duracion else None,
+        "por_worker": por_worker,
+    }
+
+def _etiquetas(**etiquetas):
+    return ",".join(f'{nombre}="{valor}"' for nombre, valor in etiquetas.items())
+
+def formato_prometheus(reporte):
+    """Reporte de una corrida en el formato de texto de Prometheus (para el textfile collector)."""
+    corrida = reporte["corrida"]
+    lineas = [
+        "# TYPE sync_duracion_segundos gauge",
+        f"sync_duracion_segundos{{{_etiquetas(corrida=corrida)}}} {reporte['duracion']}",
+        "# TYPE sync_ultima_ejecucion_timestamp gauge",
+        f"sync_ultima_ejecucion_timestamp{{{_etiquetas(corrida=corrida)}}} {reporte['fin']}",
+        "# TYPE sync_etapa_segundos gauge",
+    ]
+    for nombre, datos in reporte["etapas"].items():
+        lineas.append(f"sync_etapa_segundos{{{_etiquetas(corrida=corrida, etapa=nombre)}}} {datos['segundos']:.6f}")
+    lineas.append("# TYPE sync_etapa_filas gauge")
+    for nombre, datos in reporte["etapas"].items():
+        lineas.append(f"sync_etapa_filas{{{_etiquetas(corrida=corrida, etapa=nombre)}}} {datos['filas']}")
+    lineas.append("# TYPE sync_contador gauge")
+    for nombre, cantidad in reporte["contadores"].items():
+        lineas.append(f"sync_contador{{{_etiquetas(corrida=corrida, nombre=nombre)}}} {cantidad}")
+    lineas.append("# TYPE sync_filas gauge")
+    for nombre, cantidad in reporte["resultado"].items():
+        lineas.append(f"sync_filas{{{_etiquetas(corrida=corrida, resultado=nombre)}}} {cantidad}")
+    if reporte["workers"].get("utilizacion") is not None:
+        lineas.append("# TYPE sync_utilizacion_workers gauge")
+        lineas.append(f"sync_utilizacion_workers{{{_etiquetas(corrida=corrida)}}} {reporte['workers']['utilizacion']}")
+    return "\n".join(lineas) + "\n"
+
+def exportar_reporte(corrida, inicio, resultado=None, estadisticas=()):
+    """
+    Arma el reporte de la corrida (etapas, contadores, resultado y uso de los workers) con las
+    métricas acumuladas desde reiniciar_metricas, lo agrega como una línea JSON a SYNC_METRICAS_ARCHIVO
+    y, si SYNC_METRICAS_PROMETHEUS indica un directorio, escribe ahí sync_<corrida>.prom.
+    Un error al escribir solo se advierte: no debe hacer fallar la sincronización. Devuelve el reporte.
+    """
+    fin = time.time()
+    duracion = fin - inicio
+    reporte = {
+        "corrida": corrida,
+        "inicio": datetime.fromtimestamp(inicio).isoformat(timespec="seconds"),
+        "fin": round(fin, 3),
+        "duracion": round(duracion, 4),
+        "resultado": resultado or {},
+        **_metricas.a_dict(),
+        "workers": resumen_workers(estadisticas, duracion),
+    }
+    for datos in reporte["etapas"].values():
+        datos["segundos"] = round(datos["segundos"], 6)
+
+    try:
+        if METRICAS_ARCHIVO:
+            with open(METRICAS_ARCHIVO, "a", encoding="utf-8") as archivo:
+                archivo.write(json.dumps(reporte, ensure_ascii=False) + "\n")
+        if METRICAS_PROMETHEUS:
+            ruta = os.path.join(METRICAS_PROMETHEUS, f"sync_{corrida}.prom")
+            # Se escribe aparte y se renombra para que el collector nunca lea un archivo a medias
+            with open(ruta + ".tmp", "w", encoding="utf-8") as archivo:
+                archivo.write(formato_prometheus(reporte))
+            os.replace(ruta + ".tmp", ruta)
+    except OSError as e:
+        logging.warning(f"No se pudo escribir el reporte de métricas de {corrida}: {str(e)}")
+    return reporte
@@ -0,0 +1,103 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+# Decimales que MySQL agrega a la escala del dividendo al dividir (div_precision_increment)
+INCREMENTO_DIVISION = 4
+
+CIEN = Decimal(100)
+UNO = Decimal(1)
+
+def a_decimal(valor):
+    """Convierte a Decimal lo que devuelva el driver (Decimal, int, float o str); None se mantiene."""
+    if valor is None or isinstance(valor, Decimal):
+        return valor
+    return Decimal(str(valor))
+
+def redondear(valor, decimales=2):
+    """ROUND(valor, decimales) de MySQL sobre DECIMAL: la mitad se redondea alejándose de cero."""
+    if valor is None:
+        return None
+    return valor.quantize(UNO.scaleb(-decimales), rounding=ROUND_HALF_UP)
+
+def dividir(dividendo, divisor):
+    """
+    dividendo / divisor como en MySQL: el resultado tiene la escala del dividendo más
+    INCREMENTO_DIVISION y dividir por cero (o por NULL) da NULL.
+    """
+    if dividendo is None or not divisor:
+        return None
+    escala = max(-dividendo.as_tuple().exponent, 0) + INCREMENTO_DIVISION
+    return redondear(dividendo / divisor, escala)
+
+def porcentaje_iva(tipoiva, constantes):
+    """Porcentaje de IVA según el tipo del producto y los porcentajes de areas."""
+    if tipoiva == "NORMAL":
+        return constantes["iva"]
+    if tipoiva == "REDUCIDO":
+        return constantes["ivareducido"]
+    if tipoiva == "TASA3":
+        return constantes["tasa3"]
+    return Decimal(0)
+
+def calcular_existencia(fila, constantes):
+    """
+    Calcula los precios de una fila cruda (en el orden de CONSULTA_EXISTENCIAS_PLANA) igual que
+    CONSULTA_EXISTENCIAS_ORIGEN y la devuelve como tupla en el orden de ExistenciaOrigen.
+    """
+    (codprod, nombre, precio, tipoiva, encarte, inicio, final, desc_oferta,
+     codlin, stock, barras, pactivo, lineas, descuento) = fila
+    # precio y desc_oferta son DECIMAL(18, 2): se fija esa escala aunque el driver devuelva otra cosa,
+    # porque de ella depende la escala de las divisiones
+    precio = redondear(a_decimal(precio))
+    desc_oferta = redondear(a_decimal(desc_oferta))
+    descuento = a_decimal(descuento)
+    hoy = constantes["fecha"]
+    tasa_cambio = constantes["tasa_cambio"]
+
+    # La oferta rige si hay encarte, hoy está estrictamente entre inicio y final y tiene precio
+    en_oferta = (
+        encarte is not None and encarte > 0
+        and inicio is not None and final is not None and inicio < hoy < final
+        and desc_oferta is not None and desc_oferta > 0
+    )
+    con_descuento = descuento is not None and descuento > 0
+
+    if en_oferta:
+        precio_final = desc_oferta
+        porcentaje = dividir(precio - desc_oferta, precio) if precio is not None else None
+        descuento_porcentual = redondear(porcentaje * CIEN) if porcentaje is not None else None
+    elif con_descuento:
+        precio_final = precio * (UNO - dividir(descuento, CIEN)) if precio is not None else None
+        descuento_porcentual = descuento
+    else:
+        precio_final = precio
+        descuento_porcentual = None
+
+    # Como en SQL, un NULL en cualquier operando deja NULL el resultado
+    poriva = porcentaje_iva(tipoiva, constantes)
+    fraccion_iva = dividir(poriva, CIEN)
+    preciomasiva = precio * (UNO + fraccion_iva) if precio is not None and fraccion_iva is not None else None
+
+    return (
+        codprod,
+        nombre,
+        redondear(precio),
+        redondear(precio_final),
+        redondear(dividir(precio, tasa_cambio)),
+        redondear(dividir(precio_final, tasa_cambio)),
+        poriva,
+        redondear(preciomasiva),
+        redondear(preciomasiva - precio_final) if preciomasiva is not None and precio_final is not None else None,
+        tasa_cambio,
+        stock,
+        barras,
+        pactivo,
+        codlin,
+        lineas,
+        "Sí" if en_oferta or con_descuento else "No",
+        redondear(desc_oferta) if en_oferta else None,
+        descuento_porcentual,
+    )
+
+def calcular_existencias(filas, constantes):
+    """Etapa de precios de un lote de filas crudas; las constantes se leen una vez por ejecución."""
+    return [calcular_existencia(fila, constantes) for fila in filas]
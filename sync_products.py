@@ -1,75 +1,269 @@
 import logging
-from tqdm import tqdm
-from multiprocessing import Pool, cpu_count
-from config import FUENTE_URL, DESTINO_URL, configurar_logger
-from sync_manager import SyncManager
-import hashlib
+from itertools import chain
+from config import HASH_EN_ORIGEN, TAMANO_LOTE, TAMANO_PARTICION, configurar_logger
+from sync_worker import obtener_sync_manager, usar_pool
+from sync_scheduler import ejecutar_lotes, en_lotes
+from sync_bajas import procesar_bajas_productos, registrar_claves
+from sync_diff import calcular_diferencias
+from sync_extraccion import extraer_particiones
+from sync_huella import Esquema, expresion_sql, huella, huellas_lote, resolver_hash_en_origen, validar_backend
+from sync_estado import (
+    CODPROD_MAXIMO,
+    PuntoControl,
+    cargar_estado,
+    obtener_marca_agua,
+    obtener_punto_control,
+    registrar_sincronizacion,
+)
+from sync_metricas import etapa, exportar_reporte, medir_iterable, reiniciar_metricas
+from sync_instantanea import abrir_instantanea, actualizar_instantanea, hashes_en_rango, ruta_instantanea, validar_instantanea
 from datetime import datetime
+from functools import partial
 import time
 
+# Campos del producto que forman su hash y su tipo (la escala, en los decimales)
+ESQUEMA_HASH = Esquema([
+    ("nombre", str),
+    ("precio", 2),
+    ("stock", 3),
+    ("pactivo", str),
+    ("codmarca", int),
+])
+
 def calcular_hash(producto_origen):
     """Genera un hash de los campos relevantes del producto."""
-    campos = (
-        f"{producto_origen.nombre}{producto_origen.precio}{producto_origen.stock}"
-        f"{producto_origen.pactivo}{producto_origen.codmarca}"
-    )
-    return hashlib.sha256(campos.encode('utf-8')).hexdigest()
+    return huella(producto_origen, ESQUEMA_HASH)
+
+def calcular_hashes(productos_origen):
+    """Genera los hashes de un lote de productos en una sola llamada."""
+    return huellas_lote(productos_origen, ESQUEMA_HASH)
+
+def expresion_hash_sql(alias="productos"):
+    """El mismo hash que calcular_hash, calculado en MySQL sobre la tabla productos con el alias indicado."""
+    return expresion_sql(ESQUEMA_HASH, alias)
+
+def obtener_clave(producto_origen):
+    """Clave con la que se compara un producto contra el destino."""
+    return producto_origen.codprod
 
-def procesar_chunk(productos_chunk):
+def leer_indice_destino(sync_manager, session_destino, codprods, vista=None):
+    """
+    Índice {codprod: hash} del destino para el rango de codprod que cubren los del chunk: de la
+    instantánea local si está vigente para todo el rango y, si no, con una consulta al destino.
+    """
+    indice_destino = None
+    if vista is not None:
+        with etapa("lectura_instantanea"):
+            indice_destino = hashes_en_rango(vista, min(codprods), max(codprods))
+    if indice_destino is None:
+        with etapa("lectura_destino"):
+            indice_destino = sync_manager.obtener_hashes_productos_destino(session_destino, min(codprods), max(codprods))
+    return indice_destino
+
+def hashes_escritos(diferencias):
+    """Pares (codprod, hash) que el chunk escribió en el destino, para actualizar la instantánea."""
+    return [(obtener_clave(fila), hash_fuente) for fila, hash_fuente in diferencias.nuevos + diferencias.actualizados]
+
+def procesar_chunk(productos_chunk, vista=None):
     """Función para procesar un chunk de productos."""
-    sync_manager = SyncManager(FUENTE_URL, DESTINO_URL)
-    session_destino = sync_manager.iniciar_sesion_destino()
+    sync_manager = obtener_sync_manager()
+    with sync_manager.iniciar_sesion_destino() as session_destino:
+        # Solo se carga del destino el rango de codprod que cubre el chunk
+        codprods = [obtener_clave(producto_origen) for producto_origen in productos_chunk]
+        indice_destino = leer_indice_destino(sync_manager, session_destino, codprods, vista)
 
-    batched_productos_actualizados = []
-    batched_productos_nuevos = []
+        with etapa("hash", len(productos_chunk)):
+            hashes = calcular_hashes(productos_chunk)
+        with etapa("diferencias", len(productos_chunk)):
+            diferencias = calcular_diferencias(productos_chunk, indice_destino, obtener_clave, calcular_hash, hashes=hashes)
 
-    for producto_origen in productos_chunk:
-        codprod_origen = producto_origen.codprod
-        hash_fuente = calcular_hash(producto_origen)
+        if diferencias.nuevos or diferencias.actualizados:
+            sync_manager.upsert_productos_batch(session_destino, diferencias.nuevos, diferencias.actualizados)
 
-        producto_destino = sync_manager.obtener_producto_destino(session_destino, codprod_origen)
+    return len(diferencias.actualizados), len(diferencias.nuevos), hashes_escritos(diferencias)
 
-        if producto_destino:
-            if producto_destino.hash != hash_fuente:
-                batched_productos_actualizados.append((producto_destino, producto_origen, hash_fuente))
-        else:
-            batched_productos_nuevos.append((producto_origen, hash_fuente))
+def procesar_chunk_hashes(hashes_chunk, vista=None):
+    """
+    Procesa un chunk de pares (codprod, hash) calculados en origen: compara con el destino y
+    solo lee del origen las columnas completas de los productos nuevos o cambiados.
+    """
+    sync_manager = obtener_sync_manager()
+    with sync_manager.iniciar_sesion_destino() as session_destino:
+        codprods = [codprod for codprod, _ in hashes_chunk]
+        indice_destino = leer_indice_destino(sync_manager, session_destino, codprods, vista)
+        with etapa("diferencias", len(hashes_chunk)):
+            hashes_origen = {codprod: hash_fuente for codprod, hash_fuente in hashes_chunk if indice_destino.get(codprod) != hash_fuente}
+
+        if not hashes_origen:
+            return 0, 0, []
+
+        with sync_manager.iniciar_sesion_fuente() as session_fuente, etapa("extraccion", len(hashes_origen)):
+            productos_chunk = sync_manager.obtener_productos_origen_por_codprod(session_fuente, list(hashes_origen))
 
-    if batched_productos_actualizados:
-        sync_manager.actualizar_productos_batch(session_destino, batched_productos_actualizados)
+        diferencias = calcular_diferencias(
+            productos_chunk,
+            indice_destino,
+            obtener_clave,
+            calcular_hash,
+            hashes=[hashes_origen[obtener_clave(producto_origen)] for producto_origen in productos_chunk],
+        )
 
-    if batched_productos_nuevos:
-        sync_manager.insertar_productos_batch(session_destino, batched_productos_nuevos)
+        if diferencias.nuevos or diferencias.actualizados:
+            sync_manager.upsert_productos_batch(session_destino, diferencias.nuevos, diferencias.actualizados)
 
-    session_destino.close()
-    return len(batched_productos_actualizados), len(batched_productos_nuevos)
+    return len(diferencias.actualizados), len(diferencias.nuevos), hashes_escritos(diferencias)
 
-def sincronizar_productos():
+def cargar_indice(sync_manager, indice, vista=None):
+    """
+    Carga en el índice en memoria los hashes de todos los productos del destino si aún no los tiene:
+    de la instantánea local si coincide entera con el destino o, si no, del destino.
+    """
+    if indice.cargado:
+        return
+    with etapa("indice_destino") as medicion:
+        if vista is not None and vista.completa:
+            indice.cargar(abrir_instantanea(vista).items())
+        else:
+            session_destino = sync_manager.iniciar_sesion_destino()
+            indice.cargar(sync_manager.obtener_hashes_productos_destino(session_destino))
+            session_destino.close()
+        medicion["filas"] = len(indice.hashes)
+
+def leer_hashes_destino(sync_manager):
+    """{codprod: hash} de todos los productos del destino, para rehacer la instantánea."""
+    session_destino = sync_manager.iniciar_sesion_destino()
+    try:
+        return sync_manager.obtener_hashes_productos_destino(session_destino)
+    finally:
+        session_destino.close()
+
+def sincronizar_productos(incremental=False, rangos=None, simular_bajas=False, pool=None, indice=None, reanudar=False):
+    """
+    Sincroniza los productos fuente con el destino.
+    En modo incremental solo se leen los productos que pudieron cambiar desde la última marca de agua,
+    salvo que toque la reconciliación completa periódica. Con rangos [(desde, hasta), ...] solo se
+    sincronizan esos codprod y no se toca el estado persistido. Con SYNC_HASH_EN_ORIGEN el hash se
+    calcula en la base fuente (si es MySQL) y solo se leen completos los productos que cambiaron.
+    Las pasadas completas dan de baja los productos del destino que ya no están en el origen
+    (con simular_bajas solo se informa cuántos serían).
+    El servicio residente pasa su pool de workers y su IndiceHashes de productos: en las pasadas
+    incrementales no se envían a los workers los productos cuyo hash no cambió desde la última escritura.
+    Con SYNC_INSTANTANEAS los workers leen los hashes del destino de la instantánea local en los bloques
+    de codprod en que sigue coincidiendo con el destino, y al terminar la instantánea se actualiza.
+    Con SYNC_CONEXIONES_EXTRACCION > 1 el origen se lee por tramos de codprod en paralelo.
+    Mientras corre se guarda un punto de control con el último codprod hasta el que todo quedó
+    confirmado; con reanudar, si la ejecución anterior se interrumpió, se retoma desde ahí con su
+    misma marca de agua en vez de empezar de cero.
+    """
     inicio = time.time()
     configurar_logger()
+    reiniciar_metricas()
 
     try:
         logging.info("Iniciando la sincronización de productos...")
+        validar_backend(en_sql=HASH_EN_ORIGEN)
+
+        estado = cargar_estado()
+        reanudacion = obtener_punto_control(estado, "productos") if reanudar and not rangos else None
+        marca_agua = obtener_marca_agua(estado, "productos") if incremental else None
 
-        sync_manager = SyncManager(FUENTE_URL, DESTINO_URL)
+        # El SyncManager del proceso: en el servicio residente sus engines siguen abiertos entre ciclos
+        sync_manager = obtener_sync_manager()
+        hash_en_origen = resolver_hash_en_origen(sync_manager.engine_fuente.dialect.name, HASH_EN_ORIGEN)
         session_fuente = sync_manager.iniciar_sesion_fuente()
-        productos_origen = sync_manager.obtener_productos_origen(session_fuente)
-        session_fuente.close()
+        nueva_marca_agua = sync_manager.obtener_marca_agua_origen(session_fuente)
+
+        # Al reanudar solo se leen los codprod posteriores al último confirmado, con la marca de agua
+        # de la ejecución interrumpida, y al terminar se registra la que ella tomó
+        rangos_lectura = rangos
+        desde_codprod = None
+        if reanudacion is not None:
+            marca_agua = reanudacion["marca_agua"]
+            nueva_marca_agua = reanudacion["nueva_marca_agua"]
+            desde_codprod = reanudacion["codprod"]
+            if desde_codprod is not None:
+                rangos_lectura = [(desde_codprod + 1, CODPROD_MAXIMO)]
+            logging.info(f"Se reanuda la sincronización interrumpida de productos después del codprod {desde_codprod}.")
+
+        if marca_agua is not None:
+            logging.info(f"Modo incremental: productos con cambios desde {marca_agua['fecha']} o keycodigo > {marca_agua['keycodigo']}.")
+        elif incremental:
+            logging.info("Modo incremental: toca reconciliación completa.")
+
+        total_productos = sync_manager.contar_productos_origen(session_fuente, marca_agua, rangos_lectura)
 
-        if not productos_origen:
+        if not total_productos and marca_agua is None and not rangos_lectura:
             logging.warning("No se encontraron productos en la base de datos fuente.")
+            session_fuente.close()
             return
 
-        logging.info(f"Se encontraron {len(productos_origen)} productos en la base de datos fuente.")
+        logging.info(f"Se encontraron {total_productos} productos en la base de datos fuente.")
 
-        # Dividir productos en chunks para multiprocesamiento
-        num_chunks = cpu_count()
-        chunk_size = len(productos_origen) // num_chunks
-        chunks = [productos_origen[i:i + chunk_size] for i in range(0, len(productos_origen), chunk_size)]
+        ruta = ruta_instantanea("productos")
+        vista = None
+        if ruta:
+            with etapa("validar_instantanea"):
+                session_destino = sync_manager.iniciar_sesion_destino()
+                vista = validar_instantanea(
+                    ruta, lambda tamano: sync_manager.obtener_checksums_productos_destino(session_destino, tamano)
+                )
+                session_destino.close()
+
+        # Las particiones leídas por streaming se reparten en lotes pequeños entre los workers
+        if hash_en_origen:
+            leer = partial(
+                sync_manager.obtener_particiones_hashes_productos_origen,
+                expresion_hash=expresion_hash_sql(),
+                tamano_particion=TAMANO_PARTICION,
+                marca_agua=marca_agua,
+            )
+            funcion = partial(procesar_chunk_hashes, vista=vista)
+        else:
+            leer = partial(sync_manager.obtener_particiones_productos_origen, tamano_particion=TAMANO_PARTICION, marca_agua=marca_agua)
+            funcion = partial(procesar_chunk, vista=vista)
+        particiones = extraer_particiones(sync_manager, session_fuente, leer, rangos_lectura)
+        claves_origen = set()
+        particiones = medir_iterable("extraccion", particiones)
+        filas = registrar_claves(chain.from_iterable(particiones), claves_origen)
+        if indice is not None and marca_agua is not None:
+            cargar_indice(sync_manager, indice, vista)
+            obtener_hash = (lambda fila: fila[1]) if hash_en_origen else calcular_hash
+            filas = indice.filtrar(filas, lambda fila: fila[0], obtener_hash)
+        lotes = en_lotes(filas, TAMANO_LOTE)
+        total_lotes = -(-total_productos // TAMANO_LOTE)
 
         # Procesar en paralelo
-        with Pool(processes=num_chunks) as pool:
-            resultados = list(tqdm(pool.imap(procesar_chunk, chunks), total=len(chunks), desc="Procesando en paralelo", unit="chunk"))
+        try:
+            with usar_pool(pool) as pool_lotes:
+                punto_control = None if rangos else PuntoControl(estado, "productos", marca_agua, nueva_marca_agua, desde_codprod)
+                resultados, estadisticas = ejecutar_lotes(pool_lotes, funcion, lotes, total_lotes, punto_control=punto_control)
+        finally:
+            session_fuente.close()
+
+        # Tras una pasada completa (que además aplica bajas) el índice se vuelve a cargar del destino
+        if indice is not None:
+            if marca_agua is not None:
+                indice.confirmar()
+            elif not rangos:
+                indice.invalidar()
+
+        if not rangos:
+            registrar_sincronizacion(estado, "productos", nueva_marca_agua, completa=marca_agua is None)
+
+        # Solo una pasada completa ve todas las claves del origen
+        if marca_agua is None and not rangos:
+            with etapa("bajas"):
+                procesar_bajas_productos(sync_manager, claves_origen, simular_bajas, desde_codprod=desde_codprod)
+
+        if ruta:
+            with etapa("escribir_instantanea"):
+                actualizar_instantanea(
+                    ruta,
+                    vista,
+                    {codprod: hash_fuente for r in resultados for codprod, hash_fuente in r[2]},
+                    lambda: leer_hashes_destino(sync_manager),
+                    completa=marca_agua is None and not rangos,
+                )
 
         # Resumir resultados
         total_actualizados = sum(r[0] for r in resultados)
@@ -84,6 +278,10 @@ def sincronizar_productos():
         logging.info(f"  Hora de inicio: {datetime.fromtimestamp(inicio).strftime('%Y-%m-%d %H:%M:%S')}")
         logging.info(f"  Hora de finalización: {datetime.fromtimestamp(fin).strftime('%Y-%m-%d %H:%M:%S')}")
         logging.info(f"  Duración del proceso: {duracion:.2f} segundos")
+        estadisticas.resumir()
+        exportar_reporte(
+            "productos", inicio, {"actualizados": total_actualizados, "nuevos": total_nuevos}, [estadisticas]
+        )
 
     except Exception as e:
         logging.error(f"Error durante la sincronización: {str(e)}")
@@ -0,0 +1,183 @@
+import logging
+import time
+from itertools import chain
+
+from sqlalchemy import text
+
+from config import FUENTE_URL, DESTINO_URL, TAMANOS_BLOQUE_RECONCILIACION, configurar_logger
+from models.existencia_origen import ExistenciaOrigen
+from sync_huella import calculable_en_sql, validar_backend
+from sync_instantanea import checksum_hashes
+from sync_sedes import SEDE_PRINCIPAL
+from sync_manager import SyncManager, filtro_rangos_sql
+import sync_existencia
+import sync_products
+
+# Si un nivel deja más rangos que esto se sincronizan tal cual, sin seguir bajando de nivel
+MAX_RANGOS_DIVERGENTES = 1000
+
+def expresion_bloque(dialecto, columna, tamano):
+    """Número de bloque de una clave entera: división entera por el tamaño del bloque."""
+    if dialecto == "mysql":
+        return f"{columna} DIV {int(tamano)}"
+    # En SQLite la división entre enteros ya es entera
+    return f"({columna} / {int(tamano)})"
+
+def _where(condiciones):
+    return ("WHERE " + " AND ".join(condiciones)) if condiciones else ""
+
+def _ejecutar_checksums(session, consulta, parametros):
+    """Devuelve {bloque: (filas, checksum)} a partir de una consulta agrupada por bloque."""
+    resultado = session.execute(text(consulta), parametros)
+    return {bloque: (filas, checksum) for bloque, filas, checksum in resultado}
+
+def checksums_python(pares, tamano):
+    """{bloque: (filas, checksum)} de pares (codprod, hash) con la huella calculada en Python."""
+    return {bloque: tuple(valores) for bloque, valores in checksum_hashes(pares, tamano).items()}
+
+def checksums_productos_origen(sync_manager, session_fuente, tamano, rangos=None):
+    """
+    Checksum BIT_XOR(CRC32(hash)) por bloque de codprod de los productos fuente: calculado en el
+    servidor si la base calcula la huella igual que Python (MySQL) y, si no, leyendo los productos.
+    """
+    dialecto = session_fuente.get_bind().dialect.name
+    if not calculable_en_sql(dialecto):
+        productos = chain.from_iterable(sync_manager.obtener_particiones_productos_origen(session_fuente, rangos=rangos))
+        return checksums_python(((producto.codprod, sync_products.calcular_hash(producto)) for producto in productos), tamano)
+    parametros = {}
+    condiciones = [filtro_rangos_sql("p.codprod", rangos, parametros)] if rangos else []
+    bloque = expresion_bloque(dialecto, "p.codprod", tamano)
+    consulta = f"""
+        SELECT {bloque} AS bloque, COUNT(*) AS filas, BIT_XOR(CRC32({sync_products.expresion_hash_sql("p")})) AS checksum
+        FROM productos p
+        {_where(condiciones)}
+        GROUP BY bloque
+    """
+    return _ejecutar_checksums(session_fuente, consulta, parametros)
+
+def checksums_productos_destino(session_destino, tamano, rangos=None):
+    """Checksum BIT_XOR(CRC32(hash)) por bloque de codprod de los productos destino."""
+    parametros = {}
+    condiciones = [filtro_rangos_sql("d.codprod", rangos, parametros)] if rangos else []
+    bloque = expresion_bloque(session_destino.get_bind().dialect.name, "d.codprod", tamano)
+    consulta = f"""
+        SELECT {bloque} AS bloque, COUNT(*) AS filas, BIT_XOR(CRC32(d.hash)) AS checksum
+        FROM productos d
+        {_where(condiciones)}
+        GROUP BY bloque
+    """
+    return _ejecutar_checksums(session_destino, consulta, parametros)
+
+def checksums_existencias_origen(sync_manager, session_fuente, tamano, rangos=None):
+    """
+    Checksum BIT_XOR(CRC32(hash)) por bloque de codprod de la consulta de existencias fuente, en el
+    servidor o en Python como checksums_productos_origen.
+    """
+    dialecto = session_fuente.get_bind().dialect.name
+    if not calculable_en_sql(dialecto):
+        existencias = map(ExistenciaOrigen._make, sync_manager.obtener_filas_existencias_origen(session_fuente, rangos=rangos))
+        return checksums_python(((existencia.codprod, sync_existencia.calcular_hash(existencia)) for existencia in existencias), tamano)
+    consulta_existencias, parametros = sync_manager.consulta_existencias_origen(rangos=rangos)
+    bloque = expresion_bloque(dialecto, "e.codprod", tamano)
+    consulta = f"""
+        SELECT {bloque} AS bloque, COUNT(*) AS filas, BIT_XOR(CRC32({sync_existencia.expresion_hash_sql("e")})) AS checksum
+        FROM ({consulta_existencias}) e
+        GROUP BY bloque
+    """
+    return _ejecutar_checksums(session_fuente, consulta, parametros)
+
+def checksums_existencias_destino(session_destino, tamano, rangos=None, codsede=1):
+    """Checksum BIT_XOR(CRC32(hash)) por bloque de codprod de las existencias destino de una sede."""
+    parametros = {"codsede": codsede}
+    condiciones = ["d.codsede = :codsede"]
+    if rangos:
+        condiciones.append(filtro_rangos_sql("d.product_codprod", rangos, parametros))
+    bloque = expresion_bloque(session_destino.get_bind().dialect.name, "d.product_codprod", tamano)
+    consulta = f"""
+        SELECT {bloque} AS bloque, COUNT(*) AS filas, BIT_XOR(CRC32(d.hash)) AS checksum
+        FROM existencias_sede d
+        {_where(condiciones)}
+        GROUP BY bloque
+    """
+    return _ejecutar_checksums(session_destino, consulta, parametros)
+
+def bloques_divergentes(checksums_origen, checksums_destino):
+    """Bloques cuyo número de filas o checksum difiere entre origen y destino, o que faltan en un lado."""
+    bloques = checksums_origen.keys() | checksums_destino.keys()
+    return sorted(bloque for bloque in bloques if checksums_origen.get(bloque) != checksums_destino.get(bloque))
+
+def bloques_a_rangos(bloques, tamano):
+    """Convierte números de bloque ordenados en rangos de codprod [(desde, hasta)], uniendo los contiguos."""
+    rangos = []
+    for bloque in bloques:
+        desde, hasta = bloque * tamano, (bloque + 1) * tamano - 1
+        if rangos and rangos[-1][1] + 1 == desde:
+            rangos[-1] = (rangos[-1][0], hasta)
+        else:
+            rangos.append((desde, hasta))
+    return rangos
+
+def localizar_rangos_divergentes(checksums_origen, checksums_destino, tamanos=None):
+    """
+    Compara checksums por bloque de mayor a menor tamaño, bajando de nivel solo dentro de los
+    bloques que difieren. checksums_origen/destino son funciones (tamano, rangos) -> {bloque: (filas, checksum)}.
+    Devuelve los rangos de codprod que hay que sincronizar.
+    """
+    rangos = None
+    for tamano in tamanos or TAMANOS_BLOQUE_RECONCILIACION:
+        bloques = bloques_divergentes(checksums_origen(tamano, rangos), checksums_destino(tamano, rangos))
+        nuevos_rangos = bloques_a_rangos(bloques, tamano)
+        logging.info(f"  Bloques de {tamano}: {len(bloques)} divergentes")
+        if not nuevos_rangos:
+            return []
+        if len(nuevos_rangos) > MAX_RANGOS_DIVERGENTES:
+            return rangos or nuevos_rangos
+        rangos = nuevos_rangos
+    return rangos
+
+def reconciliar():
+    """
+    Localiza los rangos de codprod en los que origen y destino difieren comparando checksums
+    agregados en cada base y sincroniza solo esos rangos, para productos y existencias.
+    """
+    inicio = time.time()
+    configurar_logger()
+
+    try:
+        logging.info("Iniciando la reconciliación por checksums de rangos...")
+        validar_backend()
+
+        sync_manager = SyncManager(FUENTE_URL, DESTINO_URL)
+        session_fuente = sync_manager.iniciar_sesion_fuente()
+        session_destino = sync_manager.iniciar_sesion_destino()
+
+        logging.info("Comparando productos...")
+        rangos_productos = localizar_rangos_divergentes(
+            lambda tamano, rangos: checksums_productos_origen(sync_manager, session_fuente, tamano, rangos),
+            lambda tamano, rangos: checksums_productos_destino(session_destino, tamano, rangos),
+        )
+
+        logging.info("Comparando existencias...")
+        rangos_existencias = localizar_rangos_divergentes(
+            lambda tamano, rangos: checksums_existencias_origen(sync_manager, session_fuente, tamano, rangos),
+            lambda tamano, rangos: checksums_existencias_destino(session_destino, tamano, rangos),
+        )
+
+        session_fuente.close()
+        session_destino.close()
+
+        logging.info(f"Rangos divergentes: {len(rangos_productos)} de productos, {len(rangos_existencias)} de existencias.")
+
+        if rangos_productos:
+            sync_products.sincronizar_productos(rangos=rangos_productos)
+        if rangos_existencias:
+            # Los checksums comparan la sede principal
+            sync_existencia.sincronizar_existencias(rangos=rangos_existencias, sedes=[SEDE_PRINCIPAL])
+
+        logging.info(f"Reconciliación completada en {time.time() - inicio:.2f} segundos.")
+
+    except Exception as e:
+        logging.error(f"Error durante la reconciliación: {str(e)}")
+
+if __name__ == "__main__":
+    reconciliar()
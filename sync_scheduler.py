@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+import time
+from functools import partial
+from itertools import islice
+
+from sqlalchemy.exc import InterfaceError, OperationalError
+from tqdm import tqdm
+
+from config import MAX_LOTES_PENDIENTES, REINTENTOS_LOTE, TAMANO_LOTE
+from sync_metricas import contar, fusionar_metricas, reiniciar_metricas
+
+# Errores tras los que se reintenta un lote: conexión caída o reiniciada, deadlock, tiempo de espera agotado
+ERRORES_TRANSITORIOS = (OperationalError, InterfaceError)
+
+def en_lotes(filas, tamano_lote=None):
+    """Agrupa cualquier iterable de filas en listas de hasta tamano_lote filas, sin materializarlo."""
+    tamano_lote = max(1, tamano_lote or TAMANO_LOTE)
+    iterador = iter(filas)
+    while True:
+        lote = list(islice(iterador, tamano_lote))
+        if not lote:
+            return
+        yield lote
+
+def _ejecutar_cronometrado(funcion, lote):
+    """
+    Corre en el worker: ejecuta la función sobre el lote y mide cuánto tardó. También devuelve las
+    métricas por etapa del lote, que el proceso principal suma a las de la corrida.
+    Un lote que falla por un error transitorio se reintenta hasta SYNC_REINTENTOS_LOTE veces: cada lote
+    se confirma en una sola transacción con UPSERT, así que repetirlo no duplica nada.
+    """
+    metricas = reiniciar_metricas()
+    inicio = time.perf_counter()
+    for intento in range(REINTENTOS_LOTE + 1):
+        try:
+            resultado = funcion(lote)
+            break
+        except ERRORES_TRANSITORIOS as e:
+            if intento == REINTENTOS_LOTE:
+                raise
+            contar("reintentos")
+            logging.warning(f"Error transitorio en un lote de {len(lote)} filas, se reintenta ({intento + 1}/{REINTENTOS_LOTE}): {str(e)}")
+            time.sleep(min(2 ** intento, 30))
+    return resultado, time.perf_counter() - inicio, len(lote), os.getpid(), metricas.a_dict()
+
+class EstadisticasLotes:
+    """Tiempos por lote devueltos por los workers, para ajustar el tamaño de lote."""
+
+    def __init__(self):
+        self.duraciones = []
+        self.filas = 0
+        self.tiempo_por_worker = {}
+
+    def registrar(self, duracion, filas, pid):
+        self.duraciones.append(duracion)
+        self.filas += filas
+        self.tiempo_por_worker[pid] = self.tiempo_por_worker.get(pid, 0.0) + duracion
+
+    def percentil(self, p):
+        ordenadas = sorted(self.duraciones)
+        return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p))]
+
+    def resumir(self):
+        """Escribe en el log los tiempos por lote."""
+        if not self.duraciones:
+            return
+        total = sum(self.duraciones)
+        logging.info(f"  Lotes procesados: {len(self.duraciones)} ({self.filas} filas, {len(self.tiempo_por_worker)} workers)")
+        logging.info(
+            f"  Tiempo por lote: p50 {self.percentil(0.5):.3f}s, p95 {self.percentil(0.95):.3f}s, "
+            f"máx {max(self.duraciones):.3f}s, {self.filas / total if total else 0:.0f} filas/s por worker"
+        )
+
+def ejecutar_lotes(pool, funcion, lotes, total_lotes=None, max_pendientes=None, descripcion="Procesando en paralelo", punto_control=None):
+    """
+    Reparte los lotes entre los workers del pool como tareas pequeñas e independientes: cada worker
+    toma el siguiente lote en cuanto termina el anterior. Como mucho hay max_pendientes lotes en vuelo,
+    de modo que el extractor no se adelanta a los escritores. Si un lote falla se deja de enviar
+    trabajo y se relanza el error al terminar los lotes en curso.
+    Con un PuntoControl se le informa cada lote enviado y confirmado, y se guarda al terminar.
+    Devuelve los resultados de cada lote (en orden de finalización) y sus estadísticas.
+    """
+    max_pendientes = max_pendientes or MAX_LOTES_PENDIENTES
+    semaforo = threading.BoundedSemaphore(max_pendientes)
+    estadisticas = EstadisticasLotes()
+    resultados = []
+    errores = []
+    progreso = tqdm(total=total_lotes, desc=descripcion, unit="lote")
+
+    def al_terminar(respuesta, numero):
+        resultado, duracion, filas, pid, metricas = respuesta
+        resultados.append(resultado)
+        estadisticas.registrar(duracion, filas, pid)
+        fusionar_metricas(metricas)
+        if punto_control is not None:
+            punto_control.confirmado(numero)
+        progreso.update(1)
+        semaforo.release()
+
+    def al_fallar(error):
+        errores.append(error)
+        semaforo.release()
+
+    tareas = []
+    try:
+        for numero, lote in enumerate(lotes):
+            semaforo.acquire()
+            if errores:
+                break
+            if punto_control is not None:
+                punto_control.enviado(numero, lote)
+            tareas.append(pool.apply_async(
+                _ejecutar_cronometrado,
+                (funcion, lote),
+                callback=partial(al_terminar, numero=numero),
+                error_callback=al_fallar,
+            ))
+        for tarea in tareas:
+            tarea.wait()
+    finally:
+        progreso.close()
+        if punto_control is not None:
+            punto_control.guardar()
+
+    if errores:
+        raise errores[0]
+
+    return resultados, estadisticas
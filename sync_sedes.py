@@ -0,0 +1,41 @@
+from collections import namedtuple
+
+from config import SEDES
+
+# Columnas de productos que guardan la existencia de un almacén
+COLUMNAS_STOCK = ("stock", "alm2", "alm3", "alm4", "alm5", "alm6")
+
+# Una sede del destino: de qué base fuente (None = FUENTE_URL) y de qué columna se lee su existencia
+Sede = namedtuple("Sede", ["codsede", "columna_stock", "fuente_url"])
+
+# La sede que se sincronizaba antes de existir el registro
+SEDE_PRINCIPAL = Sede(1, "stock", None)
+
+def _leer_sede(entrada):
+    codsede, _, destino = entrada.partition("=")
+    if not destino:
+        raise ValueError(f"Sede mal configurada (se espera codsede=columna o codsede=url): {entrada}")
+
+    fuente_url, columna_stock = None, destino.strip()
+    if "://" in destino:
+        fuente_url, _, columna_stock = destino.strip().partition("|")
+        columna_stock = columna_stock or "stock"
+
+    # La columna se interpola en el SQL: solo se admiten las de existencias conocidas
+    if columna_stock not in COLUMNAS_STOCK:
+        raise ValueError(f"Columna de stock no válida para la sede {codsede.strip()}: {columna_stock}")
+    return Sede(int(codsede), columna_stock, fuente_url)
+
+def cargar_sedes(texto=None):
+    """Registro de sedes a partir de SYNC_SEDES, en el orden configurado."""
+    sedes = [_leer_sede(entrada) for entrada in (texto or SEDES).split(",") if entrada.strip()]
+    if not sedes:
+        raise ValueError(f"La configuración no define ninguna sede: {texto or SEDES}")
+    codsedes = [sede.codsede for sede in sedes]
+    if len(set(codsedes)) != len(codsedes):
+        raise ValueError(f"Sede repetida en la configuración: {texto or SEDES}")
+    return sedes
+
+def clave_estado(sede):
+    """Clave del estado persistido de la sede; la sede 1 conserva la que ya usaban las existencias."""
+    return "existencias" if sede.codsede == SEDE_PRINCIPAL.codsede else f"existencias_sede_{sede.codsede}"
@@ -0,0 +1,201 @@
+import logging
+import re
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import DateTime, Integer
+
+from config import ARCHIVOS_SEMILLA, DESTINO_URL, FUENTE_URL, TAMANO_LOTE_ESCRITURA, configurar_logger
+from models.imagen_producto import ImagenProducto
+from models.producto_subcategoria import ProductoSubcategoria
+from sync_manager import SyncManager
+from sync_writer import escribir_upsert
+
+# Tablas que pueden aparecer en los archivos de semillas
+TABLAS_SEMILLA = {
+    tabla.name: tabla for tabla in (ImagenProducto.__table__, ProductoSubcategoria.__table__)
+}
+
+# Literales de cadena SQL completos: comillas duplicadas ('') o escapadas con barra (\')
+LITERAL_CADENA = re.compile(r"'(?:[^'\\]|\\.|'')*'", re.S)
+
+# Cabecera de un INSERT: tabla y lista de columnas, hasta VALUES
+CABECERA_INSERT = re.compile(
+    r"\s*insert\s+into\s+`?(\w+)`?\s*\(([^)]*)\)\s*values\s*", re.I
+)
+
+# Un valor de una tupla de VALUES seguido de su separador (',' o el ')' que la cierra)
+VALOR = re.compile(
+    r"\s*(?:'((?:[^'\\]|\\.|'')*)'|(NULL)|([-+]?\d+(?:\.\d+)?))\s*([,)])", re.I | re.S
+)
+
+# Escapes de MySQL dentro de las cadenas
+ESCAPES = {"n": "\n", "r": "\r", "t": "\t", "0": "\0", "Z": "\x1a"}
+
+def _desescapar(cadena):
+    return re.sub(r"\\(.)|''", lambda m: ESCAPES.get(m.group(1), m.group(1)) if m.group(1) else "'", cadena, flags=re.S)
+
+def leer_sentencias(ruta):
+    """
+    Lee un archivo SQL como flujo y devuelve sus sentencias una a una, sin el ';' final.
+    Una sentencia termina en la línea que acaba en ';' fuera de una cadena.
+    """
+    partes = []
+    with open(ruta, encoding="utf-8") as archivo:
+        for linea in archivo:
+            partes.append(linea)
+            fin = linea.rstrip()
+            if not fin.endswith(";"):
+                continue
+            sentencia = "".join(partes)
+            # Si al quitar las cadenas completas queda una comilla, el ';' está dentro de una cadena
+            if "'" in LITERAL_CADENA.sub("", sentencia):
+                continue
+            partes = []
+            yield sentencia.rstrip().rstrip(";").strip()
+    resto = "".join(partes).strip()
+    if resto:
+        yield resto
+
+def parsear_insert(sentencia):
+    """
+    Descompone un INSERT INTO tabla (columnas) VALUES (...), (...) en (tabla, columnas, filas),
+    con las filas como tuplas de valores de Python. Devuelve None si la sentencia no es un INSERT.
+    """
+    cabecera = CABECERA_INSERT.match(sentencia)
+    if not cabecera:
+        return None
+    tabla = cabecera.group(1)
+    columnas = [columna.strip().strip("`") for columna in cabecera.group(2).split(",")]
+
+    filas = []
+    posicion = cabecera.end()
+    while posicion < len(sentencia):
+        if sentencia[posicion] in " \t\r\n,":
+            posicion += 1
+            continue
+        if sentencia[posicion] != "(":
+            raise ValueError(f"VALUES mal formado en {tabla} cerca de: {sentencia[posicion:posicion + 40]!r}")
+        posicion += 1
+        fila = []
+        while True:
+            valor = VALOR.match(sentencia, posicion)
+            if not valor:
+                raise ValueError(f"Valor no reconocido en {tabla} cerca de: {sentencia[posicion:posicion + 40]!r}")
+            cadena, nulo, numero, separador = valor.groups()
+            if cadena is not None:
+                fila.append(_desescapar(cadena))
+            elif nulo:
+                fila.append(None)
+            else:
+                fila.append(Decimal(numero) if "." in numero else int(numero))
+            posicion = valor.end()
+            if separador == ")":
+                break
+        if len(fila) != len(columnas):
+            raise ValueError(f"Fila de {tabla} con {len(fila)} valores para {len(columnas)} columnas")
+        filas.append(tuple(fila))
+    return tabla, columnas, filas
+
+def _convertidores(tabla, columnas):
+    """
+    Funciones que llevan cada valor al tipo de su columna: en los archivos las claves y las
+    fechas vienen como cadenas ('2403', '2024-11-18 16:23:11'), y no todos los drivers las aceptan así.
+    """
+    convertidores = []
+    for nombre in columnas:
+        tipo = tabla.columns[nombre].type
+        if isinstance(tipo, DateTime):
+            convertidores.append(lambda valor: datetime.fromisoformat(valor) if isinstance(valor, str) else valor)
+        elif isinstance(tipo, Integer):
+            convertidores.append(lambda valor: int(valor) if isinstance(valor, str) else valor)
+        else:
+            convertidores.append(None)
+    return convertidores
+
+def cargar_archivo_semillas(session_destino, ruta, tamano_lote=None):
+    """
+    Carga un archivo de semillas agrupando sus INSERT de una fila en INSERT multi-fila de
+    tamano_lote filas, con un UPSERT (las filas ya existentes se actualizan) y un commit por lote.
+    Devuelve {tabla: filas cargadas}.
+    """
+    tamano_lote = tamano_lote or TAMANO_LOTE_ESCRITURA
+    # (tabla, columnas) -> filas pendientes de escribir; convertidores de tipo por (tabla, columnas)
+    pendientes = {}
+    convertidores = {}
+    totales = {}
+
+    def escribir(clave):
+        nombre_tabla, columnas = clave
+        tabla = TABLAS_SEMILLA[nombre_tabla]
+        claves = {columna.name for columna in tabla.primary_key.columns}
+        actualizar = [columna for columna in columnas if columna not in claves]
+        escribir_upsert(session_destino, tabla, pendientes[clave], actualizar, tamano_lote)
+        session_destino.commit()
+        pendientes[clave] = []
+
+    for sentencia in leer_sentencias(ruta):
+        insert = parsear_insert(sentencia)
+        if insert is None:
+            # USE base y similares: la base es la de DESTINO_URL
+            logging.debug(f"  Se omite la sentencia: {sentencia[:60]}")
+            continue
+        nombre_tabla, columnas, filas = insert
+        if nombre_tabla not in TABLAS_SEMILLA:
+            raise ValueError(f"Tabla de semillas desconocida en {ruta}: {nombre_tabla}")
+
+        clave = (nombre_tabla, tuple(columnas))
+        if clave not in pendientes:
+            pendientes[clave] = []
+            convertidores[clave] = _convertidores(TABLAS_SEMILLA[nombre_tabla], columnas)
+        lote = pendientes[clave]
+        for fila in filas:
+            lote.append({
+                columna: convertir(valor) if convertir else valor
+                for columna, valor, convertir in zip(columnas, fila, convertidores[clave])
+            })
+        totales[nombre_tabla] = totales.get(nombre_tabla, 0) + len(filas)
+        if len(lote) >= tamano_lote:
+            escribir(clave)
+
+    for clave, lote in list(pendientes.items()):
+        if lote:
+            escribir(clave)
+    return totales
+
+def cargar_semillas(rutas=None, generar_imagenes=False):
+    """
+    Carga en el destino los archivos de semillas del catálogo (SYNC_ARCHIVOS_SEMILLA) e informa
+    las filas por segundo de cada uno. Con generar_imagenes además crea la imagen principal de
+    los productos sincronizados que no tienen ninguna, con un solo INSERT ... SELECT en el destino.
+    """
+    inicio = time.time()
+    configurar_logger()
+
+    try:
+        sync_manager = SyncManager(FUENTE_URL, DESTINO_URL)
+        session_destino = sync_manager.iniciar_sesion_destino()
+
+        for ruta in ARCHIVOS_SEMILLA if rutas is None else rutas:
+            logging.info(f"Cargando semillas de {ruta}...")
+            inicio_archivo = time.time()
+            totales = cargar_archivo_semillas(session_destino, ruta)
+            duracion = time.time() - inicio_archivo
+            for tabla, filas in totales.items():
+                logging.info(f"  {tabla}: {filas} filas en {duracion:.2f} s ({filas / max(duracion, 1e-9):.0f} filas/s).")
+
+        if generar_imagenes:
+            inicio_imagenes = time.time()
+            creadas = sync_manager.insertar_imagenes_faltantes_destino(session_destino)
+            session_destino.commit()
+            logging.info(f"Imágenes generadas desde productos: {creadas} en {time.time() - inicio_imagenes:.2f} s.")
+
+        session_destino.close()
+        logging.info(f"Carga de semillas completada en {time.time() - inicio:.2f} segundos.")
+
+    except Exception as e:
+        logging.error(f"Error durante la carga de semillas: {str(e)}")
+
+if __name__ == "__main__":
+    cargar_semillas()
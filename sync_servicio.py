@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import datetime
+
+from config import INTERVALO_SERVICIO, SOCKET_SERVICIO, configurar_logger
+from sync_diff import IndiceHashes
+from sync_existencia import sincronizar_existencias
+from sync_products import sincronizar_productos
+from sync_sedes import cargar_sedes, clave_estado
+from sync_worker import crear_pool
+
+# Órdenes que acepta el socket del servicio, una por conexión
+COMANDOS_SERVICIO = ("sincronizar", "completa", "estado", "detener")
+
+class ServicioSync:
+    """
+    Proceso residente que corre micro-sincronizaciones incrementales de productos y existencias cada
+    intervalo segundos, o antes si se le pide por SIGUSR1 o por su socket. Entre ciclos conserva el pool
+    de workers (con sus engines), los engines del proceso principal y los índices de hashes del destino,
+    de modo que un ciclo solo paga la lectura de lo que cambió.
+    """
+
+    def __init__(self, intervalo=None, ruta_socket=None, sedes=None, simular_bajas=False):
+        self.intervalo = INTERVALO_SERVICIO if intervalo is None else intervalo
+        self.ruta_socket = SOCKET_SERVICIO if ruta_socket is None else ruta_socket
+        self.sedes = sedes or cargar_sedes()
+        self.simular_bajas = simular_bajas
+        self.indice_productos = IndiceHashes()
+        self.indices_existencias = {clave_estado(sede): IndiceHashes() for sede in self.sedes}
+        self.pool = None
+        self.ciclos = 0
+        self.ultimo_ciclo = None
+        self.en_curso = False
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._completa = False
+
+    def solicitar(self, completa=False):
+        """Pide un ciclo inmediato (completo si se indica) sin esperar al intervalo."""
+        self._completa = self._completa or completa
+        self._despertar.set()
+
+    def detener(self):
+        """Termina el servicio al acabar el ciclo en curso."""
+        self._detener.set()
+        self._despertar.set()
+
+    def estado(self):
+        return {
+            "ciclos": self.ciclos,
+            "en_curso": self.en_curso,
+            "ultimo_ciclo": self.ultimo_ciclo,
+            "intervalo": self.intervalo,
+            "indice_productos": len(self.indice_productos.hashes),
+            "indices_existencias": {clave: len(indice.hashes) for clave, indice in self.indices_existencias.items()},
+        }
+
+    def ciclo(self, completa=False):
+        """Una micro-sincronización: productos y luego existencias, reutilizando pool, engines e índices."""
+        inicio = time.time()
+        self.en_curso = True
+        try:
+            sincronizar_productos(
+                incremental=not completa, simular_bajas=self.simular_bajas, pool=self.pool, indice=self.indice_productos
+            )
+            sincronizar_existencias(
+                incremental=not completa,
+                sedes=self.sedes,
+                simular_bajas=self.simular_bajas,
+                pool=self.pool,
+                indices=self.indices_existencias,
+            )
+        finally:
+            self.en_curso = False
+        duracion = time.time() - inicio
+        self.ciclos += 1
+        self.ultimo_ciclo = {
+            "inicio": datetime.fromtimestamp(inicio).isoformat(timespec="seconds"),
+            "duracion": round(duracion, 3),
+            "completo": completa,
+        }
+        logging.info(f"Ciclo {self.ciclos} del servicio ({'completo' if completa else 'incremental'}) en {duracion:.2f} s.")
+
+    def _responder(self, conexion):
+        with conexion:
+            conexion.settimeout(5)
+            comando = conexion.makefile(encoding="utf-8").readline().strip().lower()
+            if comando not in COMANDOS_SERVICIO:
+                respuesta = {"error": f"Comando desconocido: {comando!r}", "comandos": list(COMANDOS_SERVICIO)}
+            elif comando == "estado":
+                respuesta = self.estado()
+            elif comando == "detener":
+                self.detener()
+                respuesta = {"ok": True}
+            else:
+                self.solicitar(completa=comando == "completa")
+                respuesta = {"ok": True, "en_curso": self.en_curso}
+            conexion.sendall((json.dumps(respuesta, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def _atender_socket(self, servidor):
+        """Hilo que atiende las órdenes que llegan por el socket local hasta que el servicio se detiene."""
+        while not self._detener.is_set():
+            try:
+                conexion, _ = servidor.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                # El socket se cerró al detener el servicio
+                return
+            try:
+                self._responder(conexion)
+            except (OSError, UnicodeDecodeError) as e:
+                logging.warning(f"Error atendiendo una orden del socket del servicio: {str(e)}")
+
+    def _abrir_socket(self):
+        if not self.ruta_socket:
+            return None
+        if not hasattr(socket, "AF_UNIX"):
+            logging.warning("Esta plataforma no tiene sockets Unix: el servicio solo atiende al intervalo y a las señales.")
+            return None
+        # Un socket que quedó de una ejecución anterior impediría el bind
+        if os.path.exists(self.ruta_socket):
+            os.remove(self.ruta_socket)
+        servidor = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        servidor.bind(self.ruta_socket)
+        servidor.listen()
+        servidor.settimeout(1)
+        threading.Thread(target=self._atender_socket, args=(servidor,), daemon=True).start()
+        return servidor
+
+    def _instalar_senales(self):
+        # Se instalan antes de crear el pool: los workers heredan estos manejadores en vez de morir con Ctrl+C
+        signal.signal(signal.SIGTERM, lambda *_: self.detener())
+        signal.signal(signal.SIGINT, lambda *_: self.detener())
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda *_: self.solicitar())
+        if hasattr(signal, "SIGUSR2"):
+            signal.signal(signal.SIGUSR2, lambda *_: self.solicitar(completa=True))
+
+    def ejecutar(self):
+        """Bucle del servicio: un ciclo al arrancar y luego uno por intervalo o por pedido, hasta detenerse."""
+        configurar_logger()
+        self._instalar_senales()
+        # El pool se crea antes de abrir ningún engine en este proceso, para que los workers no hereden conexiones
+        with crear_pool() as pool:
+            self.pool = pool
+            servidor = self._abrir_socket()
+            logging.info(
+                f"Servicio de sincronización iniciado (pid {os.getpid()}, cada {self.intervalo:.0f} s"
+                f"{f', socket {self.ruta_socket}' if servidor else ''})."
+            )
+            try:
+                while not self._detener.is_set():
+                    completa = self._completa
+                    self._completa = False
+                    # Lo que se pida durante el ciclo dispara el siguiente al terminar
+                    self._despertar.clear()
+                    self.ciclo(completa)
+                    self._despertar.wait(self.intervalo)
+            finally:
+                self._detener.set()
+                if servidor is not None:
+                    servidor.close()
+                    os.remove(self.ruta_socket)
+                self.pool = None
+        logging.info(f"Servicio de sincronización detenido tras {self.ciclos} ciclos.")
+
+def servir(intervalo=None, simular_bajas=False):
+    ServicioSync(intervalo, simular_bajas=simular_bajas).ejecutar()
+
+def enviar_comando(comando, ruta_socket=None):
+    """Envía una orden al servicio en ejecución por su socket y devuelve su respuesta."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as cliente:
+        cliente.settimeout(10)
+        cliente.connect(ruta_socket or SOCKET_SERVICIO)
+        cliente.sendall(f"{comando}\n".encode("utf-8"))
+        return json.loads(cliente.makefile(encoding="utf-8").readline())
+
+if __name__ == "__main__":
+    servir()
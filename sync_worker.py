@@ -0,0 +1,62 @@
+import threading
+from contextlib import nullcontext
+from multiprocessing import Pool
+
+from config import FUENTE_URL, DESTINO_URL, NUM_WORKERS
+from sync_manager import SyncManager
+
+# SyncManagers del proceso actual por URL de la base fuente; en los workers inicializar_worker
+# crea el principal una sola vez y los de otras fuentes (sedes remotas) se crean al usarse
+_sync_managers = {}
+_destino_url = DESTINO_URL
+
+# Las sedes corren en hilos del mismo proceso: sin el lock dos hilos podrían crear a la vez el
+# SyncManager de una fuente y uno de ellos quedaría con engines que nadie cierra
+_lock_sync_managers = threading.Lock()
+
+def _inicializar(fuente_url, destino_url):
+    """Cuerpo de inicializar_worker; quien lo llama ya tiene _lock_sync_managers."""
+    global _destino_url
+    _destino_url = destino_url
+    # Los SyncManagers heredados del proceso principal (p. ej. el servicio residente) usan sus conexiones
+    for sync_manager in _sync_managers.values():
+        sync_manager.cerrar(cerrar_conexiones=False)
+    _sync_managers.clear()
+    _sync_managers[None] = SyncManager(fuente_url, destino_url)
+
+def inicializar_worker(fuente_url=FUENTE_URL, destino_url=DESTINO_URL):
+    """Initializer del Pool: crea el SyncManager (y sus pools de conexiones) una vez por proceso."""
+    with _lock_sync_managers:
+        _inicializar(fuente_url, destino_url)
+
+def obtener_sync_manager(fuente_url=None):
+    """
+    Devuelve el SyncManager del proceso para la base fuente indicada (None = la principal),
+    creándolo si se llama fuera de un Pool o por primera vez para esa fuente. Todas las sedes
+    de una misma fuente comparten sus engines.
+    """
+    # Lectura sin lock en el caso habitual, en que ya existe; el principal siempre se crea primero
+    sync_manager = _sync_managers.get(fuente_url)
+    if sync_manager is not None:
+        return sync_manager
+    with _lock_sync_managers:
+        if None not in _sync_managers:
+            _inicializar(FUENTE_URL, DESTINO_URL)
+        if fuente_url not in _sync_managers:
+            _sync_managers[fuente_url] = SyncManager(fuente_url, _destino_url)
+        return _sync_managers[fuente_url]
+
+def crear_pool(procesos=None):
+    """Pool de procesos cuyos workers reutilizan sus engines entre chunks."""
+    return Pool(
+        processes=procesos or NUM_WORKERS,
+        initializer=inicializar_worker,
+        initargs=(FUENTE_URL, DESTINO_URL),
+    )
+
+def usar_pool(pool=None):
+    """
+    Contexto con el pool indicado, que no se cierra al salir (el del servicio residente, que conserva
+    sus workers entre ciclos), o con uno nuevo solo para esta ejecución.
+    """
+    return nullcontext(pool) if pool is not None else crear_pool()
@@ -0,0 +1,50 @@
+from sqlalchemy.dialects import mysql, sqlite
+
+from config import TAMANO_LOTE_ESCRITURA
+
+def construir_upsert(tabla, dialecto, columnas_actualizar):
+    """
+    Construye un INSERT que actualiza las columnas indicadas si la clave ya existe.
+    MySQL usa ON DUPLICATE KEY UPDATE y SQLite ON CONFLICT ... DO UPDATE. Sin columnas que
+    actualizar (tablas que son solo clave) las filas repetidas se ignoran.
+    """
+    if dialecto == "mysql":
+        insert = mysql.insert(tabla)
+        if not columnas_actualizar:
+            return insert.prefix_with("IGNORE")
+        return insert.on_duplicate_key_update({columna: insert.inserted[columna] for columna in columnas_actualizar})
+
+    if dialecto == "sqlite":
+        insert = sqlite.insert(tabla)
+        claves = [columna.name for columna in tabla.primary_key.columns]
+        if not columnas_actualizar:
+            return insert.on_conflict_do_nothing(index_elements=claves)
+        return insert.on_conflict_do_update(
+            index_elements=claves,
+            set_={columna: insert.excluded[columna] for columna in columnas_actualizar},
+        )
+
+    raise ValueError(f"Dialecto no soportado para UPSERT: {dialecto}")
+
+def escribir_upsert(session, tabla, filas, columnas_actualizar, tamano_lote=None):
+    """
+    Escribe las filas (diccionarios con las mismas claves) con INSERT multi-fila en lotes de tamano_lote.
+    Las filas nuevas se insertan y las existentes se actualizan en el mismo flujo de sentencias.
+    No hace commit: la transacción queda a cargo de quien llama.
+    """
+    tamano_lote = tamano_lote or TAMANO_LOTE_ESCRITURA
+    dialecto = session.get_bind().dialect.name
+    upsert = construir_upsert(tabla, dialecto, columnas_actualizar)
+
+    for inicio in range(0, len(filas), tamano_lote):
+        session.execute(upsert.values(filas[inicio:inicio + tamano_lote]))
+    return len(filas)
+
+async def escribir_upsert_async(conexion, tabla, filas, columnas_actualizar, tamano_lote=None):
+    """Igual que escribir_upsert, sobre una AsyncConnection de SQLAlchemy."""
+    tamano_lote = tamano_lote or TAMANO_LOTE_ESCRITURA
+    upsert = construir_upsert(tabla, conexion.dialect.name, columnas_actualizar)
+
+    for inicio in range(0, len(filas), tamano_lote):
+        await conexion.execute(upsert.values(filas[inicio:inicio + tamano_lote]))
+    return len(filas)
@@ -0,0 +1,70 @@
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from sync_huella import BACKENDS, Esquema, huella, huellas_lote
+
+Fila = namedtuple("Fila", ["codprod", "nombre", "precio", "fecha"])
+
+ESQUEMA = Esquema([("codprod", int), ("nombre", str), ("precio", 2), ("fecha", date)])
+
+# Filas de referencia: la misma con otra escala del decimal, una con nulos y un redondeo en .005
+FILAS = {
+    "base": Fila(7, "ÁGUA", Decimal("1.5"), date(2026, 1, 2)),
+    "escala": Fila(7, "ÁGUA", Decimal("1.500"), date(2026, 1, 2)),
+    "nulos": Fila(8, None, None, None),
+    "mitad": Fila(-3, "x", Decimal("2.345"), date(2000, 12, 31)),
+}
+
+# Huellas fijas por backend: si cambian, todas las guardadas en destino dejan de coincidir
+HUELLAS = {
+    "legacy": {
+        "base": "c6705b1ab3a03b653ae2aa14ca0049041142a24fcec11df382980ede1d9b0209",
+        "escala": "cfb4079925b831e8a7910e7598d0fca290679c1e7cd22119a819e47a56d4f5fa",
+        "nulos": "452983f0f47f01383564e1d2e727fa2cb7edd6ec2460e7cf3f72c16de4fcaf46",
+        "mitad": "a52cbc5fd08938428f7e3eef55b8a29b00b0d2409b1394ee8b92f5a34f067780",
+    },
+    "sha256": {
+        "base": "738d3e02e3573a7e9d8a23fa79a7407aadf8f4d358d3ac51fa3e5ccfb299427c",
+        "escala": "738d3e02e3573a7e9d8a23fa79a7407aadf8f4d358d3ac51fa3e5ccfb299427c",
+        "nulos": "c3246d69702a3ee07187adf1f93499dce7b166cff937b9d421c9f583783e7c7f",
+        "mitad": "e93604e4fb5a7aea77c209f76af563af82f1f93e54a0b86f98e69cf07228cf27",
+    },
+    "blake2b": {
+        "base": "242c76aa4831e898c504475a18d5e72d",
+        "escala": "242c76aa4831e898c504475a18d5e72d",
+        "nulos": "cdd42316a91d340a08f83574a14b81fc",
+        "mitad": "25e219d6d1f1f4250ae4981f8b02ba49",
+    },
+    "xxh3": {
+        "base": "1d30b8e71b8118f5cbc1e2da574d3577",
+        "escala": "1d30b8e71b8118f5cbc1e2da574d3577",
+        "nulos": "1177148c8bab0833b700a7289b9ac18c",
+        "mitad": "c4efe83ffe3e6be97b8d6f70bf586fdf",
+    },
+}
+
+def test_codificacion_canonica():
+    assert ESQUEMA.codificar(FILAS["base"]) == "i7\x1fsÁGUA\x1fd1.50\x1ft2026-01-02".encode("utf-8")
+    assert ESQUEMA.codificar(FILAS["escala"]) == ESQUEMA.codificar(FILAS["base"])
+    assert ESQUEMA.codificar(FILAS["nulos"]) == b"i8\x1fn\x1fn\x1fn"
+
+def test_codificacion_legacy():
+    assert ESQUEMA.codificar_legacy(FILAS["base"]) == "7ÁGUA1.52026-01-02".encode("utf-8")
+    assert ESQUEMA.codificar_legacy(FILAS["escala"]) == "7ÁGUA1.5002026-01-02".encode("utf-8")
+    assert ESQUEMA.codificar_legacy(FILAS["nulos"]) == b"8NoneNoneNone"
+
+@pytest.mark.parametrize("backend", sorted(HUELLAS))
+def test_huellas_fijas(backend):
+    if backend != "legacy" and backend not in BACKENDS:
+        pytest.skip(f"backend {backend} no disponible")
+    for nombre, fila in FILAS.items():
+        assert huella(fila, ESQUEMA, backend) == HUELLAS[backend][nombre], nombre
+    assert huellas_lote(list(FILAS.values()), ESQUEMA, backend) == [HUELLAS[backend][nombre] for nombre in FILAS]
+
+def test_esquema_de_un_campo():
+    esquema = Esquema([("codprod", int)])
+    assert esquema.codificar(FILAS["base"]) == b"i7"
+    assert esquema.codificar_legacy(FILAS["base"]) == b"7"
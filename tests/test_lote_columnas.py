@@ -0,0 +1,33 @@
+from collections import namedtuple
+
+from models import lote_columnas
+from models.lote_columnas import LoteColumnas
+
+Fila = namedtuple("Fila", ["codprod", "nombre"])
+
+def test_desde_filas_por_bloques(monkeypatch):
+    # Bloques de dos filas: el último queda incompleto
+    monkeypatch.setattr(lote_columnas, "FILAS_POR_BLOQUE", 2)
+    filas = [(codprod, f"p{codprod}") for codprod in range(5)]
+
+    lote = LoteColumnas.desde_filas(Fila._fields, iter(filas))
+
+    assert len(lote) == 5
+    assert lote.columna("codprod") == (0, 1, 2, 3, 4)
+    assert list(lote) == filas
+    assert list(lote.filas(Fila)) == [Fila(*fila) for fila in filas]
+    assert lote[3] == (3, "p3")
+
+def test_desde_filas_vacio():
+    lote = LoteColumnas.desde_filas(Fila._fields, [])
+
+    assert not lote
+    assert lote.columnas == ((), ())
+    assert list(lote) == []
+
+def test_concatenar():
+    lotes = [LoteColumnas.desde_filas(Fila._fields, filas) for filas in ([(1, "a")], [], [(2, "b"), (3, "c")])]
+
+    lote = LoteColumnas.concatenar(Fila._fields, lotes)
+
+    assert list(lote) == [(1, "a"), (2, "b"), (3, "c")]
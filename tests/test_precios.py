@@ -0,0 +1,110 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from models.existencia_origen import ExistenciaOrigen
+from sync_precios import calcular_existencia, dividir, porcentaje_iva, redondear
+
+HOY = date(2026, 10, 17)
+
+CONSTANTES = {
+    "fecha": HOY,
+    "tasa_cambio": Decimal("40.000"),
+    "iva": Decimal("16.00"),
+    "ivareducido": Decimal("8.00"),
+    "tasa3": Decimal("31.00"),
+}
+
+def fila(precio="100.00", tipoiva="NORMAL", encarte=0, inicio=None, final=None, desc_oferta="0.00", descuento=None):
+    """Fila cruda en el orden de CONSULTA_EXISTENCIAS_PLANA."""
+    return (
+        7, "PRODUCTO", Decimal(precio) if precio is not None else None, tipoiva, Decimal(encarte),
+        inicio or HOY - timedelta(days=10), final or HOY - timedelta(days=5), Decimal(desc_oferta),
+        3, Decimal("5.000"), "759000000007", "PACTIVO", "LINEA",
+        Decimal(descuento) if descuento is not None else None,
+    )
+
+def calcular(constantes=CONSTANTES, **campos):
+    return ExistenciaOrigen._make(calcular_existencia(fila(**campos), constantes))
+
+def test_sin_oferta_ni_descuento():
+    existencia = calcular()
+    assert existencia.precio_original == Decimal("100.00")
+    assert existencia.precio_final == Decimal("100.00")
+    assert existencia.precio_divisas_original == Decimal("2.50")
+    assert existencia.precio_divisas_final == Decimal("2.50")
+    assert existencia.preciomasiva == Decimal("116.00")
+    assert existencia.montoiva == Decimal("16.00")
+    assert existencia.tiene_descuento == "No"
+    assert existencia.precio_oferta is None
+    assert existencia.descuento_porcentual is None
+
+def test_oferta_vigente():
+    existencia = calcular(encarte=1, inicio=HOY - timedelta(days=1), final=HOY + timedelta(days=1), desc_oferta="80.00", descuento="10")
+    # La oferta manda sobre el descuento de la línea
+    assert existencia.precio_final == Decimal("80.00")
+    assert existencia.precio_oferta == Decimal("80.00")
+    assert existencia.descuento_porcentual == Decimal("20.00")
+    assert existencia.precio_divisas_final == Decimal("2.00")
+    assert existencia.montoiva == Decimal("36.00")
+    assert existencia.tiene_descuento == "Sí"
+
+def test_oferta_fuera_de_fechas_o_sin_encarte():
+    # inicio y final son exclusivos, como CURDATE() > inicio AND CURDATE() < final
+    for campos in (
+        {"encarte": 1, "inicio": HOY, "final": HOY + timedelta(days=1)},
+        {"encarte": 1, "inicio": HOY - timedelta(days=1), "final": HOY},
+        {"encarte": 0, "inicio": HOY - timedelta(days=1), "final": HOY + timedelta(days=1)},
+    ):
+        existencia = calcular(desc_oferta="80.00", **campos)
+        assert existencia.precio_final == Decimal("100.00")
+        assert existencia.precio_oferta is None
+        assert existencia.tiene_descuento == "No"
+
+def test_descuento_de_linea():
+    existencia = calcular(descuento="10.00")
+    assert existencia.precio_final == Decimal("90.00")
+    assert existencia.descuento_porcentual == Decimal("10.00")
+    assert existencia.tiene_descuento == "Sí"
+    # 99.99 * (1 - 0.12500) = 87.49125
+    assert calcular(precio="99.99", descuento="12.5").precio_final == Decimal("87.49")
+
+def test_tipos_de_iva():
+    esperados = {"NORMAL": "116.00", "REDUCIDO": "108.00", "TASA3": "131.00", "EXENTO": "100.00"}
+    for tipoiva, preciomasiva in esperados.items():
+        existencia = calcular(tipoiva=tipoiva)
+        assert existencia.poriva == porcentaje_iva(tipoiva, CONSTANTES)
+        assert existencia.preciomasiva == Decimal(preciomasiva)
+    assert calcular(tipoiva="EXENTO").poriva == 0
+
+def test_redondeo_mitad_lejos_de_cero():
+    assert redondear(Decimal("2.345")) == Decimal("2.35")
+    assert redondear(Decimal("-2.345")) == Decimal("-2.35")
+    assert redondear(Decimal("2.344")) == Decimal("2.34")
+    assert redondear(Decimal("0.0005"), 3) == Decimal("0.001")
+    # 1.00 / 8 = 0.125000 se redondea a 0.13 (no a 0.12 como el redondeo bancario)
+    existencia = calcular(precio="1.00", constantes={**CONSTANTES, "tasa_cambio": Decimal(8)})
+    assert existencia.precio_divisas_original == Decimal("0.13")
+
+def test_division_con_la_escala_de_mysql():
+    # Escala del dividendo más 4
+    assert dividir(Decimal("10.00"), Decimal(3)) == Decimal("3.333333")
+    assert dividir(Decimal("1"), Decimal(3)) == Decimal("0.3333")
+
+def test_tasa_nula_o_divisor_cero():
+    for tasa_cambio in (None, Decimal(0)):
+        existencia = calcular(constantes={**CONSTANTES, "tasa_cambio": tasa_cambio})
+        assert existencia.precio_divisas_original is None
+        assert existencia.precio_divisas_final is None
+        assert existencia.precio_final == Decimal("100.00")
+    assert dividir(None, Decimal(3)) is None
+    assert dividir(Decimal(3), None) is None
+    # Precio 0 en oferta: el porcentaje de descuento divide por cero y queda NULL
+    existencia = calcular(precio="0.00", encarte=1, inicio=HOY - timedelta(days=1), final=HOY + timedelta(days=1), desc_oferta="5.00")
+    assert existencia.descuento_porcentual is None
+
+def test_precio_nulo():
+    existencia = calcular(precio=None, descuento="10")
+    assert existencia.precio_original is None
+    assert existencia.precio_final is None
+    assert existencia.preciomasiva is None
+    assert existencia.montoiva is None
@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, select
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import Session
+
+from sync_writer import construir_upsert, escribir_upsert
+
+metadata = MetaData()
+
+productos = Table(
+    "productos",
+    metadata,
+    Column("codprod", Integer, primary_key=True),
+    Column("nombre", String(50)),
+    Column("hash", String(64)),
+)
+
+# Tabla que es solo clave, como las de relación
+imagenes = Table("imagenes", metadata, Column("codprod", Integer, primary_key=True))
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+def test_upsert_inserta_y_actualiza(session):
+    escribir_upsert(session, productos, [
+        {"codprod": 1, "nombre": "uno", "hash": "a"},
+        {"codprod": 2, "nombre": "dos", "hash": "b"},
+    ], ["hash"])
+    session.commit()
+
+    # Lotes de una fila: una actualización y una inserción en el mismo flujo
+    escrituras = escribir_upsert(session, productos, [
+        {"codprod": 2, "nombre": "DOS", "hash": "c"},
+        {"codprod": 3, "nombre": "tres", "hash": "d"},
+    ], ["hash"], tamano_lote=1)
+    session.commit()
+
+    assert escrituras == 2
+    filas = session.execute(select(productos).order_by(productos.c.codprod)).all()
+    # nombre no está entre las columnas a actualizar: conserva su valor
+    assert [tuple(fila) for fila in filas] == [(1, "uno", "a"), (2, "dos", "c"), (3, "tres", "d")]
+
+def test_upsert_sin_columnas_ignora_repetidas(session):
+    escribir_upsert(session, imagenes, [{"codprod": 1}, {"codprod": 2}], [])
+    escribir_upsert(session, imagenes, [{"codprod": 2}, {"codprod": 3}], [])
+    session.commit()
+
+    assert session.execute(select(imagenes.c.codprod).order_by(imagenes.c.codprod)).scalars().all() == [1, 2, 3]
+
+def test_upsert_mysql():
+    sql = str(construir_upsert(productos, "mysql", ["hash"]).compile(dialect=mysql.dialect()))
+    assert "ON DUPLICATE KEY UPDATE hash = VALUES(hash)" in sql
+    assert "nombre = " not in sql.split("ON DUPLICATE KEY UPDATE")[1]
+
+    sql = str(construir_upsert(imagenes, "mysql", []).compile(dialect=mysql.dialect()))
+    assert sql.startswith("INSERT IGNORE INTO imagenes")
+
+def test_upsert_dialecto_no_soportado():
+    with pytest.raises(ValueError):
+        construir_upsert(productos, "postgresql", ["hash"])